@@ -1,18 +1,438 @@
+import io
 import os
-import base64
-import shutil
+import asyncio
 import json
+import mimetypes
 import uuid
 import random
-from flask import Flask, render_template, request, jsonify
-from openai_service import OpenAIService
+import threading
+import re
+import time
+from flask import (
+    Flask,
+    Response,
+    g,
+    render_template,
+    request,
+    jsonify,
+    send_file,
+    send_from_directory,
+    stream_with_context,
+    url_for,
+)
+from flask.json.provider import DefaultJSONProvider
+from openai_service import OpenAIService, validate_num_slides
+from async_openai_service import AsyncOpenAIService
+from async_runtime import async_runtime
 from categories_service import categories_service
+from job_service import JobService, SLIDE_DONE, SLIDE_FAILED
+from job_queue import (
+    JOB_IMAGE,
+    JOB_STORY,
+    STATUS_DONE,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    JobQueue,
+)
+from worker import QueueWorker, enqueue_image, enqueue_story, enqueue_upgrade
+from zip_stream import stream_zip
+from story_pool import StoryPool
+from rate_limiter import openai_scheduler, slide_priority
+from session_images import save_session_image
+from avatar_service import (
+    AvatarError,
+    AVATAR_MAX_BYTES,
+    ingest_avatar,
+    read_avatar_bytes,
+)
+from resilience import CircuitOpenError
+from session_store import AVATAR_FILENAME, InvalidSessionError, create_session_store
+from session_sweeper import SessionSweeper
+from single_flight import SingleFlight, prompt_digest
+from story_schema import session_characters
+from image_tiers import (
+    TIER_DRAFT,
+    TIER_FINAL,
+    parse_tier,
+    read_image_tier,
+    slide_index,
+)
+from image_variants import ImageVariants, parse_variant, variant_filename
+from metrics import (
+    HTTP_IN_FLIGHT,
+    HTTP_REQUEST_SECONDS,
+    HTTP_RESPONSE_BYTES,
+    render_metrics,
+    time_stage,
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that records serialisation time of every JSON response"""
+
+    def dumps(self, obj, **kwargs):
+        with time_stage("json_encode"):
+            return super().dumps(obj, **kwargs)
+
+
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
+# Room for the avatar plus prompts/story fields in the same multipart body
+app.config["MAX_CONTENT_LENGTH"] = AVATAR_MAX_BYTES + 2 * 1024 * 1024
 openai_service = OpenAIService()
+async_openai_service = AsyncOpenAIService(openai_service)
+session_store = create_session_store()
+image_variants = ImageVariants(session_store)
+job_service = JobService(
+    async_openai_service, session_store, image_variants=image_variants
+)
+story_pool = StoryPool(openai_service, categories_service)
+story_pool.warm()
+job_queue = JobQueue()
+# Set to 0 when separate worker.py processes do the generation
+QUEUE_APP_WORKERS = int(os.getenv("QUEUE_APP_WORKERS", "4"))
+if QUEUE_APP_WORKERS > 0:
+    QueueWorker(
+        job_queue,
+        openai_service,
+        async_openai_service,
+        session_store,
+        image_variants=image_variants,
+        concurrency=QUEUE_APP_WORKERS,
+        story_pool=story_pool,
+    ).start()
+session_sweeper = SessionSweeper(
+    session_store,
+    protect=lambda: job_service.active_sessions() | job_queue.active_sessions(),
+)
+session_sweeper.start()
+story_flights = SingleFlight("story")
+image_flights = SingleFlight("image")
+
+
+SSE_HEARTBEAT_SECONDS = 15
+IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE", "3600"))
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or "unmatched"
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = g.pop("metrics_endpoint", None)
+    if endpoint is None:
+        return response
+    HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+    # Streaming responses are measured up to the headers, not the last byte
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - g.metrics_started,
+        endpoint=endpoint,
+        method=request.method,
+        status=response.status_code,
+    )
+    if response.content_length is not None:
+        HTTP_RESPONSE_BYTES.observe(response.content_length, endpoint=endpoint)
+    return response
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def wants_prompts():
+    """Prompts run to kilobytes and are only sent back when ?debug=1 asks"""
+    return request.args.get("debug") == "1"
+
+
+def request_tier(default=TIER_FINAL):
+    """
+    The image tier asked for with ?tier= or a "tier" form field
+
+    Raises:
+        ValueError: If the tier is unknown
+    """
+    return parse_tier(request.args.get("tier") or request.form.get("tier"), default)
+
+
+def client_story(story_data, include_prompts=False):
+    """A story as sent to clients, without its image prompts unless asked"""
+    if story_data is None or include_prompts:
+        return story_data
+    return {
+        **story_data,
+        "slides": [
+            {key: value for key, value in slide.items() if key != "image_prompt"}
+            for slide in story_data.get("slides", [])
+        ],
+    }
+
+
+async def generate_session_image(
+    session_id, filename, avatar_bytes, prompt, priority, tier=TIER_FINAL
+):
+    """
+    Generate an image into the session, joining an identical one in flight
+
+    The generation runs on the shared event loop, but a WSGI view awaiting
+    it still holds its worker thread until it is done; only the job paths
+    free the thread while images are generated.
+
+    A double-click or client retry for the same slide and prompt waits for
+    the generation already running instead of paying for a second one. The
+    session story's characters are added to the prompts that name them.
+
+    Returns:
+        The final image prompt sent to the API
+    """
+
+    async def generate_and_save():
+        characters = await asyncio.to_thread(
+            session_characters, session_store, session_id
+        )
+        image_base64, image_prompt = await async_openai_service.generate_image(
+            avatar_bytes,
+            prompt,
+            session_id=session_id,
+            priority=priority,
+            characters=characters,
+            tier=tier,
+        )
+        await asyncio.to_thread(
+            save_session_image,
+            session_store,
+            session_id,
+            filename,
+            image_base64,
+            tier,
+            image_variants,
+        )
+        return image_prompt
+
+    key = (session_id, filename, prompt_digest(prompt), tier)
+    return await async_runtime.run(image_flights.run(key, generate_and_save))
+
+
+def session_image_url(session_id, filename, version=None):
+    """Build a cache-busting URL for a file stored in the session"""
+    return url_for(
+        "get_session_file",
+        session_id=session_id,
+        filename=filename,
+        v=version or session_store.version(session_id, filename),
+    )
+
+
+def session_image_urls(session_id, filename):
+    """
+    URLs of a generated image and its small WebP variants
+
+    Pages show the preview and link to the full-size JPEG, which is only
+    fetched when opened or downloaded. Variants carry the version of the
+    full-size image, so they are refetched whenever it is regenerated.
+    """
+    version = session_store.version(session_id, filename)
+    return {
+        "image_url": session_image_url(session_id, filename, version),
+        "preview_url": session_image_url(
+            session_id, variant_filename(filename, "preview"), version
+        ),
+        "thumb_url": session_image_url(
+            session_id, variant_filename(filename, "thumb"), version
+        ),
+    }
+
+
+def avatar_thumb_url(session_id):
+    """URL of the thumbnail of a session's avatar"""
+    return session_image_urls(session_id, AVATAR_FILENAME)["thumb_url"]
+
+
+def session_job(session_id):
+    """
+    The job an event stream attaches to: ?job_id= if given, else the
+    session's running job
+
+    Event streams never start work, so an EventSource reconnecting does not
+    pay for the same images twice.
+    """
+    job_id = request.args.get("job_id")
+    job = job_service.get(job_id) if job_id else job_service.active_job(session_id)
+    if job is None or job.session_id != session_id:
+        return None
+    return job
+
+
+def job_event_response(job):
+    """Stream a job's story and image progress as Server-Sent Events"""
+    session_id = job.session_id
+    include_prompts = wants_prompts()
+
+    def stream():
+        yield sse_event(
+            "job",
+            {
+                "job_id": job.job_id,
+                "session_id": session_id,
+                "total_slides": job.total_slides if job.closed else None,
+            },
+        )
+
+        story_sent = False
+        story_slides_sent = 0
+        sent = set()
+        version = -1
+        while True:
+            new_version = job.wait_for_change(version, SSE_HEARTBEAT_SECONDS)
+            if new_version == version:
+                yield ": heartbeat\n\n"
+                continue
+            version = new_version
+
+            if not story_sent and "story_title" in job.meta:
+                story_sent = True
+                yield sse_event(
+                    "story",
+                    {
+                        "story_title": job.meta["story_title"],
+                        "category": job.meta.get("category"),
+                        "subcategory": job.meta.get("subcategory"),
+                    },
+                )
+
+            total = job.total_slides
+            for idx in range(story_slides_sent, total):
+                story_slide = job.get_slide(idx)["story_slide"]
+                if story_slide is not None and not include_prompts:
+                    story_slide = {
+                        key: value
+                        for key, value in story_slide.items()
+                        if key != "image_prompt"
+                    }
+                if story_slide is not None:
+                    yield sse_event("story_slide", {"index": idx, "slide": story_slide})
+            story_slides_sent = total
+
+            for idx in range(total):
+                slide = job.get_slide(idx)
+                if idx in sent or slide["status"] not in (SLIDE_DONE, SLIDE_FAILED):
+                    continue
+                sent.add(idx)
+                if slide["status"] == SLIDE_DONE:
+                    yield sse_event(
+                        "slide",
+                        {
+                            "success": True,
+                            **session_image_urls(session_id, slide["filename"]),
+                            "filename": slide["filename"],
+                            "prompt": slide["prompt"] if include_prompts else None,
+                            "index": idx,
+                        },
+                    )
+                else:
+                    yield sse_event(
+                        "slide",
+                        {"success": False, "error": slide["error"], "index": idx},
+                    )
+
+            status = job.to_dict()
+            yield sse_event(
+                "progress",
+                {
+                    "completed": status["completed"],
+                    "failed": status["failed"],
+                    "total_slides": total if job.closed else None,
+                },
+            )
+            if status["done"]:
+                if status["error"]:
+                    yield sse_event("error", {"error": status["error"]})
+                if "story" in job.meta:
+                    status["story"] = client_story(job.meta["story"], include_prompts)
+                    if include_prompts:
+                        status["base_prompt"] = job.meta.get("base_prompt")
+                yield sse_event("done", status)
+                return
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.errorhandler(InvalidSessionError)
+def handle_invalid_session(e):
+    return jsonify({"error": "Session not found"}), 404
+
+
+def pick_category_and_subcategory(selected_categories):
+    """Pick a category/subcategory, restricted to the user's selection if any"""
+    # Filter out empty strings from selected categories
+    selected_categories = [cat for cat in selected_categories if cat.strip()]
+    print(f"Selected categories: {selected_categories}")
+
+    if not selected_categories:
+        # Completely random selection from all categories
+        return categories_service.get_random_category_and_subcategory()
+
+    # Random selection from selected categories
+    selected_category = random.choice(selected_categories)
+
+    # Get all available subcategories for the selected category
+    all_categories = categories_service.get_all_categories()
+    if selected_category not in all_categories:
+        raise ValueError(f"Invalid category: {selected_category}")
+
+    available_subcategories = all_categories[selected_category]
+    return selected_category, random.choice(available_subcategories)
+
+
+def create_avatar_session(avatar_file, session_id=None):
+    """
+    Create a new session holding the normalised avatar, or add it to one
+
+    A failed upload only removes a session this call created; an existing
+    session keeps its files so the client can retry with another avatar.
+    """
+    created = session_id is None
+    session_id = session_id or str(uuid.uuid4())
+    try:
+        ingest_avatar(avatar_file, session_store, session_id)
+    except Exception:
+        if created:
+            session_store.delete(session_id)
+        raise
+    image_variants.schedule(session_id, AVATAR_FILENAME)
+    return session_id
+
+
+def load_session_prompts(session_id):
+    """Load the slide image prompts stored for a session, if any"""
+    prompts = session_store.read_json(session_id, "prompts.json")
+    if prompts is not None:
+        return prompts
+
+    story_data = session_store.read_json(session_id, "story.json")
+    if story_data is not None:
+        return [slide.get("image_prompt", "") for slide in story_data.get("slides", [])]
+
+    return None
+
+
+def session_slide_prompt(session_id, index):
+    """The stored image prompt of one zero-based slide, or None"""
+    prompts = load_session_prompts(session_id) or []
+    if 0 <= index < len(prompts):
+        return prompts[index]
+    return None
 
 
 @app.route("/")
@@ -30,6 +450,44 @@ def health_check():
     return jsonify({"status": "healthy"})
 
 
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(
+        {
+            "success": True,
+            "image_cache": openai_service.image_cache.stats(),
+            "story_pool": story_pool.stats(),
+            "sessions": session_sweeper.stats(),
+        }
+    )
+
+
+@app.route("/api/usage", methods=["GET"])
+def get_usage():
+    return jsonify({"success": True, "usage": openai_service.usage.stats()})
+
+
+@app.route("/api/scheduler/stats", methods=["GET"])
+def get_scheduler_stats():
+    return jsonify(
+        {
+            "success": True,
+            "scheduler": openai_scheduler.stats(),
+            "resilience": openai_service.resilience_stats(),
+            "queue": job_queue.stats(),
+            "dedup": {
+                "story": story_flights.stats(),
+                "image": image_flights.stats(),
+            },
+        }
+    )
+
+
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
     try:
@@ -40,82 +498,407 @@ def get_categories():
 
 
 @app.route("/api/generate-story", methods=["POST"])
-def generate_story():
+async def generate_story():
     try:
         data = request.json
         selected_categories = data.get("selected_categories", [])
-        num_slides = data.get("num_slides", 5)
 
-        # Filter out empty strings from selected categories
-        selected_categories = [cat for cat in selected_categories if cat.strip()]
-        print(f"Selected categories: {selected_categories}")
+        try:
+            num_slides = validate_num_slides(data.get("num_slides", 5))
+            category, subcategory = pick_category_and_subcategory(selected_categories)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        if selected_categories:
-            # Random selection from selected categories
-            selected_category = random.choice(selected_categories)
-
-            # Get all available subcategories for the selected category
-            all_categories = categories_service.get_all_categories()
-            if selected_category not in all_categories:
-                return jsonify({"error": f"Invalid category: {selected_category}"}), 400
-
-            available_subcategories = all_categories[selected_category]
-            selected_subcategory = random.choice(available_subcategories)
-
-            category = selected_category
-            subcategory = selected_subcategory
-        else:
-            # Completely random selection from all categories
-            category, subcategory = (
-                categories_service.get_random_category_and_subcategory()
+        async def pooled_or_generated():
+            print(
+                f"Using category: {category}, subcategory: {subcategory}, slides: {num_slides}"
             )
+            # Use a pre-generated story when one is pooled, otherwise generate it now
+            pooled = story_pool.take(category, subcategory, num_slides)
+            if pooled:
+                prompt, story_data = pooled
+            else:
+                prompt, story_data = await async_openai_service.generate_story(
+                    category, subcategory, num_slides
+                )
+            return prompt, story_data
 
-        print(
-            f"Using category: {category}, subcategory: {subcategory}, slides: {num_slides}"
+        # A repeated submit from the same client joins the story being written.
+        # Only the story is shared: clients behind one NAT or proxy share an
+        # address, so each request still gets a session of its own
+        key = (request.remote_addr, tuple(sorted(selected_categories)), num_slides)
+        prompt, story_data = await async_runtime.run(
+            story_flights.run(key, pooled_or_generated)
         )
-
-        # Generate the story and get the base prompt
-        prompt, story_data = openai_service.generate_story(
-            category, subcategory, num_slides
+        # Kept server-side so later calls only need the session id
+        session_id = str(uuid.uuid4())
+        await asyncio.to_thread(
+            session_store.write_json, session_id, "story.json", story_data
         )
-        print(prompt)
         print("Story generated successfully")
-        return jsonify({"success": True, "story": story_data, "base_prompt": prompt})
+        include_prompts = wants_prompts()
+        response = {
+            "success": True,
+            "session_id": session_id,
+            "story": client_story(story_data, include_prompts),
+        }
+        if include_prompts:
+            response["base_prompt"] = prompt
+        return jsonify(response)
+    except CircuitOpenError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"Error generating story: {str(e)}")
         print(f"Error details: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/generate-story-stream", methods=["POST"])
+def generate_story_stream():
+    try:
+        avatar_file = request.files.get("avatar")
+        if not avatar_file:
+            return jsonify({"error": "No avatar file uploaded"}), 400
+
+        selected_categories = json.loads(request.form.get("selected_categories", "[]"))
+        try:
+            num_slides = validate_num_slides(request.form.get("num_slides", 5))
+            tier = request_tier()
+            category, subcategory = pick_category_and_subcategory(selected_categories)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        session_id = create_avatar_session(avatar_file)
+        session_store.write_json(
+            session_id,
+            "story_request.json",
+            {
+                "category": category,
+                "subcategory": subcategory,
+                "num_slides": num_slides,
+                "tier": tier,
+            },
+        )
+
+        job = job_service.open_job(session_id, tier=tier)
+        threading.Thread(
+            target=run_story_stream,
+            args=(job, category, subcategory, num_slides),
+            daemon=True,
+        ).start()
+
+        return jsonify(
+            {
+                "success": True,
+                "session_id": session_id,
+                "job_id": job.job_id,
+                "avatar_thumb_url": avatar_thumb_url(session_id),
+                "category": category,
+                "subcategory": subcategory,
+                "num_slides": num_slides,
+                "tier": tier,
+            }
+        )
+    except AvatarError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def run_story_stream(job, category, subcategory, num_slides):
+    """Write the story slide by slide, starting each slide's image right away"""
+    avatar_bytes = read_avatar_bytes(session_store, job.session_id)
+    try:
+        for event, value in openai_service.generate_story_stream(
+            category, subcategory, num_slides, session_id=job.session_id
+        ):
+            if event == "title":
+                job.update_meta(
+                    story_title=value, category=category, subcategory=subcategory
+                )
+            elif event == "characters":
+                job.characters = value
+            elif event == "slide":
+                job_service.add_slide(
+                    job, avatar_bytes, value.get("image_prompt", ""), story_slide=value
+                )
+            elif event == "story":
+                prompt, story_data = value
+                session_store.write_json(job.session_id, "story.json", story_data)
+                job.update_meta(story=story_data, base_prompt=prompt)
+        job.close()
+    except Exception as e:
+        print(f"Error streaming story: {e}")
+        job.close(error=str(e))
+
+
+@app.route("/api/queue/story", methods=["POST"])
+def queue_story():
+    """Create a session and queue its story; images are queued slide by slide"""
+    try:
+        avatar_file = request.files.get("avatar")
+        if not avatar_file:
+            return jsonify({"error": "No avatar file uploaded"}), 400
+
+        selected_categories = json.loads(request.form.get("selected_categories", "[]"))
+        try:
+            num_slides = validate_num_slides(request.form.get("num_slides", 5))
+            tier = request_tier()
+            category, subcategory = pick_category_and_subcategory(selected_categories)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        session_id = create_avatar_session(avatar_file)
+        session_store.write_json(
+            session_id,
+            "story_request.json",
+            {
+                "category": category,
+                "subcategory": subcategory,
+                "num_slides": num_slides,
+                "tier": tier,
+            },
+        )
+        enqueue_story(job_queue, session_id, category, subcategory, num_slides, tier)
+
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "session_id": session_id,
+                    "avatar_thumb_url": avatar_thumb_url(session_id),
+                    "category": category,
+                    "subcategory": subcategory,
+                    "num_slides": num_slides,
+                    "tier": tier,
+                }
+            ),
+            202,
+        )
+    except AvatarError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def queue_missing_work(session_id):
+    """
+    Queue whatever a session still lacks: its story, or the slide images
+
+    Work already queued, running or done is left alone, so this is safe to
+    call on every reconnect.
+
+    Returns:
+        Number of jobs looked at
+    """
+    prompts = load_session_prompts(session_id)
+    if prompts is None:
+        story_request = session_store.read_json(session_id, "story_request.json")
+        if story_request is None:
+            return 0
+        enqueue_story(job_queue, session_id, **story_request)
+        return 1
+
+    story_request = session_store.read_json(session_id, "story_request.json") or {}
+    tier = story_request.get("tier", TIER_FINAL)
+    missing = 0
+    for index, prompt in enumerate(prompts):
+        if not session_store.exists(session_id, f"story_image_{index}.jpg"):
+            enqueue_image(job_queue, session_id, index, prompt, tier)
+            missing += 1
+    return missing
+
+
+@app.route("/api/queue/sessions/<session_id>/resume", methods=["POST"])
+def resume_session(session_id):
+    if not session_store.exists(session_id, AVATAR_FILENAME):
+        return jsonify({"error": "Session not found"}), 404
+    queued = queue_missing_work(session_id)
+    return jsonify({"success": True, "session_id": session_id, "queued": queued})
+
+
+@app.route("/api/sessions/<session_id>/finalize", methods=["POST"])
+def finalize_session(session_id):
+    """
+    Queue final-tier renders of a session's draft slide images
+
+    Takes an optional JSON body {"slides": [zero-based indexes]}; every draft
+    slide is upgraded if it is left out. Drafts stay visible until their
+    final image replaces them, and progress shows up in
+    GET /api/queue/sessions/<session_id>.
+    """
+    if not session_store.exists(session_id, AVATAR_FILENAME):
+        return jsonify({"error": "Session not found"}), 404
+
+    selected = (request.get_json(silent=True) or {}).get("slides")
+    if selected is not None and (
+        not isinstance(selected, list)
+        or not all(isinstance(index, int) for index in selected)
+    ):
+        return jsonify({"error": "slides must be a list of slide indexes"}), 400
+
+    prompts = load_session_prompts(session_id) or []
+    upgrading = {
+        job["payload"]["filename"]
+        for job in job_queue.session_jobs(session_id)
+        if job["payload"].get("upgrade")
+        and job["status"] in (STATUS_QUEUED, STATUS_RUNNING)
+    }
+    queued = []
+    for filename in session_store.list_files(session_id):
+        index = slide_index(filename)
+        if index is None or not 0 <= index < len(prompts):
+            continue
+        if selected is not None and index not in selected:
+            continue
+        # Already on its way; only slides queued by this call are reported
+        if filename in upgrading:
+            continue
+        if read_image_tier(session_store, session_id, filename) != TIER_DRAFT:
+            continue
+        enqueue_upgrade(
+            job_queue,
+            session_id,
+            index,
+            prompts[index],
+            filename,
+            session_store.version(session_id, filename),
+        )
+        queued.append(index)
+
+    return (
+        jsonify({"success": True, "session_id": session_id, "queued": sorted(queued)}),
+        202,
+    )
+
+
+@app.route("/api/queue/sessions/<session_id>", methods=["GET"])
+def get_queued_session(session_id):
+    """Everything generated for a session so far, for polling and reconnects"""
+    if not session_store.exists(session_id, AVATAR_FILENAME):
+        return jsonify({"error": "Session not found"}), 404
+
+    include_prompts = wants_prompts()
+    story_job = None
+    image_jobs = {}
+    upgrading = set()
+    for job in job_queue.session_jobs(session_id):
+        if job["kind"] == JOB_STORY:
+            story_job = job
+        elif job["payload"].get("upgrade"):
+            if job["status"] in (STATUS_QUEUED, STATUS_RUNNING):
+                upgrading.add(job["payload"]["index"])
+        elif job["kind"] == JOB_IMAGE:
+            image_jobs[job["payload"]["index"]] = job
+
+    story = session_store.read_json(session_id, "story.json")
+    story_complete = story is not None
+    if story is None:
+        story = session_store.read_json(session_id, "story_progress.json")
+    if story is not None:
+        prompts = [slide.get("image_prompt", "") for slide in story["slides"]]
+    else:
+        prompts = session_store.read_json(session_id, "prompts.json") or []
+
+    slides = []
+    for index, prompt in enumerate(prompts):
+        filename = f"story_image_{index}.jpg"
+        job = image_jobs.get(index)
+        if session_store.exists(session_id, filename):
+            result = (job or {}).get("result") or {}
+            slides.append(
+                {
+                    "index": index,
+                    "status": STATUS_DONE,
+                    "success": True,
+                    "prompt": result.get("prompt", prompt) if include_prompts else None,
+                    "filename": filename,
+                    "tier": read_image_tier(session_store, session_id, filename),
+                    "upgrading": index in upgrading,
+                    **session_image_urls(session_id, filename),
+                }
+            )
+        elif job is not None and job["status"] not in (STATUS_QUEUED, STATUS_RUNNING):
+            slides.append(
+                {
+                    "index": index,
+                    "status": job["status"],
+                    "success": False,
+                    "error": job["error"] or job["status"],
+                }
+            )
+        else:
+            slides.append(
+                {"index": index, "status": job["status"] if job else STATUS_QUEUED}
+            )
+
+    story_status = story_job["status"] if story_job else None
+    story_pending = story_status in (STATUS_QUEUED, STATUS_RUNNING)
+    return jsonify(
+        {
+            "success": True,
+            "session_id": session_id,
+            "story": client_story(story, include_prompts),
+            "story_complete": story_complete,
+            "story_status": story_status,
+            "story_error": story_job["error"] if story_job else None,
+            "base_prompt": (
+                ((story_job or {}).get("result") or {}).get("base_prompt")
+                if include_prompts
+                else None
+            ),
+            "slides": slides,
+            "completed": sum(1 for slide in slides if slide.get("success")),
+            "failed": sum(1 for slide in slides if slide.get("success") is False),
+            "upgrading": len(upgrading),
+            "done": not story_pending
+            and not upgrading
+            and all("success" in slide for slide in slides),
+        }
+    )
+
+
+@app.route("/api/generate-story-stream/<session_id>/events", methods=["GET"])
+def generate_story_stream_events(session_id):
+    job = session_job(session_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return job_event_response(job)
+
+
 @app.route("/api/generate-story-session", methods=["POST"])
 def generate_story_session():
     try:
         avatar_file = request.files.get("avatar")
+        # The session /api/generate-story created; posting the whole story
+        # back as story_data still works for older clients
+        session_id = request.form.get("session_id")
         story_data_json = request.form.get("story_data")
 
-        if not avatar_file or not story_data_json:
+        if not avatar_file or not (session_id or story_data_json):
             return jsonify({"error": "Missing avatar or story data"}), 400
 
-        story_data = json.loads(story_data_json)
-        session_id = str(uuid.uuid4())
-        output_dir = f"static/avatars/{session_id}"
-        os.makedirs(output_dir, exist_ok=True)
-
-        avatar_path = os.path.join(output_dir, "avatar.jpg")
-        avatar_file.save(avatar_path)
-
-        story_path = os.path.join(output_dir, "story.json")
-        with open(story_path, "w") as f:
-            json.dump(story_data, f)
+        if session_id:
+            story_data = session_store.read_json(session_id, "story.json")
+            if story_data is None:
+                return jsonify({"error": "Story not found"}), 404
+            create_avatar_session(avatar_file, session_id)
+        else:
+            story_data = json.loads(story_data_json)
+            session_id = create_avatar_session(avatar_file)
+            session_store.write_json(session_id, "story.json", story_data)
 
         return jsonify(
             {
                 "success": True,
                 "session_id": session_id,
-                "story": story_data,
+                "avatar_thumb_url": avatar_thumb_url(session_id),
+                "story": client_story(story_data, wants_prompts()),
                 "total_slides": len(story_data.get("slides", [])),
             }
         )
+    except AvatarError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -123,28 +906,43 @@ def generate_story_session():
 @app.route(
     "/api/generate-story-image/<session_id>/<int:slide_number>", methods=["POST"]
 )
-def generate_story_image(session_id, slide_number):
+async def generate_story_image(session_id, slide_number):
     try:
-        data = request.json
-        image_prompt = data.get("image_prompt")
-        story_text = data.get("story_text", "")
+        tier = request_tier()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        avatar_path = f"static/avatars/{session_id}/avatar.jpg"
-        if not os.path.exists(avatar_path):
+    try:
+        avatar_bytes = read_avatar_bytes(session_store, session_id)
+        if avatar_bytes is None:
             return jsonify({"error": "Avatar not found"}), 400
 
-        image_base64 = openai_service.generate_image(avatar_path, image_prompt)
+        image_prompt = session_slide_prompt(session_id, slide_number - 1)
+        if image_prompt is None:
+            return jsonify({"error": "Slide not found"}), 404
+
+        filename = f"story_slide_{slide_number}.jpg"
+        await generate_session_image(
+            session_id,
+            filename,
+            avatar_bytes,
+            image_prompt,
+            priority=slide_priority(slide_number - 1),
+            tier=tier,
+        )
 
         return jsonify(
             {
                 "success": True,
-                "image_base64": image_base64,
-                "filename": f"story_slide_{slide_number}.jpg",
+                **session_image_urls(session_id, filename),
+                "filename": filename,
                 "slide_number": slide_number,
-                "story_text": story_text,
-                "image_prompt": image_prompt,
+                "tier": tier,
+                "image_prompt": image_prompt if wants_prompts() else None,
             }
         )
+    except CircuitOpenError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -167,81 +965,253 @@ def generate_images_stream():
         if not prompts:
             return jsonify({"error": "No prompts provided"}), 400
 
-        session_id = str(uuid.uuid4())
-        output_dir = f"static/avatars/{session_id}"
-        os.makedirs(output_dir, exist_ok=True)
+        session_id = create_avatar_session(avatar_file)
+        session_store.write_json(session_id, "prompts.json", prompts)
 
-        avatar_path = os.path.join(output_dir, "avatar.jpg")
-        avatar_file.save(avatar_path)
+        # Optional full story from the story page, kept for the download
+        story_data_json = request.form.get("story_data")
+        if story_data_json:
+            session_store.write_json(
+                session_id, "story.json", json.loads(story_data_json)
+            )
 
         return jsonify(
             {
                 "session_id": session_id,
+                "avatar_thumb_url": avatar_thumb_url(session_id),
                 "total_prompts": len(prompts),
-                "prompts": prompts,
             }
         )
+    except AvatarError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/generate-stream/<session_id>/events", methods=["GET"])
+def generate_images_events(session_id):
+    job = session_job(session_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return job_event_response(job)
+
+
 @app.route("/generate-single/<session_id>/<int:idx>", methods=["POST"])
-def generate_single_image(session_id, idx):
+async def generate_single_image(session_id, idx):
     try:
-        prompt = request.json.get("prompt")
+        tier = request_tier()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        prompt = session_slide_prompt(session_id, idx)
         if not prompt:
-            return jsonify({"error": "No prompt provided"}), 400
+            return jsonify({"error": "No prompt found for slide"}), 404
 
-        avatar_path = f"static/avatars/{session_id}/avatar.jpg"
-        if not os.path.exists(avatar_path):
+        avatar_bytes = read_avatar_bytes(session_store, session_id)
+        if avatar_bytes is None:
             return jsonify({"error": "Avatar not found"}), 400
 
-        image_base64, updated_image_prompt = openai_service.generate_image(
-            avatar_path, prompt
+        filename = f"story_image_{idx}.jpg"
+        updated_image_prompt = await generate_session_image(
+            session_id,
+            filename,
+            avatar_bytes,
+            prompt,
+            priority=slide_priority(idx),
+            tier=tier,
         )
 
         return jsonify(
             {
                 "success": True,
-                "image_base64": image_base64,
-                "filename": f"story_image_{idx}.jpg",
-                "prompt": updated_image_prompt,
+                **session_image_urls(session_id, filename),
+                "filename": filename,
+                "prompt": updated_image_prompt if wants_prompts() else None,
                 "index": idx,
+                "tier": tier,
             }
         )
+    except CircuitOpenError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/get-avatar/<session_id>", methods=["GET"])
-def get_avatar(session_id):
+@app.route("/api/generate-all/<session_id>", methods=["POST"])
+def generate_all_images(session_id):
     try:
-        avatar_path = f"static/avatars/{session_id}/avatar.jpg"
-        if not os.path.exists(avatar_path):
+        tier = request_tier()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        avatar_bytes = read_avatar_bytes(session_store, session_id)
+        if avatar_bytes is None:
             return jsonify({"error": "Avatar not found"}), 400
 
-        with open(avatar_path, "rb") as avatar_file:
-            avatar_base64 = base64.b64encode(avatar_file.read()).decode("utf-8")
+        prompts = load_session_prompts(session_id)
+        if not prompts:
+            return jsonify({"error": "No prompts found for session"}), 400
 
-        return jsonify(
-            {"success": True, "avatar_base64": avatar_base64, "filename": "avatar.jpg"}
+        # A repeated request joins the images already being generated
+        job = job_service.active_job(session_id) or job_service.submit(
+            session_id,
+            avatar_bytes,
+            prompts,
+            characters=session_characters(session_store, session_id),
+            tier=tier,
+        )
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "job_id": job.job_id,
+                    "session_id": session_id,
+                    "total_slides": job.total_slides,
+                    "tier": job.tier,
+                }
+            ),
+            202,
         )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    job = job_service.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+
+@app.route("/api/jobs/<job_id>/slides/<int:idx>", methods=["GET"])
+def get_job_slide(job_id, idx):
+    job = job_service.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    slide = job.get_slide(idx)
+    if not slide:
+        return jsonify({"error": "Slide not found"}), 404
+    if slide["status"] == SLIDE_FAILED:
+        return jsonify({"error": slide["error"], "index": idx}), 500
+    if slide["status"] != SLIDE_DONE:
+        return jsonify({"success": False, "status": slide["status"], "index": idx}), 202
+
+    return jsonify(
+        {
+            "success": True,
+            **session_image_urls(job.session_id, slide["filename"]),
+            "filename": slide["filename"],
+            "prompt": slide["prompt"] if wants_prompts() else None,
+            "index": idx,
+        }
+    )
+
+
+@app.route("/get-avatar/<session_id>", methods=["GET"])
+def get_avatar(session_id):
+    try:
+        if not session_store.exists(session_id, AVATAR_FILENAME):
+            return jsonify({"error": "Avatar not found"}), 400
+
+        return get_session_file(session_id, AVATAR_FILENAME)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/sessions/<session_id>/<filename>", methods=["GET"])
+def get_session_file(session_id, filename):
+    if parse_variant(filename) and not image_variants.ensure(session_id, filename):
+        return jsonify({"error": "File not found"}), 404
+
+    path = session_store.local_path(session_id, filename)
+    if path is not None:
+        return send_from_directory(
+            os.path.abspath(os.path.dirname(path)),
+            filename,
+            conditional=True,
+            max_age=IMAGE_MAX_AGE,
+        )
+
+    version = session_store.version(session_id, filename)
+    data = session_store.read(session_id, filename)
+    if data is None:
+        return jsonify({"error": "File not found"}), 404
+    return send_file(
+        io.BytesIO(data),
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        etag=f"{session_id}-{filename}-{version}",
+        last_modified=version / 1e9,
+        conditional=True,
+        max_age=IMAGE_MAX_AGE,
+    )
+
+
+def format_story_text(story_data):
+    """Render a story as plain text for the download archive"""
+    story_text = f"{story_data.get('story_title', '')}\n"
+    story_text += f"Category: {story_data.get('category', '').replace('_', ' ')}\n"
+    story_text += f"Theme: {story_data.get('subcategory', '').replace('_', ' ')}\n\n"
+    for slide in story_data.get("slides", []):
+        story_text += f"Slide {slide.get('slide_number')}\n"
+        story_text += f"{slide.get('story_text', '')}\n\n"
+    return story_text
+
+
+@app.route("/download/<session_id>", methods=["GET"])
+def download_session(session_id):
+    filenames = session_store.list_files(session_id)
+    if not filenames:
+        return jsonify({"error": "Session not found"}), 404
+
+    download_name = f"story_{session_id}.zip"
+    story_json = session_store.read(session_id, "story.json")
+    story_data = json.loads(story_json) if story_json is not None else None
+    if story_data and story_data.get("story_title"):
+        title = re.sub(r"[^a-zA-Z0-9]", "_", story_data["story_title"])
+        download_name = f"{title}_story.zip"
+
+    def entries():
+        # Read lazily so only one image is held in memory at a time
+        if story_data is not None:
+            yield "story.txt", format_story_text(story_data).encode("utf-8")
+            yield "story.json", story_json
+        for filename in filenames:
+            if filename.endswith(".jpg"):
+                path = session_store.local_path(session_id, filename)
+                yield filename, path or session_store.read(session_id, filename)
+
+    cleanup = request.args.get("cleanup") == "1"
+
+    def stream():
+        yield from stream_zip(entries())
+        if cleanup:
+            job_queue.cancel_session(session_id)
+            session_store.delete(session_id)
+
+    return Response(
+        stream(),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{download_name}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
 @app.route("/cleanup/<session_id>", methods=["POST"])
 def cleanup_session(session_id):
     try:
-        avatar_dir = f"static/avatars/{session_id}"
-        if os.path.exists(avatar_dir):
-            shutil.rmtree(avatar_dir)
+        job_queue.cancel_session(session_id)
+        session_store.delete(session_id)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
-    os.makedirs("static/avatars", exist_ok=True)
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port, debug=True)
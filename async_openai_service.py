@@ -0,0 +1,142 @@
+import os
+import asyncio
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from image_tiers import TIER_FINAL
+from metrics import track_upstream
+from openai_service import undecodable_response, validate_num_slides
+from rate_limiter import (
+    CALL_IMAGE,
+    CALL_REQUEST,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    openai_scheduler,
+)
+
+load_dotenv()
+
+
+class AsyncOpenAIService:
+    def __init__(self, openai_service):
+        """
+        Asyncio variant of OpenAIService built on the async OpenAI client
+
+        Prompt templates, the image cache, usage accounting and the resilient
+        callers are shared with the synchronous service so both paths stay
+        consistent and trip the same circuit breakers.
+
+        Args:
+            openai_service: The synchronous service to share state with
+        """
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.sync_service = openai_service
+
+    async def _complete_story(self, params, call, session_id, priority):
+        """Run one story completion with retries and return the decoded JSON"""
+        service = self.sync_service
+
+        async def attempt(timeout):
+            await openai_scheduler.acquire(CALL_REQUEST, session_id, priority)
+            with track_upstream(call):
+                return await self.client.chat.completions.create(
+                    **params, timeout=timeout
+                )
+
+        response = await service.story_callers[call].acall(attempt)
+        service.usage.record("story", response.usage)
+
+        response_text = response.choices[0].message.content
+        return service.parse_story_response(response_text)
+
+    async def _try_complete_story(self, call, params, session_id, priority):
+        """Like _complete_story, but None for a response that cannot be decoded"""
+        try:
+            return await self._complete_story(params, call, session_id, priority)
+        except ValueError as e:
+            return undecodable_response(call, e)
+
+    async def _run_story_steps(self, steps, session_id, priority):
+        """Drive a plan of the sync service, running each batch concurrently"""
+        try:
+            batch = next(steps)
+            while True:
+                responses = await asyncio.gather(
+                    *(
+                        self._try_complete_story(call, params, session_id, priority)
+                        for call, params in batch
+                    )
+                )
+                batch = steps.send(list(responses))
+        except StopIteration as done:
+            return done.value
+
+    async def repair_story(
+        self,
+        category,
+        subcategory,
+        num_slides,
+        story,
+        missing,
+        session_id=None,
+        priority=PRIORITY_INTERACTIVE,
+        outline=None,
+    ):
+        """Regenerate only the missing or invalid slides, like the sync service"""
+        return await self._run_story_steps(
+            self.sync_service.repair_steps(
+                category, subcategory, num_slides, story, missing, outline
+            ),
+            session_id,
+            priority,
+        )
+
+    async def generate_story(
+        self,
+        category,
+        subcategory,
+        num_slides,
+        session_id=None,
+        priority=PRIORITY_INTERACTIVE,
+    ):
+        """Generate story using OpenAI without blocking a thread"""
+        num_slides = validate_num_slides(num_slides)
+        return await self._run_story_steps(
+            self.sync_service.story_steps(category, subcategory, num_slides),
+            session_id,
+            priority,
+        )
+
+    async def generate_image(
+        self,
+        avatar_bytes,
+        prompt,
+        session_id=None,
+        priority=PRIORITY_NORMAL,
+        characters=None,
+        tier=TIER_FINAL,
+    ):
+        """
+        Generate a slide image; raises on failure like the sync service
+
+        Cache reads and writes and the base64 encoding of multi-megabyte images
+        run on a worker thread, so they never stall the shared event loop.
+        """
+        service = self.sync_service
+        image_request = await asyncio.to_thread(
+            service.prepare_image_request, avatar_bytes, prompt, characters, tier
+        )
+        if image_request["cached_base64"] is not None:
+            return image_request["cached_base64"], image_request["image_prompt"]
+
+        params = service.image_edit_params(image_request)
+
+        async def attempt(timeout):
+            await openai_scheduler.acquire(CALL_IMAGE, session_id, priority)
+            with track_upstream("image"):
+                return await self.client.images.edit(**params, timeout=timeout)
+
+        result = await service.image_caller.acall(attempt)
+        image_base64 = await asyncio.to_thread(
+            service.finish_image_request, image_request, result
+        )
+        return image_base64, image_request["image_prompt"]
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    def __init__(self):
+        """
+        A single long-lived event loop running in a background thread
+
+        All async OpenAI calls in the process run here, so each in-flight
+        generation costs a coroutine rather than a thread, and the async HTTP
+        client keeps one connection pool bound to one loop.
+        """
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self.loop.run_forever, name="async-runtime", daemon=True
+            )
+            self._thread.start()
+            logger.info("Async runtime started")
+
+    def submit(self, coro: Awaitable) -> Future:
+        """
+        Schedule a coroutine on the shared loop from any thread
+
+        Args:
+            coro: Coroutine to run
+
+        Returns:
+            A concurrent.futures.Future for its result
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run(self, coro: Awaitable):
+        """
+        Await a coroutine on the shared loop from a different event loop
+
+        Flask runs each async view in its own short-lived loop; this hands the
+        actual work to the shared loop and waits for it without blocking.
+
+        Args:
+            coro: Coroutine to run
+
+        Returns:
+            The coroutine's result
+        """
+        return await asyncio.wrap_future(self.submit(coro))
+
+
+# Global instance for easy access
+async_runtime = AsyncRuntime()
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import logging
+from functools import lru_cache
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from metrics import PAYLOAD_BYTES, time_stage
+from session_store import AVATAR_FILENAME
+
+logger = logging.getLogger(__name__)
+
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(20 * 1024 * 1024)))
+AVATAR_MAX_SIDE = int(os.getenv("AVATAR_MAX_SIDE", "1024"))
+AVATAR_JPEG_QUALITY = int(os.getenv("AVATAR_JPEG_QUALITY", "90"))
+CHUNK_SIZE = 64 * 1024
+
+
+class AvatarError(ValueError):
+    """Raised when an uploaded avatar is too large or not a readable image"""
+
+
+def read_limited(stream, limit: int = AVATAR_MAX_BYTES) -> bytes:
+    """
+    Read an upload stream in chunks, refusing anything over the size limit
+
+    Args:
+        stream: Readable binary stream
+        limit: Maximum number of bytes accepted
+
+    Returns:
+        The uploaded bytes
+    """
+    buffer = BytesIO()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > limit:
+            raise AvatarError(f"Avatar exceeds the {limit} byte upload limit")
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def normalize_avatar_bytes(data: bytes) -> bytes:
+    """
+    Decode an avatar once and re-encode it compactly for the edit endpoint
+
+    Applies the EXIF orientation, drops all metadata, flattens transparency
+    onto white and downsizes so the longest side is at most AVATAR_MAX_SIDE.
+
+    Args:
+        data: Raw uploaded image bytes in any format Pillow can read
+
+    Returns:
+        JPEG bytes of the normalised avatar
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((AVATAR_MAX_SIDE, AVATAR_MAX_SIDE), Image.LANCZOS)
+
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=AVATAR_JPEG_QUALITY)
+            return output.getvalue()
+    except (UnidentifiedImageError, OSError) as e:
+        raise AvatarError(f"Avatar is not a readable image: {e}")
+
+
+def ingest_avatar(file_storage, store, session_id: str) -> str:
+    """
+    Stream an uploaded avatar into a session in normalised form
+
+    Writes avatar.jpg and avatar.sha256 (content hash of the stored bytes).
+
+    Args:
+        file_storage: The uploaded file from request.files
+        store: Session store to keep the avatar in
+        session_id: Session the avatar belongs to
+
+    Returns:
+        Hex SHA-256 digest of the stored avatar
+    """
+    raw = read_limited(file_storage.stream)
+    PAYLOAD_BYTES.observe(len(raw), kind="avatar_upload")
+    with time_stage("avatar_normalize"):
+        avatar_bytes = normalize_avatar_bytes(raw)
+    digest = hashlib.sha256(avatar_bytes).hexdigest()
+
+    store.write(session_id, AVATAR_FILENAME, avatar_bytes)
+    store.write(session_id, "avatar.sha256", digest.encode("ascii"))
+
+    logger.info(
+        f"Ingested avatar {digest[:12]}: {len(raw)} bytes -> {len(avatar_bytes)} bytes"
+    )
+    return digest
+
+
+@lru_cache(maxsize=int(os.getenv("AVATAR_MEMORY_CACHE_SIZE", "64")))
+def _load_avatar(store, session_id: str, version: int) -> Optional[bytes]:
+    return store.read(session_id, AVATAR_FILENAME)
+
+
+def read_avatar_bytes(store, session_id: str) -> Optional[bytes]:
+    """
+    Get a session avatar's bytes, reading them from the store once per version
+
+    Args:
+        store: Session store holding the avatar
+        session_id: The session
+
+    Returns:
+        The avatar bytes, shared by every slide of the session, or None if
+        the session has no avatar
+    """
+    version = store.version(session_id, AVATAR_FILENAME)
+    if version is None:
+        return None
+    return _load_avatar(store, session_id, version)
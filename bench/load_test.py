@@ -0,0 +1,426 @@
+"""
+Load test for the story app against the local mock OpenAI server
+
+Starts bench/mock_openai.py and the app (unless --app-url points at a running
+one), then replays the full user flow at increasing concurrency:
+
+    categories -> generate-story -> create session -> start images
+        -> stream N slides -> zip
+
+and reports p50/p95/p99 latency, errors and peak app memory per endpoint, plus
+throughput per concurrency level.
+
+    python bench/load_test.py --concurrency 1,4,16 --flows 3 --slides 5
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def rss_mib(pid):
+    """Resident set size of a process in MiB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+    for name, value in fields.items():
+        body.write(f"--{boundary}\r\n".encode())
+        body.write(f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+        body.write(str(value).encode("utf-8") + b"\r\n")
+    for name, filename, data in files:
+        body.write(f"--{boundary}\r\n".encode())
+        body.write(
+            f'Content-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\nContent-Type: image/jpeg\r\n\r\n'.encode()
+        )
+        body.write(data + b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+class Recorder:
+    def __init__(self, pid=None):
+        """Collect per-endpoint latencies, errors and app memory samples"""
+        self.pid = pid
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.peak_rss = defaultdict(float)
+        self.rss = rss_mib(pid) if pid else None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def sample_memory(self, interval=0.1):
+        while not self._stop.is_set():
+            if self.pid:
+                self.rss = rss_mib(self.pid)
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+            if self.rss is not None:
+                self.peak_rss[endpoint] = max(self.peak_rss[endpoint], self.rss)
+
+
+class Client:
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def request(self, endpoint, method, path, body=None, content_type=None, read=None):
+        """
+        Time one request from sending it until the body has been read
+
+        Args:
+            endpoint: Label the latency is reported under
+            read: Optional function consuming the response instead of read()
+        """
+        headers = {"Content-Type": content_type} if content_type else {}
+        req = urllib.request.Request(
+            self.base_url + path, data=body, method=method, headers=headers
+        )
+        started = time.perf_counter()
+        ok = False
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                result = read(response) if read else response.read()
+            ok = True
+            return result
+        except urllib.error.HTTPError as e:
+            e.read()
+            return None
+        except (urllib.error.URLError, OSError):
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - started, ok)
+
+    def json(self, endpoint, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        data = self.request(
+            endpoint,
+            method,
+            path,
+            body,
+            "application/json" if body is not None else None,
+        )
+        return json.loads(data) if data else None
+
+
+def read_events(recorder, started):
+    """Consume an SSE stream until "done", recording time to the first slide"""
+
+    def read(response):
+        event = None
+        slides = 0
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "slide":
+                if slides == 0:
+                    recorder.record(
+                        "slides (first image)", time.perf_counter() - started, True
+                    )
+                if json.loads(line[6:]).get("success"):
+                    slides += 1
+            elif line.startswith("data: ") and event == "done":
+                return slides
+        return slides
+
+    return read
+
+
+def run_flow(client, avatar, num_slides):
+    """One user: pick categories, write a story, render it and download it"""
+    recorder = client.recorder
+    categories = client.json("categories", "GET", "/api/categories")
+    selected = []
+    if categories and categories.get("categories"):
+        selected = [random.choice(list(categories["categories"]))]
+
+    story = client.json(
+        "generate-story",
+        "POST",
+        "/api/generate-story",
+        {"selected_categories": selected, "num_slides": num_slides},
+    )
+    if not story or "story" not in story:
+        return 0
+
+    # The story and its prompts stay on the server; only the id goes back
+    fields = {"session_id": story["session_id"]}
+    body, content_type = multipart(fields, [("avatar", "avatar.jpg", avatar)])
+    session = client.request(
+        "create-session", "POST", "/api/generate-story-session", body, content_type
+    )
+    if not session:
+        return 0
+    session_id = json.loads(session)["session_id"]
+
+    # Start the image job, then attach to its event stream as the pages do
+    started = time.perf_counter()
+    job = client.json("generate-all", "POST", f"/api/generate-all/{session_id}")
+    if not job or "job_id" not in job:
+        return 0
+    generated = client.request(
+        "slides (all images)",
+        "GET",
+        f"/generate-stream/{session_id}/events?job_id={job['job_id']}",
+        read=read_events(recorder, started),
+    )
+    client.request("download-zip", "GET", f"/download/{session_id}?cleanup=1")
+    return generated or 0
+
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args, workdir):
+    """Start the mock API and the app, returning (processes, app url, app pid)"""
+    mock = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(REPO_ROOT, "bench", "mock_openai.py"),
+            "--port",
+            str(args.mock_port),
+            "--story-latency",
+            str(args.story_latency),
+            "--image-latency",
+            str(args.image_latency),
+            "--latency-sigma",
+            str(args.latency_sigma),
+            "--error-rate",
+            str(args.error_rate),
+            "--rate-limit-rate",
+            str(args.rate_limit_rate),
+            "--image-side",
+            str(args.image_side),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="mock",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.mock_port}/v1",
+        SESSIONS_ROOT=os.path.join(workdir, "sessions"),
+        SESSION_DB=os.path.join(workdir, "sessions.sqlite3"),
+        IMAGE_CACHE_DIR=os.path.join(workdir, "image-cache"),
+        RATE_LIMIT_DB=os.path.join(workdir, "rate_limits.sqlite3"),
+        QUEUE_DB=os.path.join(workdir, "jobs.sqlite3"),
+    )
+    if not args.use_cache:
+        # Every flow should reach the (mock) API, as distinct real users would
+        env["IMAGE_CACHE_MAX_BYTES"] = "0"
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "flask",
+            "--app",
+            "app",
+            "run",
+            "--port",
+            str(args.app_port),
+            "--no-reload",
+            "--no-debugger",
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    wait_for(f"http://127.0.0.1:{args.mock_port}/stats")
+    wait_for(f"{app_url}/health")
+    return [app, mock], app_url, app.pid
+
+
+def make_avatar(path=None):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    output = BytesIO()
+    Image.effect_noise((1024, 1024), 64).convert("RGB").save(output, format="JPEG")
+    return output.getvalue()
+
+
+def run_level(base_url, pid, concurrency, flows, num_slides, avatar, timeout):
+    recorder = Recorder(pid)
+    sampler = threading.Thread(target=recorder.sample_memory, daemon=True)
+    sampler.start()
+    client = Client(base_url, recorder, timeout)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        generated = list(
+            pool.map(
+                lambda _: run_flow(client, avatar, num_slides),
+                range(concurrency * flows),
+            )
+        )
+    elapsed = time.perf_counter() - started
+    recorder.stop()
+
+    endpoints = {}
+    for endpoint, values in recorder.latencies.items():
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": recorder.errors[endpoint],
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "peak_rss_mib": recorder.peak_rss.get(endpoint),
+        }
+    return {
+        "concurrency": concurrency,
+        "flows": len(generated),
+        "seconds": elapsed,
+        "flows_per_second": len(generated) / elapsed,
+        "images_per_second": sum(generated) / elapsed,
+        "images": sum(generated),
+        "endpoints": endpoints,
+    }
+
+
+def print_level(result):
+    print(
+        f"\n== concurrency {result['concurrency']}: {result['flows']} flows in "
+        f"{result['seconds']:.1f}s, {result['flows_per_second']:.2f} flows/s, "
+        f"{result['images_per_second']:.2f} images/s"
+    )
+    print(
+        f"{'endpoint':<22}{'reqs':>6}{'errs':>6}{'p50 s':>9}{'p95 s':>9}"
+        f"{'p99 s':>9}{'peak RSS MiB':>14}"
+    )
+    for endpoint, stats in result["endpoints"].items():
+        rss = stats["peak_rss_mib"]
+        print(
+            f"{endpoint:<22}{stats['requests']:>6}{stats['errors']:>6}"
+            f"{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}"
+            f"{(f'{rss:.0f}' if rss else '-'):>14}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--app-url", help="benchmark an already running app instead of starting one"
+    )
+    parser.add_argument("--app-pid", type=int, help="pid of --app-url, for memory")
+    parser.add_argument("--app-port", type=int, default=8200)
+    parser.add_argument("--mock-port", type=int, default=8100)
+    parser.add_argument(
+        "--concurrency",
+        default="1,2,4,8",
+        help="comma-separated numbers of concurrent users, run in turn",
+    )
+    parser.add_argument(
+        "--flows", type=int, default=2, help="flows per user at each level"
+    )
+    parser.add_argument("--slides", type=int, default=5)
+    parser.add_argument("--avatar", help="avatar image (default: generated noise)")
+    parser.add_argument("--story-latency", type=float, default=2.0)
+    parser.add_argument("--image-latency", type=float, default=5.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--image-side", type=int, default=0)
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="keep the image cache enabled (off by default so every image is generated)",
+    )
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show app logs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    avatar = make_avatar(args.avatar)
+    workdir = tempfile.mkdtemp(prefix="storyteller-bench-")
+    processes = []
+    try:
+        if args.app_url:
+            base_url, pid = args.app_url, args.app_pid
+        else:
+            processes, base_url, pid = start_servers(args, workdir)
+
+        results = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            result = run_level(
+                base_url,
+                pid,
+                concurrency,
+                args.flows,
+                args.slides,
+                avatar,
+                args.timeout,
+            )
+            print_level(result)
+            results.append(result)
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
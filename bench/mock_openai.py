@@ -0,0 +1,307 @@
+"""
+Local stand-in for the OpenAI chat-completions and images-edit APIs
+
+Serves just enough of the API for the app to run end to end without spending
+money: story completions (plain and streamed) and image edits returning a JPEG
+of the requested size, faster at lower quality. Latency is drawn from a log-normal distribution and a
+share of calls can be failed with 429/500 responses.
+
+Run it and point the app at it:
+
+    python bench/mock_openai.py --port 8100 --story-latency 3 --image-latency 8
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python app.py
+"""
+
+import re
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from io import BytesIO
+
+from flask import Flask, Response, jsonify, request
+from PIL import Image
+
+app = Flask(__name__)
+config = argparse.Namespace(
+    story_latency=2.0,
+    image_latency=5.0,
+    latency_sigma=0.4,
+    error_rate=0.0,
+    rate_limit_rate=0.0,
+    image_side=1024,
+    image_quality=85,
+    stream_chunk_delay=0.01,
+    slide_defect_rate=0.0,
+)
+counters = {"chat": 0, "images": 0, "errors": 0}
+# Share of the image latency and output tokens of a square image at each quality
+IMAGE_QUALITY_COST = {
+    "low": (0.25, 272),
+    "medium": (0.5, 1056),
+    "high": (1.0, 4160),
+    "auto": (1.0, 4160),
+}
+counters_lock = threading.Lock()
+_image_cache = {}
+
+
+def _count(name):
+    with counters_lock:
+        counters[name] += 1
+
+
+def _sleep(median):
+    """Sleep for a log-normally distributed time with the given median"""
+    if median > 0:
+        time.sleep(random.lognormvariate(0, config.latency_sigma) * median)
+
+
+def _injected_error():
+    roll = random.random()
+    if roll < config.rate_limit_rate:
+        status, message = 429, "Rate limit reached (mock)"
+    elif roll < config.rate_limit_rate + config.error_rate:
+        status, message = 500, "Internal server error (mock)"
+    else:
+        return None
+    _count("errors")
+    return (
+        jsonify({"error": {"message": message, "type": "mock_error", "code": None}}),
+        status,
+    )
+
+
+def _jpeg_base64(side):
+    # Noise compresses like a real illustration would, plain colours do not
+    if side not in _image_cache:
+        image = Image.effect_noise((side, side), 64).convert("RGB")
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=config.image_quality)
+        _image_cache[side] = base64.b64encode(output.getvalue()).decode("ascii")
+    return _image_cache[side]
+
+
+def _story(messages):
+    text = "\n".join(str(message.get("content", "")) for message in messages)
+    match = re.search(r"Number of slides/scenes:\s*(\d+)", text)
+    num_slides = int(match.group(1)) if match else 5
+    category = re.search(r"Category:\s*(\S+)", text)
+    subcategory = re.search(r"Subcategory:\s*(\S+)", text)
+    story = {
+        "story_title": f"Mock story {random.randint(1000, 9999)}",
+        "category": category.group(1) if category else "mock",
+        "subcategory": subcategory.group(1) if subcategory else "mock",
+        "characters": [
+            {
+                "name": "Zed",
+                "description": "A small green robot with round blue eyes and a red antenna",
+            }
+        ],
+    }
+    part = re.search(r"Write only slides (\d+) to (\d+)", text)
+    if '"beats"' in text and not part:
+        # Outline call of a two-phase story
+        story["beats"] = [
+            {"slide_number": number, "beat": f"Beat {number} of the mock story"}
+            for number in range(1, num_slides + 1)
+        ]
+        return story
+    numbers = range(1, num_slides + 1)
+    if part:
+        numbers = range(int(part.group(1)), int(part.group(2)) + 1)
+    story["slides"] = [
+        {
+            "slide_number": number,
+            "story_text": f"Slide {number} of the mock story. " * 3,
+            "image_prompt": (
+                f"Medium shot of the character on slide {number}, smiling, "
+                "holding career-specific tools in a bright workshop while Zed helps"
+            ),
+        }
+        for number in numbers
+    ]
+    for slide in list(story["slides"]):
+        # Dropped or blank slides, as a model sometimes writes them
+        if random.random() < config.slide_defect_rate:
+            if random.random() < 0.5:
+                story["slides"].remove(slide)
+            else:
+                slide["image_prompt"] = ""
+    return story
+
+
+def _usage(prompt_text, completion_text):
+    prompt_tokens = len(prompt_text) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(completion_text) // 4,
+        "total_tokens": prompt_tokens + len(completion_text) // 4,
+        "prompt_tokens_details": {"cached_tokens": prompt_tokens // 2},
+    }
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    _count("chat")
+    body = request.get_json()
+    error = _injected_error()
+    if error:
+        _sleep(config.story_latency / 4)
+        return error
+
+    content = json.dumps(_story(body.get("messages", [])), indent=2)
+    usage = _usage(json.dumps(body.get("messages", [])), content)
+    created = int(time.time())
+
+    if not body.get("stream"):
+        _sleep(config.story_latency)
+        return jsonify(
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    def chunk(delta, finish_reason=None, usage_block=None):
+        data = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": body.get("model"),
+            "choices": (
+                []
+                if usage_block
+                else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            ),
+        }
+        if usage_block:
+            data["usage"] = usage_block
+        return f"data: {json.dumps(data)}\n\n"
+
+    def stream():
+        # Time to first token, then the rest spread over the chunks
+        _sleep(config.story_latency / 4)
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(content), 40):
+            time.sleep(config.stream_chunk_delay)
+            yield chunk({"content": content[start : start + 40]})
+        yield chunk({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk({}, usage_block=usage)
+        yield "data: [DONE]\n\n"
+
+    return Response(stream(), mimetype="text/event-stream")
+
+
+@app.route("/v1/images/edits", methods=["POST"])
+def images_edits():
+    _count("images")
+    error = _injected_error()
+    if error:
+        _sleep(config.image_latency / 4)
+        return error
+
+    latency_share, output_tokens = IMAGE_QUALITY_COST.get(
+        request.form.get("quality", "auto"), IMAGE_QUALITY_COST["auto"]
+    )
+    _sleep(config.image_latency * latency_share)
+    size = request.form.get("size", "1024x1024")
+    side = config.image_side or int(size.split("x")[0])
+    prompt = request.form.get("prompt", "")
+    return jsonify(
+        {
+            "created": int(time.time()),
+            "data": [{"b64_json": _jpeg_base64(side)}],
+            "usage": {
+                "input_tokens": len(prompt) // 4 + 323,
+                "input_tokens_details": {"text_tokens": len(prompt) // 4},
+                "output_tokens": output_tokens,
+                "total_tokens": len(prompt) // 4 + 323 + output_tokens,
+            },
+        }
+    )
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    with counters_lock:
+        return jsonify(dict(counters))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--story-latency",
+        type=float,
+        default=config.story_latency,
+        help="median seconds per story completion",
+    )
+    parser.add_argument(
+        "--image-latency",
+        type=float,
+        default=config.image_latency,
+        help="median seconds per image edit",
+    )
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=config.latency_sigma,
+        help="log-normal sigma; 0 makes latency constant",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=config.error_rate,
+        help="share of calls failed with HTTP 500",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=config.rate_limit_rate,
+        help="share of calls failed with HTTP 429",
+    )
+    parser.add_argument(
+        "--image-side",
+        type=int,
+        default=0,
+        help="side of returned images in pixels (default: the requested size)",
+    )
+    parser.add_argument("--image-quality", type=int, default=config.image_quality)
+    parser.add_argument(
+        "--slide-defect-rate",
+        type=float,
+        default=config.slide_defect_rate,
+        help="share of story slides left out or returned with an empty image prompt",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for name, value in vars(args).items():
+        if hasattr(config, name):
+            setattr(config, name, value)
+    print(
+        f"Mock OpenAI listening on http://{args.host}:{args.port}/v1", file=sys.stderr
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
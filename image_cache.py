@@ -0,0 +1,186 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    def __init__(
+        self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None
+    ):
+        """
+        Initialize a disk-backed, content-addressed cache of generated images
+
+        Entries are evicted least-recently-used first once the total size
+        exceeds max_bytes. Recency survives restarts through file mtimes.
+
+        Args:
+            cache_dir: Directory holding cached images (defaults to the
+                IMAGE_CACHE_DIR environment variable, or "cache/images")
+            max_bytes: Size cap in bytes, 0 disables the cache (defaults to the
+                IMAGE_CACHE_MAX_BYTES environment variable, or 1 GiB)
+        """
+        self.cache_dir = cache_dir or os.getenv("IMAGE_CACHE_DIR", "cache/images")
+        if max_bytes is None:
+            max_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024**3)))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._load_index()
+        logger.info(
+            f"Image cache initialized at {self.cache_dir} with {len(self._entries)} entries"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(
+        avatar_bytes: bytes,
+        prompt: str,
+        model: str,
+        size: str,
+        output_format: str,
+        options: Optional[Dict] = None,
+    ) -> str:
+        """
+        Build the cache key for one image request
+
+        Args:
+            avatar_bytes: The exact reference image bytes sent to the API
+            prompt: The final wrapped prompt sent to the API
+            model: Image model name
+            size: Requested image size
+            output_format: Requested output format
+            options: Any further request parameters, e.g. quality
+
+        Returns:
+            Hex SHA-256 digest identifying the request
+        """
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(avatar_bytes).digest())
+        parts = [prompt, model, size, output_format]
+        # Left out when empty so keys of plain requests stay the same
+        parts += [f"{name}={value}" for name, value in sorted((options or {}).items())]
+        for part in parts:
+            digest.update(b"\0")
+            digest.update(part.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Fetch a cached image and mark it as recently used
+
+        Args:
+            key: Key returned by make_key
+
+        Returns:
+            The image bytes, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self.total_bytes -= size
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key not in self._entries:
+                self._entries[key] = len(data)
+                self.total_bytes += len(data)
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """
+        Store an image, evicting least-recently-used entries if over the cap
+
+        Args:
+            key: Key returned by make_key
+            data: The image bytes
+        """
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous
+            self._entries[key] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def stats(self) -> Dict:
+        """
+        Get cache counters
+
+        Returns:
+            Dictionary with hits, misses, hit rate, evictions and size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.bin")
+
+    def _evict(self):
+        # Caller holds self._lock
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self):
+        found = []
+        if os.path.isdir(self.cache_dir):
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".bin"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
@@ -0,0 +1,107 @@
+"""
+Image quality tiers
+
+Slides can be rendered at the quick, cheap draft tier first so the whole story
+can be reviewed fast, then upgraded to the final tier (see
+POST /api/sessions/<session_id>/finalize). The tier each session image was
+rendered at is kept next to it in the session.
+"""
+
+import os
+import re
+from typing import Dict, Optional
+
+TIER_DRAFT = "draft"
+TIER_FINAL = "final"
+
+# "auto" quality and full JPEG quality are what the API does when not asked
+IMAGE_TIERS = {
+    TIER_DRAFT: {
+        "quality": os.getenv("IMAGE_DRAFT_QUALITY", "low"),
+        "output_compression": int(os.getenv("IMAGE_DRAFT_COMPRESSION", "70")),
+    },
+    TIER_FINAL: {
+        "quality": os.getenv("IMAGE_FINAL_QUALITY", "auto"),
+        "output_compression": int(os.getenv("IMAGE_FINAL_COMPRESSION", "100")),
+    },
+}
+
+SLIDE_IMAGE_PATTERN = re.compile(r"^story_(?P<kind>image|slide)_(?P<number>\d+)\.jpg$")
+
+
+def parse_tier(value: Optional[str], default: str = TIER_FINAL) -> str:
+    """
+    Check a requested tier name
+
+    Args:
+        value: Tier from the request, or None/empty for the default
+        default: Tier used when none is given
+
+    Returns:
+        The tier name
+
+    Raises:
+        ValueError: If the tier is unknown
+    """
+    if not value:
+        return default
+    if value not in IMAGE_TIERS:
+        raise ValueError(f"Unknown image tier: {value}")
+    return value
+
+
+def tier_params(tier: str) -> Dict:
+    """
+    Image API parameters of a tier that differ from the API defaults
+
+    Returns:
+        Extra keyword arguments for images.edit, empty for the defaults
+    """
+    settings = IMAGE_TIERS[tier]
+    params = {}
+    if settings["quality"] != "auto":
+        params["quality"] = settings["quality"]
+    if settings["output_compression"] < 100:
+        params["output_compression"] = settings["output_compression"]
+    return params
+
+
+def tier_filename(filename: str) -> str:
+    """story_image_0.jpg -> story_image_0.tier.json"""
+    return f"{os.path.splitext(filename)[0]}.tier.json"
+
+
+def write_image_tier(session_store, session_id: str, filename: str, tier: str):
+    """Record the tier a session image was just rendered at"""
+    session_store.write_json(session_id, tier_filename(filename), {"tier": tier})
+
+
+def read_image_tier(session_store, session_id: str, filename: str) -> Optional[str]:
+    """
+    The tier a session image was rendered at
+
+    Returns:
+        The tier, TIER_FINAL for images from before tiers were recorded, or
+        None if the image does not exist
+    """
+    if not session_store.exists(session_id, filename):
+        return None
+    recorded = session_store.read_json(session_id, tier_filename(filename)) or {}
+    return recorded.get("tier", TIER_FINAL)
+
+
+def slide_index(filename: str) -> Optional[int]:
+    """
+    Zero-based slide index of a session slide image
+
+    story_image_<index>.jpg comes from the gallery and queue flows,
+    story_slide_<number>.jpg from the story page's per-slide endpoint.
+
+    Returns:
+        The index, or None if the file is not a slide image
+    """
+    match = SLIDE_IMAGE_PATTERN.match(filename)
+    if not match:
+        return None
+    number = int(match.group("number"))
+    return number if match.group("kind") == "image" else number - 1
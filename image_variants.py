@@ -0,0 +1,158 @@
+import os
+import re
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from metrics import PAYLOAD_BYTES, time_stage
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels, largest first
+VARIANT_SIDES = {
+    "preview": int(os.getenv("IMAGE_PREVIEW_SIDE", "512")),
+    "thumb": int(os.getenv("IMAGE_THUMB_SIDE", "192")),
+}
+VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+VARIANT_PATTERN = re.compile(r"^(?P<stem>.+)\.(?P<variant>preview|thumb)\.webp$")
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    """story_image_0.jpg -> story_image_0.preview.webp"""
+    return f"{os.path.splitext(filename)[0]}.{variant}.webp"
+
+
+def parse_variant(filename: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a variant file name into its source image and variant
+
+    Returns:
+        (source file name, variant name), or None if it is not a variant
+    """
+    match = VARIANT_PATTERN.match(filename)
+    if not match:
+        return None
+    return f"{match.group('stem')}.jpg", match.group("variant")
+
+
+def render_variants(data: bytes) -> Dict[str, bytes]:
+    """
+    Downscale a JPEG into every WebP variant with a single decode
+
+    The JPEG is decoded at a reduced DCT scale just large enough for the
+    biggest variant, and each smaller variant is resized from the previous one.
+
+    Args:
+        data: JPEG bytes of the full-size image
+
+    Returns:
+        Variant name -> WebP bytes
+    """
+    variants = {}
+    with Image.open(BytesIO(data)) as image:
+        largest = max(VARIANT_SIDES.values())
+        image.draft("RGB", (largest, largest))
+        image = image.convert("RGB")
+        for variant, side in VARIANT_SIDES.items():
+            image.thumbnail((side, side), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, format="WEBP", quality=VARIANT_QUALITY, method=4)
+            variants[variant] = output.getvalue()
+    return variants
+
+
+class ImageVariants:
+    def __init__(self, store, max_workers: Optional[int] = None):
+        """
+        Produce small WebP previews and thumbnails of session images
+
+        Generation runs on a small thread pool so request threads and the
+        async runtime never spend time in Pillow. A request for a variant
+        still being rendered waits for it instead of rendering it twice.
+
+        Args:
+            store: Session store the source images and variants live in
+            max_workers: Rendering threads (defaults to the IMAGE_VARIANT_WORKERS
+                environment variable, or 2)
+        """
+        self.store = store
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("IMAGE_VARIANT_WORKERS", "2")),
+            thread_name_prefix="image-variants",
+        )
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, session_id: str, filename: str) -> Future:
+        """
+        Render the variants of a session image in the background
+
+        Args:
+            session_id: The session
+            filename: The full-size JPEG, e.g. story_image_0.jpg
+
+        Returns:
+            Future resolving once the variants are stored
+        """
+        key = (session_id, filename)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(self._render, session_id, filename)
+            self._pending[key] = future
+        # Outside the lock: a finished future runs the callback right here
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def ensure(self, session_id: str, name: str, timeout: float = 30) -> bool:
+        """
+        Make sure a variant exists, rendering it now if it was never scheduled
+
+        Args:
+            session_id: The session
+            name: Variant file name, e.g. story_image_0.thumb.webp
+            timeout: Maximum seconds to wait for the rendering
+
+        Returns:
+            True if an up-to-date variant is stored, False if there is no
+                source image
+        """
+        parsed = parse_variant(name)
+        if parsed is None:
+            return False
+        source_version = self.store.version(session_id, parsed[0])
+        if source_version is None:
+            return False
+        version = self.store.version(session_id, name)
+        # Older than its source means the image was regenerated since
+        if version is not None and version >= source_version:
+            return True
+        self.schedule(session_id, parsed[0]).result(timeout)
+        return self.store.exists(session_id, name)
+
+    def _forget(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def _render(self, session_id: str, filename: str):
+        data = self.store.read(session_id, filename)
+        if data is None:
+            # Session deleted before its variants got their turn
+            return
+        try:
+            with time_stage("image_variants"):
+                variants = render_variants(data)
+        except Exception as e:
+            logger.error(f"Could not render variants of {session_id}/{filename}: {e}")
+            return
+        for variant, variant_bytes in variants.items():
+            PAYLOAD_BYTES.observe(len(variant_bytes), kind=f"image_{variant}")
+            self.store.write(
+                session_id, variant_filename(filename, variant), variant_bytes
+            )
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from rate_limiter import PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+JOB_STORY = "story"
+JOB_IMAGE = "image"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+class JobQueue:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Durable queue of story and image jobs kept in SQLite
+
+        Web processes only enqueue and read status; workers (worker.py, or
+        the app itself when QUEUE_APP_WORKERS is set) claim jobs with a lease.
+        A job whose worker died is claimed again once its lease runs out, up
+        to QUEUE_MAX_ATTEMPTS times.
+
+        Each job has a unique key, e.g. "<session>:image:3", so re-submitting
+        a session only queues the work that is not already queued or done.
+
+        Args:
+            path: SQLite database file, on a local disk of the host every app
+                process and worker runs on; WAL mode does not work over a
+                network filesystem (defaults to the QUEUE_DB environment
+                variable, or "cache/jobs.sqlite3")
+        """
+        self.path = path or os.getenv("QUEUE_DB", "cache/jobs.sqlite3")
+        self.lease_seconds = int(os.getenv("QUEUE_LEASE", "900"))
+        self.max_attempts = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_jobs ("
+            "job_id TEXT PRIMARY KEY, job_key TEXT NOT NULL UNIQUE, "
+            "session_id TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, result TEXT, "
+            "lease_until REAL, worker TEXT, created REAL NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_jobs_ready "
+            "ON queue_jobs (status, priority, created)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_jobs_session ON queue_jobs (session_id)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(
+        self,
+        session_id: str,
+        kind: str,
+        key: str,
+        payload: Dict,
+        priority: int = PRIORITY_NORMAL,
+    ) -> str:
+        """
+        Queue a job unless one with the same key is queued, running or done
+
+        A failed or cancelled job with the same key is queued again with the
+        new payload.
+
+        Args:
+            session_id: Session the job's results are written to
+            kind: JOB_STORY or JOB_IMAGE
+            key: Unique key of the unit of work within the session
+            payload: JSON-serialisable job arguments
+            priority: Rate-limiter priority, lower runs first
+
+        Returns:
+            The id of the new or existing job
+        """
+        job_key = f"{session_id}:{kind}:{key}"
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO queue_jobs (job_id, job_key, session_id, kind, payload, "
+            "priority, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (job_key) DO UPDATE SET payload = excluded.payload, "
+            "priority = excluded.priority, status = excluded.status, attempts = 0, "
+            "error = NULL, result = NULL, lease_until = NULL, worker = NULL, "
+            "updated = excluded.updated WHERE status IN (?, ?)",
+            (
+                str(uuid.uuid4()),
+                job_key,
+                session_id,
+                kind,
+                json.dumps(payload),
+                priority,
+                STATUS_QUEUED,
+                now,
+                now,
+                STATUS_FAILED,
+                STATUS_CANCELLED,
+            ),
+        )
+        row = conn.execute(
+            "SELECT job_id FROM queue_jobs WHERE job_key = ?", (job_key,)
+        ).fetchone()
+        return row["job_id"]
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """
+        Take the next ready job, or one whose worker's lease ran out
+
+        Args:
+            worker: Name of the claiming worker, for diagnostics
+
+        Returns:
+            The claimed job, or None if nothing is ready
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs abandoned by a dead worker that have used up their attempts
+            conn.execute(
+                "UPDATE queue_jobs SET status = ?, error = ?, updated = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (
+                    STATUS_FAILED,
+                    "Worker stopped while running the job",
+                    now,
+                    STATUS_RUNNING,
+                    now,
+                    self.max_attempts,
+                ),
+            )
+            row = conn.execute(
+                "SELECT * FROM queue_jobs WHERE status = ? "
+                "OR (status = ? AND lease_until < ?) "
+                "ORDER BY priority, created LIMIT 1",
+                (STATUS_QUEUED, STATUS_RUNNING, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE queue_jobs SET status = ?, attempts = attempts + 1, "
+                "lease_until = ?, worker = ?, updated = ? WHERE job_id = ?",
+                (STATUS_RUNNING, now + self.lease_seconds, worker, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._row_to_job(row)
+        job["attempts"] += 1
+        return job
+
+    def extend_lease(self, job_id: str, worker: str) -> bool:
+        """
+        Push back the lease of a running job its worker is still working on
+
+        Args:
+            job_id: The claimed job
+            worker: Name the job was claimed with
+
+        Returns:
+            False if the job is no longer running under this worker, e.g.
+            because it was cancelled or its lease already ran out and another
+            worker claimed it
+        """
+        cursor = self._connect().execute(
+            "UPDATE queue_jobs SET lease_until = ?, updated = ? "
+            "WHERE job_id = ? AND status = ? AND worker = ?",
+            (
+                time.time() + self.lease_seconds,
+                time.time(),
+                job_id,
+                STATUS_RUNNING,
+                worker,
+            ),
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, result: Optional[Dict] = None):
+        self._finish(job_id, STATUS_DONE, result=result)
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, STATUS_FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, result=None, error=None):
+        # A job cancelled while running stays cancelled
+        self._connect().execute(
+            "UPDATE queue_jobs SET status = ?, result = ?, error = ?, "
+            "lease_until = NULL, updated = ? WHERE job_id = ? AND status = ?",
+            (
+                status,
+                json.dumps(result) if result is not None else None,
+                error,
+                time.time(),
+                job_id,
+                STATUS_RUNNING,
+            ),
+        )
+
+    def cancel_session(self, session_id: str):
+        """Cancel every queued or running job of a session"""
+        self._connect().execute(
+            "UPDATE queue_jobs SET status = ?, updated = ? "
+            "WHERE session_id = ? AND status IN (?, ?)",
+            (STATUS_CANCELLED, time.time(), session_id, STATUS_QUEUED, STATUS_RUNNING),
+        )
+
+    def is_cancelled(self, job_id: str) -> bool:
+        row = (
+            self._connect()
+            .execute("SELECT status FROM queue_jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return row is None or row["status"] == STATUS_CANCELLED
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = (
+            self._connect()
+            .execute("SELECT * FROM queue_jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return self._row_to_job(row) if row else None
+
+    def session_jobs(self, session_id: str) -> List[Dict]:
+        """Every job of a session, oldest first"""
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT * FROM queue_jobs WHERE session_id = ? ORDER BY created",
+                (session_id,),
+            )
+            .fetchall()
+        )
+        return [self._row_to_job(row) for row in rows]
+
+    def active_sessions(self) -> Set[str]:
+        """Session ids with jobs still queued or running"""
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT DISTINCT session_id FROM queue_jobs WHERE status IN (?, ?)",
+                (STATUS_QUEUED, STATUS_RUNNING),
+            )
+            .fetchall()
+        )
+        return {row["session_id"] for row in rows}
+
+    def prune(self, max_age: float):
+        """Forget finished jobs last updated more than max_age seconds ago"""
+        self._connect().execute(
+            "DELETE FROM queue_jobs WHERE status IN (?, ?, ?) AND updated < ?",
+            (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED, time.time() - max_age),
+        )
+
+    def stats(self) -> Dict:
+        """
+        Get queue depth
+
+        Returns:
+            Dictionary with job counts per kind and status, and the age of
+            the oldest queued job in seconds
+        """
+        conn = self._connect()
+        counts: Dict[str, Dict[str, int]] = {}
+        for row in conn.execute(
+            "SELECT kind, status, COUNT(*) AS n FROM queue_jobs GROUP BY kind, status"
+        ):
+            counts.setdefault(row["kind"], {})[row["status"]] = row["n"]
+        oldest = conn.execute(
+            "SELECT MIN(created) AS created FROM queue_jobs WHERE status = ?",
+            (STATUS_QUEUED,),
+        ).fetchone()["created"]
+        return {
+            "jobs": counts,
+            "oldest_queued_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
@@ -0,0 +1,386 @@
+import os
+import asyncio
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from async_runtime import async_runtime
+from image_tiers import TIER_FINAL
+from rate_limiter import slide_priority
+from session_images import save_session_image
+
+logger = logging.getLogger(__name__)
+
+SLIDE_PENDING = "pending"
+SLIDE_RUNNING = "running"
+SLIDE_DONE = "done"
+SLIDE_FAILED = "failed"
+
+
+class ImageJob:
+    def __init__(
+        self,
+        session_id: str,
+        prompts: List[str],
+        closed: bool = True,
+        characters: Optional[List[Dict]] = None,
+        tier: str = TIER_FINAL,
+    ):
+        """
+        Track the per-slide state of one session's image fan-out
+
+        Args:
+            session_id: The session the slides belong to
+            prompts: Image prompts, one per slide, in slide order
+            closed: False if more slides will be added while the job runs
+            characters: The story's characters, added to the image prompts
+                that name them; may be set later on an open job
+            tier: Image tier the slides are rendered at
+        """
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.created_at = time.time()
+        self.finished_at = None
+        self.closed = closed
+        self.error = None
+        self.meta: Dict = {}
+        self.characters = characters or []
+        self.tier = tier
+        self.slides = [
+            self._new_slide(index, prompt) for index, prompt in enumerate(prompts)
+        ]
+        self.version = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _update_slide(self, index: int, **fields):
+        with self._lock:
+            self.slides[index].update(fields)
+            self._changed_locked()
+
+    def _changed_locked(self):
+        # Caller holds self._lock
+        if (
+            self.finished_at is None
+            and self.closed
+            and all(
+                slide["status"] in (SLIDE_DONE, SLIDE_FAILED) for slide in self.slides
+            )
+        ):
+            self.finished_at = time.time()
+        self.version += 1
+        self._changed.notify_all()
+
+    def _add_slide(self, prompt: str, story_slide: Optional[Dict] = None) -> int:
+        with self._lock:
+            index = len(self.slides)
+            self.slides.append(self._new_slide(index, prompt, story_slide))
+            self._changed_locked()
+            return index
+
+    def update_meta(self, **fields):
+        """
+        Attach extra information (e.g. the story title) and wake listeners
+
+        Args:
+            **fields: Values merged into the job's meta dictionary
+        """
+        with self._lock:
+            self.meta.update(fields)
+            self._changed_locked()
+
+    def close(self, error: Optional[str] = None):
+        """
+        Mark an open job as having received all of its slides
+
+        Args:
+            error: Why no more slides will arrive, if it ended early
+        """
+        with self._lock:
+            self.closed = True
+            self.error = error
+            self._changed_locked()
+
+    def wait_for_change(self, since_version: int, timeout: float) -> int:
+        """
+        Block until the job changes after a known version or the timeout passes
+
+        Args:
+            since_version: The last version the caller has seen
+            timeout: Maximum seconds to wait
+
+        Returns:
+            The current version (equal to since_version on timeout)
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: self.version != since_version, timeout)
+            return self.version
+
+    @staticmethod
+    def _new_slide(index: int, prompt: str, story_slide: Optional[Dict] = None) -> Dict:
+        return {
+            "index": index,
+            "status": SLIDE_PENDING,
+            "prompt": prompt,
+            "story_slide": story_slide,
+            "filename": None,
+            "error": None,
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    @property
+    def total_slides(self) -> int:
+        with self._lock:
+            return len(self.slides)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def get_slide(self, index: int) -> Optional[Dict]:
+        """
+        Get a copy of a single slide's state, including its image
+
+        Args:
+            index: Zero-based slide index
+
+        Returns:
+            Slide state dictionary, or None if the index is out of range
+        """
+        with self._lock:
+            if 0 <= index < len(self.slides):
+                return dict(self.slides[index])
+        return None
+
+    def to_dict(self) -> Dict:
+        """
+        Summarise the job without image payloads
+
+        Returns:
+            Dictionary with overall and per-slide status
+        """
+        with self._lock:
+            slides = [
+                {
+                    "index": slide["index"],
+                    "status": slide["status"],
+                    "error": slide["error"],
+                    "duration": (
+                        round(slide["finished_at"] - slide["started_at"], 3)
+                        if slide["started_at"] and slide["finished_at"]
+                        else None
+                    ),
+                }
+                for slide in self.slides
+            ]
+        completed = sum(1 for slide in slides if slide["status"] == SLIDE_DONE)
+        failed = sum(1 for slide in slides if slide["status"] == SLIDE_FAILED)
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "tier": self.tier,
+            "done": self.done,
+            "error": self.error,
+            "total_slides": len(slides),
+            "completed": completed,
+            "failed": failed,
+            "slides": slides,
+        }
+
+
+class JobService:
+    def __init__(
+        self,
+        async_openai_service,
+        session_store,
+        max_concurrency: Optional[int] = None,
+        image_variants=None,
+    ):
+        """
+        Initialize the job service with a concurrency limit shared by all jobs
+
+        Slides run as coroutines on the shared async runtime, so an in-flight
+        image costs a coroutine rather than a thread.
+
+        Args:
+            async_openai_service: Async service used to generate each slide's image
+            session_store: Store the generated slide images are written to
+            max_concurrency: Maximum concurrent image calls (defaults to the
+                IMAGE_JOB_WORKERS environment variable, or 4)
+            image_variants: Renders previews and thumbnails of saved images
+        """
+        self.async_openai_service = async_openai_service
+        self.session_store = session_store
+        self.image_variants = image_variants
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("IMAGE_JOB_WORKERS", "4")
+        )
+        self.job_ttl = int(os.getenv("IMAGE_JOB_TTL", "3600"))
+        self._semaphore = None
+        self.jobs: Dict[str, ImageJob] = {}
+        self._lock = threading.Lock()
+        logger.info(f"Job service initialized with concurrency {self.max_concurrency}")
+
+    def submit(
+        self,
+        session_id: str,
+        avatar_bytes: bytes,
+        prompts: List[str],
+        characters: Optional[List[Dict]] = None,
+        tier: str = TIER_FINAL,
+    ) -> ImageJob:
+        """
+        Start generating every slide of a session at once
+
+        Args:
+            session_id: The session the slides belong to
+            avatar_bytes: The session's normalised avatar
+            prompts: Image prompts, one per slide, in slide order
+            characters: The story's characters, if it has any
+            tier: Image tier to render the slides at
+
+        Returns:
+            The newly created job
+        """
+        job = ImageJob(session_id, prompts, characters=characters, tier=tier)
+        with self._lock:
+            self._prune()
+            self.jobs[job.job_id] = job
+
+        for index in range(len(prompts)):
+            async_runtime.submit(self._run_slide(job, index, avatar_bytes))
+
+        logger.info(
+            f"Submitted job {job.job_id} for session {session_id} with {len(prompts)} slides"
+        )
+        return job
+
+    def open_job(self, session_id: str, tier: str = TIER_FINAL) -> ImageJob:
+        """
+        Create a job whose slides are added one at a time with add_slide
+
+        Args:
+            session_id: The session the slides belong to
+            tier: Image tier to render the slides at
+
+        Returns:
+            The newly created, still open job
+        """
+        job = ImageJob(session_id, [], closed=False, tier=tier)
+        with self._lock:
+            self._prune()
+            self.jobs[job.job_id] = job
+        return job
+
+    def add_slide(
+        self,
+        job: ImageJob,
+        avatar_bytes: bytes,
+        prompt: str,
+        story_slide: Optional[Dict] = None,
+    ) -> int:
+        """
+        Add a slide to an open job and start generating its image immediately
+
+        Args:
+            job: Job created with open_job
+            avatar_bytes: The session's normalised avatar
+            prompt: The slide's image prompt
+            story_slide: The story slide the prompt came from, if any
+
+        Returns:
+            Zero-based index of the new slide
+        """
+        index = job._add_slide(prompt, story_slide)
+        async_runtime.submit(self._run_slide(job, index, avatar_bytes))
+        return index
+
+    def get(self, job_id: str) -> Optional[ImageJob]:
+        """
+        Look up a job by id
+
+        Args:
+            job_id: The job id returned by submit
+
+        Returns:
+            The job, or None if it is unknown or expired
+        """
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def active_job(self, session_id: str) -> Optional[ImageJob]:
+        """
+        The newest job of a session that is still generating images
+
+        Args:
+            session_id: The session to look up
+
+        Returns:
+            The job, or None if the session has no unfinished job
+        """
+        with self._lock:
+            active = [
+                job
+                for job in self.jobs.values()
+                if job.session_id == session_id and not job.done
+            ]
+        return max(active, key=lambda job: job.created_at, default=None)
+
+    def active_sessions(self) -> Set[str]:
+        """Session ids that still have a job generating images"""
+        with self._lock:
+            return {job.session_id for job in self.jobs.values() if not job.done}
+
+    async def _run_slide(self, job: ImageJob, index: int, avatar_bytes: bytes):
+        if self._semaphore is None:
+            # Created lazily so it binds to the runtime's loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            job._update_slide(index, status=SLIDE_RUNNING, started_at=time.time())
+            try:
+                generate_image = self.async_openai_service.generate_image
+                image_base64, updated_prompt = await generate_image(
+                    avatar_bytes,
+                    job.get_slide(index)["prompt"],
+                    session_id=job.session_id,
+                    priority=slide_priority(index),
+                    characters=job.characters,
+                    tier=job.tier,
+                )
+                filename = f"story_image_{index}.jpg"
+                await asyncio.to_thread(
+                    save_session_image,
+                    self.session_store,
+                    job.session_id,
+                    filename,
+                    image_base64,
+                    job.tier,
+                    self.image_variants,
+                )
+                job._update_slide(
+                    index,
+                    status=SLIDE_DONE,
+                    filename=filename,
+                    prompt=updated_prompt,
+                    finished_at=time.time(),
+                )
+            except Exception as e:
+                logger.error(f"Job {job.job_id} slide {index} failed: {e}")
+                job._update_slide(
+                    index, status=SLIDE_FAILED, error=str(e), finished_at=time.time()
+                )
+
+    def _prune(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.done and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
@@ -1,44 +1,243 @@
+"""
+Batch story image generator
+
+Reads a JSONL manifest with one job per line and generates every image with a
+bounded number of concurrent API calls. Each job is either a list of prompts
+or a category/subcategory to write a story for first:
+
+    {"id": "dragons", "avatar": "avatar.jpg", "prompts": ["...", "..."]}
+    {"id": "zed", "avatar": "avatar.jpg", "prompts": ["Zed waves ..."], "characters": [{"name": "Zed", "description": "..."}]}
+    {"id": "space-1", "avatar": "kid.png", "category": "Adventure", "subcategory": "Space_Exploration", "num_slides": 5}
+
+Images are written as returned by the API (no re-encoding) to
+<out>/<job id>/story_image_<n>.jpg. Progress is checkpointed to
+<out>/checkpoint.jsonl, so re-running an interrupted batch only generates what
+is missing:
+
+    python main.py batch_example.jsonl --out generated_images --concurrency 8
+"""
+
 import os
+import sys
+import json
+import time
 import base64
-from openai import OpenAI
-from PIL import Image
-from io import BytesIO
-
-# Load your OpenAI API key from environment variable
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# 5 dummy story prompts for a kids' story (reduced from 10 to stay within API limits)
-story_prompts = [
-    "Create a fantasy scene showing the exact same character from the reference image, maintaining their precise appearance, clothing, and features, waking up in a magical treehouse bedroom with glowing crystals and floating books. Keep the character's identity completely consistent with the reference.",
-    "Show the identical character from the reference image, with the same exact appearance, style, and characteristics, having breakfast with friendly forest creatures at an enchanted table with golden plates and sparkling juice. Maintain perfect character consistency with the reference image.",
-    "Display the same character from the reference image, preserving their exact look, outfit, and personality, riding a flying dragon to a magical school while waving at fairy friends. Ensure the character looks exactly like the reference in every detail.",
-    "Illustrate the exact character from the reference image, keeping their precise appearance, clothing, and features identical, playing magical soccer with unicorns and elves on a rainbow field. Maintain complete visual consistency with the reference character.",
-    "Show the same character from the reference image, with identical appearance, style, and characteristics, in a cozy magical cottage getting ready for bed while a friendly wizard reads them a bedtime story. Preserve the character's exact look from the reference image."
-]
-
-# Ensure output directory exists
-output_dir = "generated_images"
-os.makedirs(output_dir, exist_ok=True)
-
-# Generate 5 images, each referencing the avatar
-for idx, prompt in enumerate(story_prompts, 1):
-    print(f"Generating image {idx}...")
-    with open("avatar.jpg", "rb") as avatar_file:
-        # Pass the file object directly
-        result = client.images.edit(
-            model="gpt-image-1",
-            image=[avatar_file],
-            prompt=prompt,
-            size="1024x1024",
-            output_format="jpeg"
+import asyncio
+import argparse
+import threading
+
+from avatar_service import normalize_avatar_bytes
+from async_runtime import async_runtime
+from story_schema import parse_characters
+from async_openai_service import AsyncOpenAIService
+from openai_service import OpenAIService
+from rate_limiter import PRIORITY_BACKGROUND
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def write_atomic(path, data):
+    """Write a file so an interrupted run never leaves a truncated one behind"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """
+        Append-only record of finished work, replayed on start
+
+        Args:
+            path: The checkpoint JSONL file
+        """
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of a run killed mid-write
+                        continue
+                    if record.get("status") == "done":
+                        self.done.add((record["job"], record["slide"]))
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def is_done(self, job_id, slide, path):
+        return (job_id, slide) in self.done and os.path.exists(path)
+
+    def record(self, job_id, slide, status, **fields):
+        line = json.dumps({"job": job_id, "slide": slide, "status": status, **fields})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if status == "done":
+            self.done.add((job_id, slide))
+
+    def close(self):
+        self._file.close()
+
+
+def load_manifest(path):
+    jobs = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"job-{number}")
+            if "avatar" not in job:
+                raise ValueError(f"{path}:{number}: job has no avatar")
+            if not job.get("prompts") and not job.get("category"):
+                raise ValueError(f"{path}:{number}: job needs prompts or a category")
+            jobs.append(job)
+    return jobs
+
+
+class BatchRunner:
+    def __init__(self, out_dir, concurrency, checkpoint):
+        self.out_dir = out_dir
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint
+        self.openai_service = OpenAIService()
+        self.async_openai_service = AsyncOpenAIService(self.openai_service)
+        self.avatars = {}
+        self.generated = 0
+        self.skipped = 0
+        self.failed = 0
+        self._semaphore = None
+
+    def avatar_bytes(self, path):
+        # Normalise each avatar once, however many jobs and slides use it
+        if path not in self.avatars:
+            with open(path, "rb") as f:
+                self.avatars[path] = normalize_avatar_bytes(f.read())
+        return self.avatars[path]
+
+    async def job_prompts(self, job, job_dir):
+        """
+        The job's image prompts and characters, writing (or reusing) its story
+        if needed
+        """
+        if job.get("prompts"):
+            return job["prompts"], parse_characters(job.get("characters"))
+
+        story_path = os.path.join(job_dir, "story.json")
+        if os.path.exists(story_path):
+            with open(story_path) as f:
+                story_data = json.load(f)
+        else:
+            async with self._semaphore:
+                _, story_data = await self.async_openai_service.generate_story(
+                    job["category"],
+                    job.get("subcategory", ""),
+                    job.get("num_slides", 5),
+                    session_id=job["id"],
+                    priority=PRIORITY_BACKGROUND,
+                )
+            write_atomic(story_path, json.dumps(story_data, indent=2).encode("utf-8"))
+        prompts = [slide.get("image_prompt", "") for slide in story_data["slides"]]
+        return prompts, parse_characters(story_data.get("characters"))
+
+    async def run_slide(self, job, avatar_bytes, slide, prompt, characters, out_path):
+        async with self._semaphore:
+            started = time.time()
+            try:
+                image_base64, _ = await self.async_openai_service.generate_image(
+                    avatar_bytes,
+                    prompt,
+                    session_id=job["id"],
+                    priority=PRIORITY_BACKGROUND,
+                    characters=characters,
+                )
+                # The API already returns a JPEG; store its bytes unchanged
+                write_atomic(out_path, base64.b64decode(image_base64))
+            except Exception as e:
+                self.failed += 1
+                self.checkpoint.record(job["id"], slide, "failed", error=str(e))
+                log(f"[{job['id']}] slide {slide} failed: {e}")
+                return
+        self.generated += 1
+        self.checkpoint.record(
+            job["id"], slide, "done", seconds=round(time.time() - started, 3)
         )
-        # Decode the base64 image
-        image_base64 = result.data[0].b64_json
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_bytes))
-        # Save the image
-        out_path = os.path.join(output_dir, f"story_image_{idx}.jpg")
-        image.save(out_path, format="JPEG", quality=90)
-        print(f"Saved: {out_path}")
-
-print("All 5 images generated successfully!")
\ No newline at end of file
+        log(f"[{job['id']}] slide {slide} saved to {out_path}")
+
+    async def run_job(self, job):
+        job_dir = os.path.join(self.out_dir, job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            avatar_bytes = self.avatar_bytes(job["avatar"])
+            prompts, characters = await self.job_prompts(job, job_dir)
+        except Exception as e:
+            self.failed += 1
+            self.checkpoint.record(job["id"], None, "failed", error=str(e))
+            log(f"[{job['id']}] failed: {e}")
+            return
+
+        slides = []
+        for slide, prompt in enumerate(prompts, 1):
+            out_path = os.path.join(job_dir, f"story_image_{slide}.jpg")
+            if self.checkpoint.is_done(job["id"], slide, out_path):
+                self.skipped += 1
+                continue
+            slides.append(
+                self.run_slide(job, avatar_bytes, slide, prompt, characters, out_path)
+            )
+        await asyncio.gather(*slides)
+
+    async def run(self, jobs):
+        # Created here so it binds to the runtime's loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.run_job(job) for job in jobs))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate story images in bulk from a JSONL manifest"
+    )
+    parser.add_argument("manifest", help="JSONL file with one job per line")
+    parser.add_argument("--out", default="generated_images", help="output directory")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("BATCH_CONCURRENCY", "4")),
+        help="maximum concurrent API calls (default 4)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = load_manifest(args.manifest)
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(args.out, "checkpoint.jsonl"))
+    runner = BatchRunner(args.out, args.concurrency, checkpoint)
+
+    log(f"Running {len(jobs)} jobs with concurrency {args.concurrency}")
+    started = time.time()
+    try:
+        async_runtime.submit(runner.run(jobs)).result()
+    finally:
+        checkpoint.close()
+
+    log(
+        f"Generated {runner.generated} images, skipped {runner.skipped} already done, "
+        f"{runner.failed} failed in {time.time() - started:.1f}s"
+    )
+    if runner.failed:
+        log("Run the same command again to retry the failed images")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
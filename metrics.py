@@ -0,0 +1,229 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+BYTES_BUCKETS = tuple(1024 * 4**i for i in range(10))  # 1 KiB .. 256 MiB
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the enclosed block takes, in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            items = sorted(
+                (key, (list(state[0]), state[1], state[2]))
+                for key, state in self._values.items()
+            )
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "storyteller_stage_seconds",
+    "Time spent in each processing stage",
+    ["stage"],
+)
+PAYLOAD_BYTES = Histogram(
+    "storyteller_payload_bytes",
+    "Size of avatars, generated images and upstream responses",
+    ["kind"],
+    buckets=BYTES_BUCKETS,
+)
+UPSTREAM_SECONDS = Histogram(
+    "storyteller_upstream_seconds",
+    "Latency of individual OpenAI API calls",
+    ["call"],
+)
+UPSTREAM_REQUESTS = Counter(
+    "storyteller_upstream_requests_total",
+    "OpenAI API calls by outcome status code",
+    ["call", "status"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "storyteller_upstream_in_flight",
+    "OpenAI API calls currently waiting for a response",
+    ["call"],
+)
+DEDUP_REQUESTS = Counter(
+    "storyteller_dedup_requests_total",
+    "Generation requests that started an upstream call or joined one in flight",
+    ["call", "outcome"],
+)
+STORY_REPAIRED_SLIDES = Counter(
+    "storyteller_story_repaired_slides_total",
+    "Story slides regenerated because the response lacked them or they were invalid",
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "storyteller_http_request_seconds",
+    "Time until the response headers are ready, per endpoint",
+    ["endpoint", "method", "status"],
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "storyteller_http_response_bytes",
+    "Response body size per endpoint, when known up front",
+    ["endpoint"],
+    buckets=BYTES_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "storyteller_http_in_flight",
+    "Requests currently being handled per endpoint",
+    ["endpoint"],
+)
+
+
+def time_stage(stage: str):
+    """Context manager recording the enclosed block under a stage name"""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+@contextmanager
+def track_upstream(call: str):
+    """
+    Record latency, in-flight count and status code of one OpenAI call
+
+    Args:
+        call: Call type, e.g. "story" or "image"
+    """
+    UPSTREAM_IN_FLIGHT.inc(call=call)
+    started = time.perf_counter()
+    status = "200"
+    try:
+        yield
+    except Exception as e:
+        status = str(getattr(e, "status_code", None) or type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(call=call)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, call=call)
+        UPSTREAM_REQUESTS.inc(call=call, status=status)
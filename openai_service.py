@@ -1,8 +1,65 @@
 import os
 import json
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 import re
+from image_cache import ImageCache
+from image_tiers import TIER_FINAL, tier_params
+from session_store import AVATAR_FILENAME
+from story_stream import SlideStreamParser
+from story_schema import (
+    InOrderSlides,
+    Story,
+    StoryOutline,
+    add_slides,
+    characters_in,
+    decode_story_json,
+    missing_runs,
+    missing_slides,
+    parse_characters,
+    parse_slide,
+    part_slides,
+    repair_outline,
+    response_format,
+    validate_story,
+)
+from prompt_registry import IMAGE_CHARACTERS, get_prompt
+from usage_tracker import UsageTracker
+from resilience import ResilientCaller, new_breaker
+from metrics import PAYLOAD_BYTES, STORY_REPAIRED_SLIDES, time_stage, track_upstream
+from rate_limiter import (
+    CALL_IMAGE,
+    CALL_REQUEST,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    openai_scheduler,
+)
+
+logger = logging.getLogger(__name__)
+
+STORY_MODEL = os.getenv("STORY_MODEL", "gpt-4")
+# The original gpt-4 rejects response_format; newer models take a strict schema
+STORY_RESPONSE_FORMAT = os.getenv(
+    "STORY_RESPONSE_FORMAT", "text" if STORY_MODEL == "gpt-4" else "json_schema"
+)
+STORY_REPAIR_ATTEMPTS = int(os.getenv("STORY_REPAIR_ATTEMPTS", "2"))
+
+IMAGE_MODEL = "gpt-image-1"
+IMAGE_SIZE = "1024x1024"
+IMAGE_OUTPUT_FORMAT = "jpeg"
+
+# Story completion call types; each has its own latency profile
+STORY_CALLS = ("story", "story_outline", "story_expand", "story_repair")
+
+STORY_DEADLINE = float(os.getenv("OPENAI_STORY_DEADLINE", "180"))
+IMAGE_DEADLINE = float(os.getenv("OPENAI_IMAGE_DEADLINE", "300"))
+
+STORY_MAX_SLIDES = int(os.getenv("STORY_MAX_SLIDES", "20"))
+STORY_OUTLINE_MIN_SLIDES = int(os.getenv("STORY_OUTLINE_MIN_SLIDES", "8"))
+STORY_EXPAND_CHUNK = max(1, int(os.getenv("STORY_EXPAND_CHUNK", "4")))
 
 
 def clean_prompt(prompt: str) -> str:
@@ -10,343 +67,673 @@ def clean_prompt(prompt: str) -> str:
     return re.sub(r"[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f]", "", prompt)
 
 
-load_dotenv()
-
-
-class OpenAIService:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    def generate_story(self, category, subcategory, num_slides):
-        # category = clean_prompt(category)
-        # subcategory = clean_prompt(subcategory)
-        # num_slides = clean_prompt(num_slides)
-        print("here")
-        """Generate story using OpenAI"""
-        prompt = f"""
-        You are an expert children's story writer. Create an engaging, age-appropriate story for children aged 5-12 years.
-
-        STORY REQUIREMENTS:
-        - Category: {category}
-        - Subcategory: {subcategory}
-        - Number of slides/scenes: {num_slides}
-        - Each slide should have 2-3 sentences of story text.
-        - The story should be educational, fun, and inspiring.
-        - Use simple language appropriate for children.
-        - Include positive messages and life lessons.
-        - Make it interactive and engaging.
-        - Add more supporting characters to the story, just make sure they are relevant to the story you create, also ensure consistency in the characters.
-        - Make sure the story generated is strongly linked to the category and subcategory that has been selected. It should be very relevant to the choice of category and subcategory.
-
-        CRITICAL IMAGE REQUIREMENTS:
-        - The user will upload an avatar image that represents the main character.
-        - ALL image prompts MUST include the main character from the uploaded avatar in most scenes.
-        - The main character should be consistently present and recognizable in every scene unless specified otherwise.
-        - Describe the character's actions, expressions, and interactions in each scene.
-        - Ensure character consistency across all slides.
-        - For the additional characters, include a detailed description with every detail of the character in every image prompt to ensure consistency.
-        - For a given scene, select the top 5 most suitable types of images to represent the scene (close-up, medium shot, wide shot, etc.) and select one at random from the 5 to use.
-        - The images must give a very holistic approach to the story when put together, ensuring each image is equally engaging and maintains the flow across all the images.
-        - Every image must have the same texture as the uploaded avatar image. This is absolutely critical.
-        
-        ### ENHANCED IMAGE PROMPT SPECIFICATIONS:
-        Every image prompt MUST include ALL of the following detailed elements:
-
-        #### 1. CHARACTER DETAILS:
-        - *Physical Positioning*: Specify exact body position (standing, sitting, kneeling, lying down, walking, running, jumping, etc.)
-        - *Body Orientation*: Detail which way the character is facing (towards camera, profile view, three-quarter turn, back to camera, etc.)
-        - *Facial Expression*: Describe precise emotions (beaming with joy, eyes sparkling with wonder, concentrated focus, proud smile, surprised wide eyes, determined look, etc.)
-        - *Hand Gestures*: Specify what the character's hands are doing (pointing, waving, holding objects, hands on hips, clapping, reaching out, etc.)
-        - *Body Language*: Detail posture and stance (confident chest out, curious leaning forward, excited bouncing, relaxed shoulders, etc.)
-
-        #### 2. THEMATIC ELEMENTS:
-        - *Career/Goal-Specific Props*: Include objects directly related to the story theme (stethoscope for doctor, paintbrush for artist, telescope for astronomer, etc.)
-        - *Relevant Clothing/Accessories*: Describe theme-appropriate attire (lab coat, hard hat, chef's hat, uniform, etc.)
-        - *Professional Tools*: Mention equipment or instruments specific to the career/goal
-        - *Achievement Symbols*: Include elements that show progress or success (certificates, medals, completed projects, etc.)
-
-        #### 3. ENVIRONMENTAL CONTEXT:
-        - *Setting Details*: Provide specific location descriptions (hospital room, art studio, space station, classroom, laboratory, etc.)
-        - *Background Elements*: Include career-relevant background objects and scenery
-        - *Scale and Perspective*: Specify the character's size relative to surroundings
-        - *Atmospheric Details*: Describe lighting, weather, time of day, mood of the environment
-
-        #### 4. COMPOSITION AND CAMERA WORK:
-        - *Camera Angle*: Specify the viewpoint (eye-level, low-angle heroic shot, high-angle, bird's eye view, etc.)
-        - *Shot Type*: Detail the framing (close-up, medium shot, wide shot, etc.)
-        - *Depth of Field*: Mention foreground, middleground, and background elements
-        - *Visual Focus*: Identify what should be the main focal point
-
-        #### 5. INTERACTION AND ACTION:
-        - *Active Engagement*: Show the character actively participating in theme-related activities
-        - *Object Interaction*: Detail how the character is using or interacting with relevant props
-        - *Environmental Interaction*: Describe how the character relates to their surroundings
-        - *Dynamic Movement*: Include action verbs that show the character in motion or engaged activity
-
-        #### 6. ADDITIONAL CHARACTERS:
-        - *Additional Characters Description*: If there are additional characters (in addition to the main character whose avatar I will upload), include a detailed description with every detail of the character ranging from color, height, structure, etc., in EVERY image prompt. This is to ensure character consistency across all the generated images.
-        - *Additional Character Inclusion*:Make sure you add additional characters wherever it helps, it is always better to have additional supporting characters.
-
-        ### Image Types and Their Applications:
-        1. *Close-Up*: Focus tightly on the character's face to highlight emotions and details. Use this shot to connect deeply with the character's feelings, such as showing determination, joy, or concentration while working on their goal.
-        2. *Medium Shot*: Show the character from the waist up, ideal for depicting interactions with career-related tools or showing the character actively working on their aspirations.
-        3. *Wide Shot (Long Shot)*: Capture the entire character and their surrounding environment. This shot is useful when establishing the professional setting and context, helping readers understand the career environment.
-        4. *Bird's Eye View*: An overhead perspective that shows the character's workspace or the scope of their achievement. Use this to emphasize the magnitude of their accomplishment or the complexity of their work.
-        5. *Worm's Eye View*: A low-angle shot looking up at the subject, making them appear larger and more heroic. Use this when a character experiences a moment of triumph or faces a significant challenge.
-        6. *Over-the-Shoulder Shot*: Taken from behind a character, this shot focuses on what they are working on or looking at. Use it to immerse the reader in the character's perspective as they pursue their goal.
-        7. *Two-Shot*: Includes two characters within the frame, valuable for depicting mentorship, collaboration, or learning relationships in career contexts.
-        8. *Dutch Angle (Tilted Angle)*: This technique introduces a diagonal horizon line, creating excitement or highlighting challenging moments in the character's journey.
-        9. *Frame Within a Frame*: Utilize elements within the scene, such as windows, doorways, or equipment, to frame the subject and add professional context.
-        10. *Leading Lines*: Incorporate compositional lines that guide the viewer's eye toward the main subject, such as paths leading to the character's workplace or tools pointing toward their goal.
-
-        ### MANDATORY IMAGE PROMPT STRUCTURE:
-        Every image prompt MUST follow this exact format:
-        "Create a [IMAGE_TYPE] illustration showing the exact same character from the reference image, maintaining their precise appearance, clothing, and features. 
-
-        CHARACTER POSITION: [Specific body position and orientation]. 
-        FACIAL EXPRESSION: The character displays [specific emotion/expression with details]. 
-        BODY LANGUAGE: [Specific gestures, posture, and stance]. 
-        HANDS: [Detailed description of hand positions and what they're holding/doing]. 
-        THEME ELEMENTS: [Career/goal-specific props, clothing, tools, and accessories]. 
-        SETTING: [Detailed environment description with career-relevant background]. 
-        INTERACTION: The character is actively [specific action related to theme]. 
-        PERSPECTIVE: Use [specific camera angle and shot type]. 
-        LIGHTING: [Mood and lighting description]. 
-        DEPTH: [Foreground, middleground, background elements]. 
-        ACHIEVEMENT FOCUS: [Elements that show progress, success, or goal pursuit]. 
-
-        Art style: Vibrant, child-friendly cartoon illustration with clear details and engaging colors."
-
-        ### EXAMPLE ENHANCED IMAGE PROMPT:
-        "Create a medium shot illustration showing the exact same character from the reference image, maintaining their precise appearance, clothing, and features.
-
-        CHARACTER POSITION: Character standing confidently at a laboratory bench, body turned three-quarters toward the camera, one foot slightly forward in an active stance. 
-        FACIAL EXPRESSION: The character displays an excited, focused expression with bright eyes wide with discovery, eyebrows raised in surprise, and a small smile of satisfaction. 
-        BODY LANGUAGE: Leaning slightly forward with shoulders relaxed but engaged, showing curiosity and concentration. 
-        HANDS: Left hand holding a test tube up to eye level for examination, right hand pointing at a colorful chemical reaction bubbling in a beaker. 
-        THEME ELEMENTS: Character wearing a white lab coat over their regular clothes, safety goggles pushed up on their forehead, surrounded by scientific equipment including microscopes, beakers, test tubes with colorful liquids, and a periodic table poster on the wall. 
-        SETTING: Modern, well-lit laboratory with clean white surfaces, shelves lined with scientific instruments, charts and diagrams on the walls, and natural light streaming through windows. 
-        INTERACTION: The character is actively conducting a safe, colorful chemistry experiment, observing the results with scientific curiosity. 
-        PERSPECTIVE: Use a slightly low-angle shot to make the character appear capable and heroic in their scientific pursuit. 
-        LIGHTING: Bright, clean lighting with warm highlights on the character's face and cool blue tones from the laboratory equipment. 
-        DEPTH: Laboratory equipment in the foreground, character in the middleground, and educational posters and windows in the background. 
-        ACHIEVEMENT FOCUS: Include a notebook with neat observations, a small trophy or certificate in the background, and visual signs of successful experiments. 
-
-        Art style: Vibrant, child-friendly cartoon illustration with clear details and engaging colors."
-
-        ### STORY DEVELOPMENT GUIDELINES:
-        1. *Opening Scene*: Establish the character's dream or aspiration with clear visual elements showing their interest in the career/goal.
-        2. *Learning/Preparation Phase*: Show the character acquiring knowledge, skills, or tools necessary for their goal.
-        3. *Challenge/Obstacle*: Present a realistic challenge that the character must overcome, showing problem-solving and determination.
-        4. *Growth/Practice*: Demonstrate the character applying what they've learned and making progress toward their goal.
-        5. *Achievement/Success*: Conclude with the character reaching their goal or making significant progress, emphasizing the value of hard work and persistence.
-
-        IMPORTANT: Your response must be in valid JSON format with the following structure:
-        {{
-            "story_title": "Title of the story",
-            "category": "{category}",
-            "subcategory": "{subcategory}",
-            "slides": [
-                {{
-                    "slide_number": 1,
-                    "story_text": "The story text for this slide (2-3 sentences)",
-                    "image_prompt": "[Use the MANDATORY IMAGE PROMPT STRUCTURE above with all required elements]"
-                }}
-            ]
-        }}
-
-        ### QUALITY CHECKLIST FOR EVERY IMAGE PROMPT:
-        Before finalizing each image prompt, ensure it includes:
-        ✓ Specific character positioning and orientation
-        ✓ Detailed facial expression and emotions
-        ✓ Precise hand gestures and body language
-        ✓ Career/goal-specific props and clothing
-        ✓ Relevant environmental setting
-        ✓ Active interaction with theme elements
-        ✓ Appropriate camera angle and perspective
-        ✓ Clear lighting and mood description
-        ✓ Depth and composition details
-        ✓ Achievement or progress indicators
-        ✓ Child-friendly cartoon art style specification
-        ✓ If additional characters are mentioned, include a detailed description with every detail of the character in every image prompt.
-
-        Make sure EVERY image prompt:
-        - Features the main character prominently in a thematically appropriate role
-        - Shows the character actively engaged with career/goal-related activities
-        - Maintains character consistency throughout the story
-        - Includes detailed career/goal-related environmental elements
-        - Creates engaging, thematically relevant visuals that reinforce the story's message
-        - Uses dynamic positioning and expressions that bring the story to life
-        - Includes detailed description of additional characters in every image prompt if mentioned.
-
-        The main character from the uploaded avatar should be the hero/protagonist of the story and appear in every single image performing actions directly related to their career aspiration or goal achievement.
-
-        Create a complete story with exactly {num_slides} slides.
-        """
-        # prompt = clean_prompt(prompt)
-        print(prompt)
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
-
-        response_text = response.choices[0].message.content.strip()
-
-        # Clean up response text
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-
-        return prompt, json.loads(response_text)
-
-    def generate_image(self, avatar_path, prompt):
-        image_prompt = f"""
-        ### CRITICAL IMAGE GENERATION REQUIREMENTS:
-        The image must be generated based on the detailed specifications provided in the story prompt. Every element mentioned in the image prompt MUST be accurately represented.
-
-        ### MANDATORY VISUAL ELEMENTS CHECKLIST:
-        Before generating, ensure the image includes ALL of these elements as specified in the prompt:
-
-        #### CHARACTER REQUIREMENTS:
-        ✓ *Exact Character Match*: The character must match the reference image precisely
-        ✓ *Specified Position*: Use the exact body position and orientation described
-        ✓ *Facial Expression*: Capture the specific emotion and expression detailed
-        ✓ *Hand Gestures*: Show the precise hand positions and actions mentioned
-        ✓ *Body Language*: Reflect the exact posture and stance described
-        ✓ *Character Consistency*: Maintain the same appearance throughout the story
-
-        #### THEMATIC REQUIREMENTS:
-        ✓ *Career/Goal-Specific Props*: Include ALL mentioned tools, equipment, and objects
-        ✓ *Professional Clothing*: Show the exact attire and accessories specified
-        ✓ *Relevant Environment*: Create the precise setting described
-        ✓ *Achievement Elements*: Include progress indicators and success symbols
-        ✓ *Interactive Elements*: Show character actively engaging with theme-related items
+def response_slides(data, slide_numbers):
+    """The valid slides of a decoded part response, none if it was undecodable"""
+    return part_slides(data, slide_numbers) if data is not None else []
 
-        #### COMPOSITION REQUIREMENTS:
-        ✓ *Camera Angle*: Use the exact perspective specified (close-up, medium shot, wide shot, etc.)
-        ✓ *Depth Layers*: Include described foreground, middleground, and background elements
-        ✓ *Lighting*: Apply the specific mood and lighting described
-        ✓ *Visual Focus*: Emphasize the main focal points mentioned
-        ✓ *Artistic Style*: Child-friendly cartoon illustration with vibrant colors
 
-        ### Enhanced Image Types and Applications:
+def undecodable_response(call, error):
+    """Log a story response that could not be decoded; its slides stay missing"""
+    # Left missing, for the repair step to try again
+    logger.warning(f"{call} response could not be decoded: {error}")
+    return None
 
-        1. *Close-Up*: Focus tightly on the character's face to highlight emotions and career-related focus. Show the character deeply engaged in their professional thoughts or reactions to their work. Capture authentic expressions that reflect their passion for their chosen career path.
 
-        2. *Medium Shot*: Show the character from the waist up, ideal for depicting interactions with career-specific tools and equipment. This composition provides both facial expressions and body language while showing the character actively working with professional instruments.
+def validate_num_slides(num_slides) -> int:
+    """
+    Check a requested slide count against STORY_MAX_SLIDES
 
-        3. *Wide Shot (Long Shot)*: Capture the entire character within their professional environment. This shot establishes the career setting and context, showing the character's relationship with their workspace and the scope of their professional activities.
+    Args:
+        num_slides: Requested number of slides, as an int or numeric string
 
-        4. *Bird's Eye View*: An overhead perspective that showcases the character's workspace, tools, and the organization of their professional environment. This shot emphasizes the complexity and scope of their career activities.
+    Returns:
+        The slide count as an int
 
-        5. *Worm's Eye View*: A low-angle shot looking up at the character, making them appear heroic and accomplished in their professional role. Use this to convey moments of career triumph or when facing significant professional challenges.
+    Raises:
+        ValueError: If it is not a number between 1 and STORY_MAX_SLIDES
+    """
+    try:
+        num_slides = int(num_slides)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid number of slides: {num_slides}")
+    if not 1 <= num_slides <= STORY_MAX_SLIDES:
+        raise ValueError(f"Number of slides must be between 1 and {STORY_MAX_SLIDES}")
+    return num_slides
 
-        6. *Over-the-Shoulder Shot*: Taken from behind the character, focusing on their work, tools, or professional output. This technique immerses the viewer in the character's professional perspective, showing what they're creating or working on.
 
-        7. *Two-Shot*: Involves the character with a mentor, colleague, or someone they're helping in their professional capacity. This shot strengthens the connection during professional learning or teaching moments.
-
-        8. *Dutch Angle (Tilted Angle)*: Use this technique during exciting career moments, breakthrough discoveries, or when the character is overcoming professional challenges. Capture dynamic professional action.
-
-        9. *Frame Within a Frame*: Utilize career-relevant elements like computer screens, microscope views, or architectural structures to frame the subject, adding professional context and depth.
-
-        10. *Leading Lines*: Incorporate professional elements that guide the viewer's eye toward the character's work - such as assembly lines, architectural elements, or laboratory equipment arrangements.
-
-        11. *Rule of Thirds*: Place the character and their professional tools strategically within the grid to create balanced, professional compositions that highlight both the character and their career environment.
+load_dotenv()
 
-        12. *Symmetry and Balance*: Arrange professional elements evenly to create organized, professional compositions that reflect the order and precision of many careers.
 
-        13. *Asymmetry*: Use dynamic arrangements of professional tools and equipment for visual interest while maintaining professional authenticity.
+class OpenAIService:
+    def __init__(self):
+        # Retries are handled by the resilient callers, not the client
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.image_cache = ImageCache()
+        self.usage = UsageTracker()
+        self.story_template = get_prompt("story")
+        self.outline_template = get_prompt("story_outline")
+        self.expand_template = get_prompt("story_expand")
+        self.image_template = get_prompt("image")
+        self.scheduler = openai_scheduler
+        # One caller per story call type, so each hedges on its own latencies,
+        # all behind one breaker since they share the upstream
+        story_breaker = new_breaker()
+        self.story_callers = {
+            call: ResilientCaller(call, STORY_DEADLINE, breaker=story_breaker)
+            for call in STORY_CALLS
+        }
+        # A hedged stream would leave the losing stream generating tokens
+        self.story_stream_caller = ResilientCaller(
+            "story_stream", STORY_DEADLINE, hedge=False, breaker=story_breaker
+        )
+        self.image_caller = ResilientCaller("image", IMAGE_DEADLINE)
+
+    def build_story_prompt(self, category, subcategory, num_slides):
+        """Build the story generation prompt"""
+        with time_stage("story_prompt"):
+            return self.story_template.render(
+                category=category, subcategory=subcategory, num_slides=num_slides
+            )
+
+    def parse_story_response(self, response_text):
+        """Decode a story response, salvaging what it can from a broken one"""
+        PAYLOAD_BYTES.observe(len(response_text.encode("utf-8")), kind="story_response")
+        with time_stage("story_parse"):
+            return decode_story_json(response_text)
+
+    def _story_params(self, messages, schema):
+        params = {"model": STORY_MODEL, "messages": messages, "temperature": 0.7}
+        story_format = response_format(schema, STORY_RESPONSE_FORMAT)
+        if story_format is not None:
+            params["response_format"] = story_format
+        return params
+
+    def story_completion_params(self, category, subcategory, num_slides):
+        """Keyword arguments for chat.completions.create for a story"""
+        with time_stage("story_prompt"):
+            messages = self.story_template.messages(
+                category=category, subcategory=subcategory, num_slides=num_slides
+            )
+        return self._story_params(messages, Story)
+
+    def uses_outline(self, num_slides):
+        """Whether a story this long is written as an outline plus parallel parts"""
+        return 0 < STORY_OUTLINE_MIN_SLIDES <= num_slides
+
+    def story_outline_params(self, category, subcategory, num_slides):
+        """Keyword arguments for chat.completions.create for a story outline"""
+        with time_stage("story_prompt"):
+            messages = self.outline_template.messages(
+                category=category, subcategory=subcategory, num_slides=num_slides
+            )
+        return self._story_params(messages, StoryOutline)
+
+    def story_expand_params(
+        self, category, subcategory, num_slides, outline, slide_numbers
+    ):
+        """Keyword arguments for chat.completions.create for one part of a story"""
+        with time_stage("story_prompt"):
+            messages = self.expand_template.messages(
+                **self._expand_values(
+                    category, subcategory, num_slides, outline, slide_numbers
+                )
+            )
+        return self._story_params(messages, Story)
+
+    def _expand_values(self, category, subcategory, num_slides, outline, slide_numbers):
+        return {
+            "category": category,
+            "subcategory": subcategory,
+            "num_slides": num_slides,
+            "outline": json.dumps(outline, indent=2),
+            "first_slide": slide_numbers[0],
+            "last_slide": slide_numbers[-1],
+        }
+
+    def outlined_story_prompt(self, category, subcategory, num_slides, outline):
+        """
+        The prompts an outlined story was written from, as one record
 
-        14. *Foreground, Middleground, and Background*: Layer career-relevant elements at different depths - tools in foreground, character in middleground, professional environment in background.
+        The outline prompt comes first, then the shared instructions of the
+        parts and the request of each part, so the prompt stored with a story
+        is the one that actually produced it.
+        """
+        with time_stage("story_prompt"):
+            return "\n\n".join(
+                [
+                    self.outline_template.render(
+                        category=category,
+                        subcategory=subcategory,
+                        num_slides=num_slides,
+                    ),
+                    self.expand_template.static,
+                    *(
+                        self.expand_template.render_dynamic(
+                            **self._expand_values(
+                                category,
+                                subcategory,
+                                num_slides,
+                                outline,
+                                slide_numbers,
+                            )
+                        )
+                        for slide_numbers in self.story_parts(num_slides)
+                    ),
+                ]
+            )
+
+    def story_parts(self, num_slides):
+        """Slide numbers of each part of an outlined story, STORY_EXPAND_CHUNK each"""
+        return [
+            list(range(first, min(first + STORY_EXPAND_CHUNK, num_slides + 1)))
+            for first in range(1, num_slides + 1, STORY_EXPAND_CHUNK)
+        ]
+
+    def outlined_story(self, category, subcategory, num_slides, outline, slides):
+        """
+        Assemble a story from its outline and the slides written from it
+
+        Args:
+            category: Requested category, used if the outline lacks one
+            subcategory: Requested subcategory, used if the outline lacks one
+            num_slides: Number of slides the story must have
+            outline: The decoded outline response
+            slides: Valid slides written so far, in any order
+
+        Returns:
+            (story, missing) as returned by validate_story; the story also
+            carries the outline's characters
+        """
+        return validate_story(
+            {
+                "story_title": outline.get("story_title"),
+                "category": outline.get("category"),
+                "subcategory": outline.get("subcategory"),
+                "characters": outline.get("characters") or [],
+                "slides": slides,
+            },
+            category,
+            subcategory,
+            num_slides,
+        )
 
-        15. *Negative Space*: Use clean, professional spacing to emphasize the character and their most important professional tools or achievements.
+    def _complete_story(self, params, call, session_id, priority):
+        """Run one story completion with retries and return the decoded JSON"""
 
-        ### ENHANCED IMAGE GENERATION SPECIFICATIONS:
+        def attempt(timeout):
+            self.scheduler.acquire_sync(CALL_REQUEST, session_id, priority)
+            with track_upstream(call):
+                return self.client.chat.completions.create(**params, timeout=timeout)
 
-        #### THEMATIC ACCURACY REQUIREMENTS:
-        - *Career Authenticity*: All professional elements must be accurate to the specified career
-        - *Age-Appropriate Tools*: Show simplified, child-friendly versions of professional equipment
-        - *Safety Considerations*: Include appropriate safety gear and safe work practices
-        - *Inspirational Elements*: Add visual cues that inspire children about the career
-        - *Educational Value*: Include elements that teach about the profession
+        response = self.story_callers[call].call(attempt)
+        self.usage.record("story", response.usage)
 
-        #### ENVIRONMENTAL AUTHENTICITY:
-        - *Professional Settings*: Accurately represent real professional environments
-        - *Appropriate Scale*: Size elements appropriately for the character and setting
-        - *Realistic Layouts*: Arrange professional spaces logically and authentically
-        - *Supporting Details*: Include background elements that support the career theme
-        - *Context Clues*: Add visual elements that clearly indicate the professional field
+        response_text = response.choices[0].message.content
+        return self.parse_story_response(response_text)
 
-        #### CHARACTER INTERACTION REQUIREMENTS:
-        - *Active Engagement*: Show the character actively using professional tools
-        - *Competent Handling*: Demonstrate proper use of career-specific equipment
-        - *Professional Posture*: Reflect appropriate professional body language
-        - *Confident Expression*: Show the character's comfort and skill in their chosen field
-        - *Goal-Oriented Action*: Illustrate the character working toward their professional objectives
+    def _try_complete_story(self, call, params, session_id, priority):
+        """Like _complete_story, but None for a response that cannot be decoded"""
+        try:
+            return self._complete_story(params, call, session_id, priority)
+        except ValueError as e:
+            return undecodable_response(call, e)
 
-        ### ARTISTIC STYLE SPECIFICATIONS:
+    def _run_story_steps(self, steps, session_id, priority):
+        """
+        Drive a story_steps or repair_steps plan, running each batch of
+        completions in parallel on a thread pool
 
-        #### Visual Style Requirements:
-        - *Child-Friendly Aesthetic*: Bright, engaging colors that appeal to children
-        - *Clear Details*: Sharp, easily recognizable professional elements
-        - *Vibrant Colors*: Use a colorful palette that maintains professional authenticity
-        - *Smooth Textures*: Clean, polished surfaces appropriate for children's illustrations
-        - *Consistent Lighting*: Maintain consistent lighting that enhances the professional environment
+        Returns:
+            The plan's result
+        """
+        try:
+            batch = next(steps)
+            while True:
+                with ThreadPoolExecutor(
+                    max_workers=len(batch), thread_name_prefix="story-part"
+                ) as pool:
+                    responses = list(
+                        pool.map(
+                            lambda request: self._try_complete_story(
+                                *request, session_id, priority
+                            ),
+                            batch,
+                        )
+                    )
+                batch = steps.send(responses)
+        except StopIteration as done:
+            return done.value
+
+    def repair_steps(
+        self, category, subcategory, num_slides, story, missing, outline=None
+    ):
+        """
+        Plan regenerating only the missing or invalid slides of a story
+
+        Each run of consecutive missing slides is written in one call, all runs
+        of a round together, for up to STORY_REPAIR_ATTEMPTS rounds. The plan
+        makes no calls itself: it yields each round as a list of (call type,
+        completion params) and is sent back the decoded responses, None for
+        any that could not be decoded, so the sync and async services share
+        it.
+
+        Args:
+            category: Story category
+            subcategory: Story subcategory
+            num_slides: Number of slides the story must have
+            story: Story with only its valid slides, from validate_story
+            missing: Numbers of the slides to regenerate
+            outline: Outline the story was written from, if any
+
+        Returns:
+            The complete story
+
+        Raises:
+            ValueError: If slides are still missing after the last round
+        """
+        for _ in range(STORY_REPAIR_ATTEMPTS):
+            if not missing:
+                break
+            logger.info(f"Regenerating story slides {missing}")
+            STORY_REPAIRED_SLIDES.inc(len(missing))
+            runs = missing_runs(missing)
+            repair_from = outline or repair_outline(story)
+            responses = yield [
+                (
+                    "story_repair",
+                    self.story_expand_params(
+                        category, subcategory, num_slides, repair_from, slide_numbers
+                    ),
+                )
+                for slide_numbers in runs
+            ]
+            for data, slide_numbers in zip(responses, runs):
+                story = add_slides(story, response_slides(data, slide_numbers))
+            missing = missing_slides(story, num_slides)
+        if missing:
+            raise ValueError(f"Story is missing slides {missing}")
+        return story
+
+    def story_steps(self, category, subcategory, num_slides):
+        """
+        Plan writing a whole story, in the form repair_steps uses
 
-        #### Technical Specifications:
-        - *High Resolution*: Ensure all professional details are clearly visible
-        - *Balanced Composition*: Professional elements should be well-distributed
-        - *Appropriate Contrast*: Professional tools should stand out clearly
-        - *Color Harmony*: Professional colors should complement the overall palette
-        - *Detail Clarity*: Career-specific elements must be easily identifiable
+        Short stories are one call; long ones (see uses_outline) an outline
+        and then all of its parts at once. Missing slides are repaired.
 
-        ### IMAGE PROMPT PROCESSING:
-        {prompt}
+        Returns:
+            (prompt, story_data), where prompt records the prompts sent
 
-        ### MANDATORY GENERATION REQUIREMENTS:
+        Raises:
+            ValueError: If the story or its outline cannot be decoded, or
+                slides are still missing after repairs
+        """
+        if not self.uses_outline(num_slides):
+            prompt = self.build_story_prompt(category, subcategory, num_slides)
+            logger.debug(f"Story prompt: {prompt}")
+            [data] = yield [
+                (
+                    "story",
+                    self.story_completion_params(category, subcategory, num_slides),
+                )
+            ]
+            if data is None:
+                raise ValueError("Story response is not valid JSON")
+            story, missing = validate_story(data, category, subcategory, num_slides)
+            story = yield from self.repair_steps(
+                category, subcategory, num_slides, story, missing
+            )
+            return prompt, story
+
+        [outline] = yield [
+            (
+                "story_outline",
+                self.story_outline_params(category, subcategory, num_slides),
+            )
+        ]
+        if outline is None:
+            raise ValueError("Story outline is not valid JSON")
+        parts = self.story_parts(num_slides)
+        responses = yield [
+            (
+                "story_expand",
+                self.story_expand_params(
+                    category, subcategory, num_slides, outline, slide_numbers
+                ),
+            )
+            for slide_numbers in parts
+        ]
+        slides = [
+            slide
+            for data, slide_numbers in zip(responses, parts)
+            for slide in response_slides(data, slide_numbers)
+        ]
+        story, missing = self.outlined_story(
+            category, subcategory, num_slides, outline, slides
+        )
+        story = yield from self.repair_steps(
+            category, subcategory, num_slides, story, missing, outline=outline
+        )
+        prompt = self.outlined_story_prompt(category, subcategory, num_slides, outline)
+        return prompt, story
+
+    def repair_story(
+        self,
+        category,
+        subcategory,
+        num_slides,
+        story,
+        missing,
+        session_id=None,
+        priority=PRIORITY_INTERACTIVE,
+        outline=None,
+    ):
+        """Regenerate only the missing or invalid slides of a story (see repair_steps)"""
+        return self._run_story_steps(
+            self.repair_steps(
+                category, subcategory, num_slides, story, missing, outline
+            ),
+            session_id,
+            priority,
+        )
 
-        *1. CHARACTER FIDELITY*: The character must exactly match the reference image in all physical characteristics while being placed in the specified professional context.
+    def generate_story(
+        self,
+        category,
+        subcategory,
+        num_slides,
+        session_id=None,
+        priority=PRIORITY_INTERACTIVE,
+    ):
+        """Generate story using OpenAI"""
+        num_slides = validate_num_slides(num_slides)
+        return self._run_story_steps(
+            self.story_steps(category, subcategory, num_slides), session_id, priority
+        )
 
-        *2. THEMATIC INTEGRATION*: Every career-related element mentioned in the prompt must be accurately represented and integrated naturally into the scene.
+    def _generate_outlined_story(
+        self, category, subcategory, num_slides, session_id, priority
+    ):
+        """
+        Write the outline, then expand its parts in parallel
 
-        *3. PROFESSIONAL AUTHENTICITY*: All career-specific tools, clothing, and environments must be authentic to the profession while being appropriate for children.
+        Yields ("prompt", prompt), ("title", story_title) and ("characters",
+        characters) once the outline is back, ("slide", slide) for every slide
+        in order as soon as it is written and finally ("story", (prompt,
+        story_data)) once missing slides have been repaired, where prompt
+        records every prompt sent.
+        """
+        outline = self._complete_story(
+            self.story_outline_params(category, subcategory, num_slides),
+            "story_outline",
+            session_id,
+            priority,
+        )
+        prompt = self.outlined_story_prompt(category, subcategory, num_slides, outline)
+        yield "prompt", prompt
+        story, _ = self.outlined_story(category, subcategory, num_slides, outline, [])
+        yield "title", story["story_title"]
+        yield "characters", story["characters"]
+
+        in_order = InOrderSlides()
+        slides = []
+        parts = self.story_parts(num_slides)
+        with ThreadPoolExecutor(
+            max_workers=len(parts), thread_name_prefix="story-part"
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self._try_complete_story,
+                    "story_expand",
+                    self.story_expand_params(
+                        category, subcategory, num_slides, outline, slide_numbers
+                    ),
+                    session_id,
+                    priority,
+                )
+                for slide_numbers in parts
+            ]
+            for future, slide_numbers in zip(futures, parts):
+                part = response_slides(future.result(), slide_numbers)
+                slides.extend(part)
+                for slide in in_order.add(part):
+                    yield "slide", slide
+
+        story, missing = self.outlined_story(
+            category, subcategory, num_slides, outline, slides
+        )
+        story = self.repair_story(
+            category,
+            subcategory,
+            num_slides,
+            story,
+            missing,
+            session_id,
+            priority,
+            outline=outline,
+        )
+        for slide in in_order.add(story["slides"]):
+            yield "slide", slide
+        yield "story", (prompt, story)
+
+    def generate_story_stream(
+        self,
+        category,
+        subcategory,
+        num_slides,
+        session_id=None,
+        priority=PRIORITY_INTERACTIVE,
+    ):
+        """
+        Generate a story, yielding each slide as soon as it has been written
+
+        Yields ("prompt", prompt) first, ("title", story_title) once the
+        title is known, ("characters", characters) before the first slide,
+        ("slide", slide) for every valid slide, in order, and finally
+        ("story", (prompt, story_data)) with the validated story. Slides that
+        are missing or invalid are regenerated once the stream ends and
+        yielded then.
+
+        Long stories (see uses_outline) are written as an outline and then
+        expanded in parallel parts, whose slides are yielded in order as each
+        part arrives.
+        """
+        num_slides = validate_num_slides(num_slides)
+        if self.uses_outline(num_slides):
+            yield from self._generate_outlined_story(
+                category, subcategory, num_slides, session_id, priority
+            )
+            return
+
+        prompt = self.build_story_prompt(category, subcategory, num_slides)
+        yield "prompt", prompt
+
+        params = self.story_completion_params(category, subcategory, num_slides)
+
+        def attempt(timeout):
+            self.scheduler.acquire_sync(CALL_REQUEST, session_id, priority)
+            # Covers opening the stream, i.e. the time to the first token
+            with track_upstream("story_stream"):
+                return self.client.chat.completions.create(
+                    **params,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout,
+                )
 
-        *4. ACTIVE ENGAGEMENT*: The character must be shown actively participating in career-related activities, not just posing with professional props.
+        # Only opening the stream is retried; slides already yielded cannot be
+        # taken back if the connection drops part way through
+        stream = self.story_stream_caller.call(attempt)
+
+        parser = SlideStreamParser()
+        in_order = InOrderSlides()
+        streamed = 0
+        title_sent = False
+        characters_sent = None
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                self.usage.record("story", chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            slides = parser.feed(delta)
+            if parser.story_title is not None and not title_sent:
+                title_sent = True
+                yield "title", parser.story_title
+            # A slide that is not valid JSON comes back as None; it is left
+            # missing and regenerated once the stream ends
+            valid = []
+            for raw in slides:
+                streamed += 1
+                slide = parse_slide(raw, streamed)
+                if slide is not None:
+                    valid.append(slide)
+            released = in_order.add(valid)
+            if released and characters_sent is None:
+                # Slides' image prompts only name the characters
+                characters_sent = parse_characters(parser.characters)
+                yield "characters", characters_sent
+            for slide in released:
+                yield "slide", slide
+
+        data = self.parse_story_response(parser.text)
+        story, missing = validate_story(data, category, subcategory, num_slides)
+        if not title_sent:
+            yield "title", story["story_title"]
+        if story["characters"] != characters_sent:
+            yield "characters", story["characters"]
+        story = self.repair_story(
+            category, subcategory, num_slides, story, missing, session_id, priority
+        )
+        for slide in in_order.add(story["slides"]):
+            yield "slide", slide
+        yield "story", (prompt, story)
 
-        *5. EDUCATIONAL VALUE*: The image should clearly communicate information about the career or goal being pursued.
+    def render_image_prompt(self, prompt, characters=None):
+        """
+        Wrap a slide's image prompt, adding the story characters it names
 
-        *6. INSPIRATIONAL QUALITY*: The image should inspire children to consider the career path and see it as achievable.
+        Args:
+            prompt: The slide's image prompt
+            characters: The story's characters, written once per story
 
-        *7. SAFETY CONSCIOUSNESS*: Include appropriate safety measures and equipment where relevant to the profession.
+        Returns:
+            The full prompt sent to the image API
+        """
+        named = characters_in(prompt, characters or [])
+        sheet = ""
+        if named:
+            sheet = IMAGE_CHARACTERS.format(
+                characters="\n".join(
+                    f"- {character['name']}: {character['description']}"
+                    for character in named
+                )
+            )
+        return self.image_template.render(prompt=prompt, characters=sheet)
 
-        *8. AGE-APPROPRIATE REPRESENTATION*: Simplify complex professional concepts while maintaining accuracy.
+    def prepare_image_request(
+        self, avatar_bytes, prompt, characters=None, tier=TIER_FINAL
+    ):
+        """
+        Build everything an image call needs and check the image cache
 
-        *Maintain the same artistic style and texture as the reference image provided. Ensure visual characteristics such as color, lighting, and detail match closely, creating a harmonious overall aesthetic.*
+        Returns a dict with the wrapped image_prompt, avatar_bytes, the tier's
+        API parameters, cache_key and cached_base64 (set when the image is
+        already cached).
+        """
+        params = tier_params(tier)
+        with time_stage("image_prompt"):
+            image_prompt = self.render_image_prompt(prompt, characters)
+        logger.debug(f"Image prompt: {image_prompt}")
+        with time_stage("image_cache_lookup"):
+            cache_key = ImageCache.make_key(
+                avatar_bytes,
+                image_prompt,
+                IMAGE_MODEL,
+                IMAGE_SIZE,
+                IMAGE_OUTPUT_FORMAT,
+                options=params,
+            )
+            cached = self.image_cache.get(cache_key)
+        cached_base64 = None
+        if cached is not None:
+            with time_stage("image_encode"):
+                cached_base64 = base64.b64encode(cached).decode("utf-8")
+        return {
+            "image_prompt": image_prompt,
+            "avatar_bytes": avatar_bytes,
+            "tier_params": params,
+            "cache_key": cache_key,
+            "cached_base64": cached_base64,
+        }
+
+    def image_edit_params(self, image_request):
+        """Keyword arguments for images.edit for a prepared request"""
+        PAYLOAD_BYTES.observe(len(image_request["avatar_bytes"]), kind="avatar_sent")
+        return {
+            "model": IMAGE_MODEL,
+            "image": (AVATAR_FILENAME, image_request["avatar_bytes"]),
+            "prompt": image_request["image_prompt"],
+            "size": IMAGE_SIZE,
+            "output_format": IMAGE_OUTPUT_FORMAT,
+            **image_request["tier_params"],
+        }
+
+    def finish_image_request(self, image_request, result):
+        """Record usage, cache the generated image and return its base64"""
+        self.usage.record("image", getattr(result, "usage", None))
+        image_base64 = result.data[0].b64_json
+        with time_stage("image_decode"):
+            image_bytes = base64.b64decode(image_base64)
+        PAYLOAD_BYTES.observe(len(image_bytes), kind="image_generated")
+        with time_stage("image_cache_store"):
+            self.image_cache.put(image_request["cache_key"], image_bytes)
+        return image_base64
+
+    def generate_image(
+        self,
+        avatar_bytes,
+        prompt,
+        session_id=None,
+        priority=PRIORITY_NORMAL,
+        characters=None,
+        tier=TIER_FINAL,
+    ):
+        """
+        Generate a slide image from the avatar's normalised bytes
 
-        *Focus on capturing natural, career-focused actions of the character, ensuring they appear genuinely engaged in their professional activities. The character should be immersed in their work environment, demonstrating competence and enthusiasm for their chosen career path.*
+        The descriptions of the story characters the prompt names are added
+        to it here, so the story only has to describe each character once.
+        The tier (see image_tiers.py) picks the quality it is rendered at.
 
-        ### QUALITY VERIFICATION:
-        Before finalizing the image, verify:
-        - All specified career elements are present and accurate
-        - Character matches reference image exactly
-        - Professional environment is authentic and appropriate
-        - Character is actively engaged in career-related activities
-        - Image inspires and educates about the career path
-        - Artistic style is consistent and child-friendly
-        - All safety and age-appropriate considerations are met
+        Returns (image_base64, image_prompt). Raises the underlying error once
+        retries are exhausted, CircuitOpenError while the breaker is open and
+        DeadlineExceededError when the call runs out of time.
         """
-        print(image_prompt)
-        try:
-            with open(avatar_path, "rb") as avatar_file:
-                result = self.client.images.edit(
-                    model="gpt-image-1",
-                    image=avatar_file,
-                    prompt=image_prompt,
-                    size="1024x1024",
-                    output_format="jpeg",
-                )
-                return result.data[0].b64_json, image_prompt
-        except Exception as e:
-            print(f"Error with image editing: {e}")
+        image_request = self.prepare_image_request(
+            avatar_bytes, prompt, characters, tier
+        )
+        if image_request["cached_base64"] is not None:
+            return image_request["cached_base64"], image_request["image_prompt"]
+
+        params = self.image_edit_params(image_request)
+
+        def attempt(timeout):
+            self.scheduler.acquire_sync(CALL_IMAGE, session_id, priority)
+            with track_upstream("image"):
+                return self.client.images.edit(**params, timeout=timeout)
+
+        result = self.image_caller.call(attempt)
+        image_base64 = self.finish_image_request(image_request, result)
+        return image_base64, image_request["image_prompt"]
+
+    def resilience_stats(self):
+        """Retry, breaker and latency statistics per call type"""
+        callers = [
+            *self.story_callers.values(),
+            self.story_stream_caller,
+            self.image_caller,
+        ]
+        return {caller.name: caller.stats() for caller in callers}
@@ -0,0 +1,288 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import itertools
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from async_runtime import async_runtime
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+CALL_REQUEST = "request"
+CALL_IMAGE = "image"
+
+
+def slide_priority(index: int) -> int:
+    """The first slide is the one the user is looking at, so it goes first"""
+    return PRIORITY_INTERACTIVE if index == 0 else PRIORITY_NORMAL
+
+
+class TokenBucketStore:
+    def __init__(self, path: str, burst_seconds: float):
+        """
+        Token buckets kept in SQLite so every worker process shares them
+
+        Args:
+            path: SQLite database file, on a local disk of the host all
+                workers run on; WAL mode does not work over a network
+                filesystem
+            burst_seconds: Bucket capacity expressed as seconds of refill
+        """
+        self.path = path
+        self.burst_seconds = burst_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def try_take(self, limits: List[Tuple[str, int]]) -> float:
+        """
+        Take one token from every bucket, or none if any of them is empty
+
+        Args:
+            limits: (bucket name, limit per minute) pairs
+
+        Returns:
+            0 if the tokens were taken, otherwise seconds until they will be
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            wait = 0.0
+            for name, per_minute in limits:
+                rate = per_minute / 60.0
+                capacity = max(1.0, rate * self.burst_seconds)
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                tokens = capacity
+                if row is not None:
+                    tokens = min(capacity, row[0] + (now - row[1]) * rate)
+                levels.append((name, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+
+            for name, tokens in levels:
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    (name, tokens - 1 if wait == 0 else tokens, now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def levels(self) -> Dict[str, float]:
+        """Current (last stored) token level per bucket"""
+        rows = self._connect().execute("SELECT name, tokens FROM buckets").fetchall()
+        return {name: round(tokens, 2) for name, tokens in rows}
+
+
+class _Waiter:
+    def __init__(self, kind, session_id, priority, seq, future):
+        self.kind = kind
+        self.session_id = session_id
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class OpenAIScheduler:
+    def __init__(self):
+        """
+        Gate every outbound OpenAI call behind shared rate limits
+
+        Requests-per-minute applies to every call and images-per-minute to
+        image calls, enforced with token buckets shared across workers. While
+        calls are waiting for tokens they are granted in priority order, and
+        within a priority round-robin across sessions, so one long story
+        cannot starve everyone else.
+        """
+        self.requests_per_minute = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+        self.images_per_minute = int(os.getenv("OPENAI_IMAGES_PER_MINUTE", "0"))
+        self.buckets = None
+        if self.requests_per_minute or self.images_per_minute:
+            self.buckets = TokenBucketStore(
+                os.getenv("RATE_LIMIT_DB", "cache/rate_limits.sqlite3"),
+                float(os.getenv("OPENAI_RATE_BURST_SECONDS", "10")),
+            )
+
+        self._waiters: List[_Waiter] = []
+        self._served: Dict[Optional[str], int] = defaultdict(int)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._stats_lock = threading.Lock()
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        logger.info(
+            f"OpenAI scheduler initialized (rpm={self.requests_per_minute}, "
+            f"ipm={self.images_per_minute})"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.buckets is not None
+
+    def _limits_for(self, kind: str) -> List[Tuple[str, int]]:
+        limits = []
+        if self.requests_per_minute:
+            limits.append(("requests", self.requests_per_minute))
+        if kind == CALL_IMAGE and self.images_per_minute:
+            limits.append(("images", self.images_per_minute))
+        return limits
+
+    async def acquire(
+        self,
+        kind: str,
+        session_id: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+    ):
+        """
+        Wait until a call of the given kind may be sent
+
+        Must be awaited on the shared async runtime loop.
+
+        Args:
+            kind: CALL_REQUEST or CALL_IMAGE
+            session_id: Session the call is made for, used for fairness
+            priority: PRIORITY_INTERACTIVE, PRIORITY_NORMAL or PRIORITY_BACKGROUND
+        """
+        if not self.enabled or not self._limits_for(kind):
+            self._record_wait(0.0)
+            return
+
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+        waiter = _Waiter(
+            kind,
+            session_id,
+            priority,
+            next(self._seq),
+            asyncio.get_running_loop().create_future(),
+        )
+        self._waiters.append(waiter)
+        self._wakeup.set()
+        await waiter.future
+
+    def acquire_sync(
+        self,
+        kind: str,
+        session_id: Optional[str] = None,
+        priority: int = PRIORITY_NORMAL,
+    ):
+        """Blocking form of acquire for threads outside the async runtime"""
+        if not self.enabled:
+            self._record_wait(0.0)
+            return
+        async_runtime.submit(self.acquire(kind, session_id, priority)).result()
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            waiter = min(
+                self._waiters,
+                key=lambda w: (w.priority, self._served[w.session_id], w.seq),
+            )
+            if waiter.future.cancelled():
+                self._remove(waiter)
+                continue
+
+            try:
+                wait = await asyncio.to_thread(
+                    self.buckets.try_take, self._limits_for(waiter.kind)
+                )
+            except Exception as e:
+                logger.error(f"Rate limiter unavailable, letting call through: {e}")
+                wait = 0.0
+            if wait > 0:
+                # Re-evaluate soon in case a higher-priority call has arrived
+                await asyncio.sleep(min(wait, 0.5))
+                continue
+
+            self._remove(waiter)
+            self._served[waiter.session_id] += 1
+            self._record_wait(time.monotonic() - waiter.enqueued_at)
+            if not waiter.future.cancelled():
+                waiter.future.set_result(None)
+
+    def _remove(self, waiter: _Waiter):
+        self._waiters.remove(waiter)
+        if not any(w.session_id == waiter.session_id for w in self._waiters):
+            self._served.pop(waiter.session_id, None)
+
+    def _record_wait(self, wait: float):
+        with self._stats_lock:
+            self.granted += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict:
+        """
+        Get queue depth, wait times and bucket levels
+
+        Returns:
+            Dictionary of scheduler statistics for this worker
+        """
+        waiters = list(self._waiters)
+        now = time.monotonic()
+        by_priority = defaultdict(int)
+        for waiter in waiters:
+            by_priority[waiter.priority] += 1
+        with self._stats_lock:
+            stats = {
+                "enabled": self.enabled,
+                "requests_per_minute": self.requests_per_minute,
+                "images_per_minute": self.images_per_minute,
+                "queue_depth": len(waiters),
+                "queue_depth_by_priority": dict(by_priority),
+                "queued_sessions": len({w.session_id for w in waiters}),
+                "oldest_wait_seconds": round(
+                    max((now - w.enqueued_at for w in waiters), default=0.0), 3
+                ),
+                "granted": self.granted,
+                "average_wait_seconds": (
+                    round(self.total_wait / self.granted, 3) if self.granted else 0.0
+                ),
+                "max_wait_seconds": round(self.max_wait, 3),
+            }
+        if self.enabled:
+            stats["bucket_levels"] = self.buckets.levels()
+        return stats
+
+
+# Global instance for easy access
+openai_scheduler = OpenAIScheduler()
@@ -0,0 +1,390 @@
+import os
+import time
+import random
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Optional
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when calls are short-circuited after repeated upstream failures"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call and its retries run past the call deadline"""
+
+
+def close_result(result):
+    """
+    Release a result nobody will read, such as a stream that lost a hedge race
+
+    Returns:
+        What the result's close() returned; async results return a coroutine
+        the caller must await
+    """
+    close = getattr(result, "close", None)
+    if callable(close):
+        try:
+            return close()
+        except Exception as e:
+            logger.warning(f"Could not close discarded result: {e}")
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Decide whether an OpenAI error is worth retrying
+
+    Args:
+        error: The exception raised by the client
+
+    Returns:
+        True for timeouts, connection errors, rate limits and server errors
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def _close_future_result(future):
+    if not future.cancelled() and future.exception() is None:
+        close_result(future.result())
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        Stop calling an upstream that keeps failing, then probe it again
+
+        Once the reset timeout has passed, a single probe call is let through;
+        the others keep failing fast until it succeeds. A probe that has not
+        reported back within another reset timeout is replaced by a new one.
+
+        Args:
+            failure_threshold: Consecutive retryable failures before opening
+            reset_timeout: Seconds to stay open before letting a probe through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    def _state_locked(self) -> str:
+        # Caller holds self._lock
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state_locked()
+
+    def before_call(self):
+        """Raise CircuitOpenError while the breaker is open or already probing"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            state = self._state_locked()
+            if state == "closed":
+                return
+            now = time.monotonic()
+            if state == "half_open" and (
+                self.probe_started_at is None
+                or now - self.probe_started_at >= self.reset_timeout
+            ):
+                self.probe_started_at = now
+                return
+        raise CircuitOpenError("Upstream is failing, try again shortly")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started_at = None
+            if self.failure_threshold and self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuit breaker opened")
+                self.opened_at = time.monotonic()
+
+    def record_other_error(self):
+        """A call failed for a reason that says nothing about the upstream"""
+        with self._lock:
+            self.probe_started_at = None
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        """Rolling window of successful call latencies"""
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Latency at the given percentile, or None without any samples
+
+        Args:
+            percent: Percentile between 0 and 100
+        """
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+def new_breaker() -> CircuitBreaker:
+    """A circuit breaker configured from the environment"""
+    return CircuitBreaker(
+        int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5")),
+        float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+    )
+
+
+class ResilientCaller:
+    def __init__(
+        self,
+        name: str,
+        deadline: float,
+        hedge: bool = True,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """
+        Retry, deadline, circuit-breaker and hedging policy for one call type
+
+        The wrapped attempt function receives the remaining time budget in
+        seconds so it can pass it on as the client timeout. Latencies are
+        tracked per caller, so each call type needs its own caller for the
+        hedge delay to mean anything.
+
+        Args:
+            name: Call type, used in logs and stats
+            deadline: Total seconds allowed for the call including retries
+            hedge: False for calls that must never be duplicated, such as
+                opening a stream whose loser would keep generating tokens
+            breaker: Breaker shared with other call types to the same
+                upstream; a new one is created if omitted
+        """
+        self.name = name
+        self.deadline = deadline
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        self.backoff_base = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+        self.hedge_percentile = (
+            float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0")) if hedge else 0.0
+        )
+        self.hedge_min_samples = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+        self.breaker = breaker or new_breaker()
+        self.latencies = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._hedge_executor = None
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given retry attempt"""
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * (2**attempt))
+        )
+
+    def hedge_after(self) -> Optional[float]:
+        """Seconds after which a hedged request is fired, or None if disabled"""
+        if not self.hedge_percentile:
+            return None
+        if len(self.latencies.samples) < self.hedge_min_samples:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def call(self, attempt: Callable[[float], object]):
+        """
+        Run a blocking call under the policy
+
+        Args:
+            attempt: Function taking the remaining seconds and making one call
+
+        Returns:
+            The result of the first successful attempt
+        """
+        self.breaker.before_call()
+        deadline_at = time.monotonic() + self.deadline
+        for attempt_number in range(self.max_retries + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError(f"{self.name} call exceeded its deadline")
+            started = time.monotonic()
+            try:
+                result = self._hedged(attempt, remaining)
+            except Exception as e:
+                if not self._should_retry(e, attempt_number, deadline_at):
+                    raise
+                time.sleep(self._retry_delay(attempt_number, deadline_at))
+                continue
+            self._record_success(time.monotonic() - started)
+            return result
+
+    async def acall(self, attempt: Callable[[float], Awaitable]):
+        """
+        Run an async call under the policy
+
+        Args:
+            attempt: Function taking the remaining seconds and returning a
+                coroutine that makes one call
+
+        Returns:
+            The result of the first successful attempt
+        """
+        self.breaker.before_call()
+        deadline_at = time.monotonic() + self.deadline
+        for attempt_number in range(self.max_retries + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError(f"{self.name} call exceeded its deadline")
+            started = time.monotonic()
+            try:
+                result = await self._ahedged(attempt, remaining)
+            except Exception as e:
+                if not self._should_retry(e, attempt_number, deadline_at):
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt_number, deadline_at))
+                continue
+            self._record_success(time.monotonic() - started)
+            return result
+
+    def stats(self) -> Dict:
+        """
+        Get retry, hedging, breaker and latency statistics
+
+        Returns:
+            Dictionary of statistics for this call type
+        """
+        return {
+            "breaker_state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_seconds": self.latencies.percentile(50),
+            "p95_seconds": self.latencies.percentile(95),
+            "p99_seconds": self.latencies.percentile(99),
+        }
+
+    def _should_retry(self, error: Exception, attempt_number: int, deadline_at):
+        if not is_retryable(error):
+            self.breaker.record_other_error()
+            return False
+        self.breaker.record_failure()
+        out_of_time = deadline_at - time.monotonic() <= 0
+        if attempt_number >= self.max_retries or out_of_time:
+            return False
+        self.breaker.before_call()
+        logger.warning(f"Retrying {self.name} call after error: {error}")
+        self.retries += 1
+        return True
+
+    def _retry_delay(self, attempt_number: int, deadline_at: float) -> float:
+        return max(
+            0.0,
+            min(self.backoff(attempt_number), deadline_at - time.monotonic()),
+        )
+
+    def _record_success(self, elapsed: float):
+        self.breaker.record_success()
+        self.latencies.add(elapsed)
+
+    def _hedged(self, attempt, remaining: float):
+        hedge_after = self.hedge_after()
+        if hedge_after is None or hedge_after >= remaining:
+            return attempt(remaining)
+
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix=f"{self.name}-hedge"
+            )
+        started = time.monotonic()
+        primary = self._hedge_executor.submit(attempt, remaining)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedge = self._hedge_executor.submit(
+            attempt, remaining - (time.monotonic() - started)
+        )
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    # A blocking request cannot be cancelled mid-flight; the
+                    # loser is closed as soon as it returns
+                    for loser in {primary, hedge} - {future}:
+                        loser.add_done_callback(_close_future_result)
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    async def _ahedged(self, attempt, remaining: float):
+        hedge_after = self.hedge_after()
+        if hedge_after is None or hedge_after >= remaining:
+            return await attempt(remaining)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt(remaining))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedge = asyncio.ensure_future(attempt(remaining - (time.monotonic() - started)))
+        pending = {primary, hedge}
+        first_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        # Both may have finished in the same step
+                        for loser in done - {task}:
+                            if loser.exception() is None:
+                                closing = close_result(loser.result())
+                                if inspect.isawaitable(closing):
+                                    await closing
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
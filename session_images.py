@@ -0,0 +1,40 @@
+"""
+Saving generated slide images
+
+Every generation path (per-slide routes, in-process jobs and queue workers)
+stores its images through save_session_image, so they are decoded, written,
+tagged with their tier and given preview variants the same way.
+"""
+
+import base64
+
+from image_tiers import write_image_tier
+from metrics import time_stage
+
+
+def save_session_image(
+    session_store,
+    session_id: str,
+    filename: str,
+    image_base64: str,
+    tier: str,
+    image_variants=None,
+):
+    """
+    Decode a generated image once and store it in the session
+
+    Args:
+        session_store: Store holding the session
+        session_id: The session the image belongs to
+        filename: Name of the image in the session
+        image_base64: The image as returned by the API
+        tier: Image tier it was rendered at
+        image_variants: Renders previews and thumbnails of saved images
+    """
+    with time_stage("image_decode"):
+        image_bytes = base64.b64decode(image_base64)
+    with time_stage("session_write"):
+        session_store.write(session_id, filename, image_bytes)
+        write_image_tier(session_store, session_id, filename, tier)
+    if image_variants is not None:
+        image_variants.schedule(session_id, filename)
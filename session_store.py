@@ -0,0 +1,291 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+AVATAR_FILENAME = "avatar.jpg"
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{3,64}$")
+FILENAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class InvalidSessionError(ValueError):
+    """Raised for session ids or file names that could escape the store"""
+
+
+def _check(session_id: str, name: Optional[str] = None):
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise InvalidSessionError(f"Invalid session id: {session_id}")
+    if name is not None and (not FILENAME_PATTERN.match(name) or name.startswith(".")):
+        raise InvalidSessionError(f"Invalid session file name: {name}")
+
+
+class SessionStore(ABC):
+    """
+    Storage for everything belonging to a session: the avatar, story and
+    prompt JSON, and generated images, addressed by (session id, file name)
+    """
+
+    @abstractmethod
+    def write(self, session_id: str, name: str, data: bytes):
+        pass
+
+    @abstractmethod
+    def read(self, session_id: str, name: str) -> Optional[bytes]:
+        """Contents of a session file, or None if it does not exist"""
+
+    @abstractmethod
+    def version(self, session_id: str, name: str) -> Optional[int]:
+        """Value that changes whenever the file is rewritten, None if missing"""
+
+    @abstractmethod
+    def list_files(self, session_id: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+    @abstractmethod
+    def list_sessions(self) -> List[Tuple[float, int, str]]:
+        """(last write time, total bytes, session id) for every session"""
+
+    def local_path(self, session_id: str, name: str) -> Optional[str]:
+        """Path of the file on local disk, if the backend keeps one"""
+        return None
+
+    def exists(self, session_id: str, name: str) -> bool:
+        return self.version(session_id, name) is not None
+
+    def read_json(self, session_id: str, name: str) -> Any:
+        data = self.read(session_id, name)
+        return json.loads(data) if data is not None else None
+
+    def write_json(self, session_id: str, name: str, value: Any):
+        self.write(session_id, name, json.dumps(value).encode("utf-8"))
+
+
+class LocalSessionStore(SessionStore):
+    def __init__(self, root: str):
+        """
+        Sessions as directories on local disk
+
+        Directories are sharded by the first two characters of the session id
+        so no single directory grows to hundreds of thousands of entries.
+
+        Args:
+            root: Directory all sessions are kept under
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def session_dir(self, session_id: str) -> str:
+        _check(session_id)
+        return os.path.join(self.root, session_id[:2], session_id)
+
+    def _path(self, session_id: str, name: str) -> str:
+        _check(session_id, name)
+        return os.path.join(self.session_dir(session_id), name)
+
+    def write(self, session_id: str, name: str, data: bytes):
+        directory = self.session_dir(session_id)
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so readers never see a partly written file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(session_id, name))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read(self, session_id: str, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(session_id, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def version(self, session_id: str, name: str) -> Optional[int]:
+        try:
+            return os.stat(self._path(session_id, name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def list_files(self, session_id: str) -> List[str]:
+        try:
+            return sorted(
+                entry.name
+                for entry in os.scandir(self.session_dir(session_id))
+                if entry.is_file() and not entry.name.startswith(".")
+            )
+        except FileNotFoundError:
+            return []
+
+    def delete(self, session_id: str):
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+        # Session directories created before sharding
+        shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+
+    def local_path(self, session_id: str, name: str) -> Optional[str]:
+        return self._path(session_id, name)
+
+    def list_sessions(self) -> List[Tuple[float, int, str]]:
+        sessions = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir(follow_symlinks=False):
+                continue
+            if len(shard.name) == 2:
+                candidates = list(os.scandir(shard.path))
+            else:
+                candidates = [shard]
+            for entry in candidates:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    last_used, size = self._scan_session(entry.path)
+                except FileNotFoundError:
+                    continue
+                sessions.append((last_used, size, entry.name))
+        return sessions
+
+    @staticmethod
+    def _scan_session(path: str) -> Tuple[float, int]:
+        # Last activity is the newest mtime in the session, since every upload,
+        # story and generated image writes a file there
+        last_used = os.stat(path).st_mtime
+        size = 0
+        for entry in os.scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                size += stat.st_size
+                last_used = max(last_used, stat.st_mtime)
+        return last_used, size
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path: str):
+        """
+        Sessions as blobs in a SQLite database
+
+        Every process on the host shares the database, so any gunicorn
+        worker can serve any session without sticky sessions. It is kept in
+        WAL mode, which needs all of its processes on one host: it must not
+        be put on a network filesystem shared between machines.
+
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_files ("
+                "session_id TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, "
+                "size INTEGER NOT NULL, updated_ns INTEGER NOT NULL, "
+                "PRIMARY KEY (session_id, name))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def write(self, session_id: str, name: str, data: bytes):
+        _check(session_id, name)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO session_files "
+            "(session_id, name, data, size, updated_ns) VALUES (?, ?, ?, ?, ?)",
+            (session_id, name, data, len(data), time.time_ns()),
+        )
+
+    def read(self, session_id: str, name: str) -> Optional[bytes]:
+        _check(session_id, name)
+        row = (
+            self._connect()
+            .execute(
+                "SELECT data FROM session_files WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            )
+            .fetchone()
+        )
+        return bytes(row[0]) if row else None
+
+    def version(self, session_id: str, name: str) -> Optional[int]:
+        _check(session_id, name)
+        row = (
+            self._connect()
+            .execute(
+                "SELECT updated_ns FROM session_files "
+                "WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def list_files(self, session_id: str) -> List[str]:
+        _check(session_id)
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT name FROM session_files WHERE session_id = ? ORDER BY name",
+                (session_id,),
+            )
+            .fetchall()
+        )
+        return [row[0] for row in rows]
+
+    def delete(self, session_id: str):
+        _check(session_id)
+        self._connect().execute(
+            "DELETE FROM session_files WHERE session_id = ?", (session_id,)
+        )
+
+    def list_sessions(self) -> List[Tuple[float, int, str]]:
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT MAX(updated_ns), SUM(size), session_id FROM session_files "
+                "GROUP BY session_id"
+            )
+            .fetchall()
+        )
+        return [
+            (updated_ns / 1e9, size, session_id)
+            for updated_ns, size, session_id in rows
+        ]
+
+
+def create_session_store() -> SessionStore:
+    """
+    Build the session store selected by the SESSION_STORE environment variable
+
+    Returns:
+        A LocalSessionStore ("local", the default) or SqliteSessionStore ("sqlite")
+    """
+    backend = os.getenv("SESSION_STORE", "local")
+    if backend == "local":
+        store = LocalSessionStore(os.getenv("SESSIONS_ROOT", "static/avatars"))
+    elif backend == "sqlite":
+        store = SqliteSessionStore(os.getenv("SESSION_DB", "cache/sessions.sqlite3"))
+    else:
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+    logger.info(f"Session store: {backend}")
+    return store
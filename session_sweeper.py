@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSweeper:
+    def __init__(self, store, protect: Optional[Callable[[], Set[str]]] = None):
+        """
+        Background sweeper deleting abandoned sessions
+
+        Sessions idle for longer than SESSION_TTL seconds are removed, then the
+        least recently used ones until the total is under SESSION_MAX_BYTES.
+
+        Args:
+            store: The session store to sweep
+            protect: Returns session ids that must not be removed right now,
+                e.g. sessions with images still being generated
+        """
+        self.store = store
+        self.ttl = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+        self.max_bytes = int(os.getenv("SESSION_MAX_BYTES", "0"))
+        self.interval = int(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+        self.protect = protect or set
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.footprint_bytes = 0
+        self.reclaimed_sessions = 0
+        self.reclaimed_bytes = 0
+        self.last_sweep_at = None
+        self.last_sweep_seconds = None
+
+    def start(self):
+        """Start the sweeper thread if it is not running yet"""
+        if self._thread is not None or not (self.ttl or self.max_bytes):
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="session-sweeper", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Session sweeper started (ttl={self.ttl}s, max_bytes={self.max_bytes})"
+        )
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def sweep(self) -> Dict:
+        """
+        Run one sweep now
+
+        Returns:
+            Number of sessions and bytes removed by this sweep
+        """
+        with self._lock:
+            started = time.monotonic()
+            sessions = sorted(self.store.list_sessions())
+            protected = self.protect()
+            footprint = sum(size for _, size, _ in sessions)
+            expire_before = time.time() - self.ttl if self.ttl else None
+
+            removed = 0
+            removed_bytes = 0
+            remaining = 0
+            for last_used, size, session_id in sessions:
+                expired = expire_before is not None and last_used < expire_before
+                over_quota = self.max_bytes and footprint > self.max_bytes
+                if session_id in protected or not (expired or over_quota):
+                    remaining += 1
+                    continue
+                self.store.delete(session_id)
+                footprint -= size
+                removed += 1
+                removed_bytes += size
+
+            self.sessions = remaining
+            self.footprint_bytes = footprint
+            self.reclaimed_sessions += removed
+            self.reclaimed_bytes += removed_bytes
+            self.last_sweep_at = time.time()
+            self.last_sweep_seconds = round(time.monotonic() - started, 3)
+
+        if removed:
+            logger.info(
+                f"Session sweep removed {removed} sessions ({removed_bytes} bytes), "
+                f"{footprint} bytes remain"
+            )
+        return {"removed_sessions": removed, "removed_bytes": removed_bytes}
+
+    def stats(self) -> Dict:
+        """
+        Get the session footprint and what the sweeper has reclaimed
+
+        Returns:
+            Dictionary of sweeper statistics as of the last sweep
+        """
+        return {
+            "ttl_seconds": self.ttl,
+            "max_bytes": self.max_bytes,
+            "sessions": self.sessions,
+            "footprint_bytes": self.footprint_bytes,
+            "reclaimed_sessions": self.reclaimed_sessions,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_sweep_at": self.last_sweep_at,
+            "last_sweep_seconds": self.last_sweep_seconds,
+        }
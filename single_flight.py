@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import DEDUP_REQUESTS
+
+
+def prompt_digest(prompt: str) -> str:
+    """Short stable hash of a prompt for use in single-flight keys"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:32]
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Coalesce identical concurrent calls into one
+
+        While a call for a key is in flight, further calls with the same key
+        wait for its result instead of starting their own. Keys are forgotten
+        as soon as the call finishes, so this only deduplicates overlapping
+        requests (double-clicks, client retries), never caches results.
+
+        Must be used from coroutines running on the shared async runtime.
+
+        Args:
+            name: Label for stats and metrics, e.g. "image"
+        """
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run factory() for key, or join the identical call already running
+
+        Args:
+            key: Identifies identical calls
+            factory: Creates the coroutine doing the actual work
+
+        Returns:
+            The (shared) result; a failure is raised to every caller
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            outcome = "leader"
+        else:
+            outcome = "coalesced"
+        with self._lock:
+            if outcome == "leader":
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        DEDUP_REQUESTS.inc(call=self.name, outcome=outcome)
+        # A caller going away must not cancel the call others are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict:
+        """
+        Get dedup counters
+
+        Returns:
+            Dictionary with requests, coalesced requests, hit rate and the
+            number of calls currently in flight
+        """
+        with self._lock:
+            requests = self.leaders + self.coalesced
+            return {
+                "requests": requests,
+                "coalesced": self.coalesced,
+                "hit_rate": round(self.coalesced / requests, 4) if requests else 0.0,
+                "in_flight": len(self._in_flight),
+            }
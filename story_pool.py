@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from rate_limiter import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class StoryPool:
+    def __init__(self, openai_service, categories_service):
+        """
+        Initialize the pool of pre-generated stories
+
+        Stories are kept per (category, subcategory, num_slides). Taking a
+        story always schedules a background refill for that combination, so
+        combinations users actually pick stay warm.
+
+        Args:
+            openai_service: Service used to generate stories
+            categories_service: Catalog of categories and subcategories
+        """
+        self.openai_service = openai_service
+        self.categories_service = categories_service
+        self.size = int(os.getenv("STORY_POOL_SIZE", "0"))
+        self.ttl = int(os.getenv("STORY_POOL_TTL", "3600"))
+        self.warm_slides = [
+            int(value)
+            for value in os.getenv("STORY_POOL_WARM_SLIDES", "").split(",")
+            if value.strip()
+        ]
+        self.hits = 0
+        self.misses = 0
+        self._pools: Dict[Tuple[str, str, int], deque] = {}
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("STORY_POOL_WORKERS", "2")),
+            thread_name_prefix="story-pool",
+        )
+        logger.info(f"Story pool initialized with size {self.size}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def warm(self):
+        """Schedule refills for every catalog combination in STORY_POOL_WARM_SLIDES"""
+        if not self.enabled:
+            return
+        catalog = self.categories_service.get_all_categories()
+        for category, subcategories in catalog.items():
+            for subcategory in subcategories:
+                for num_slides in self.warm_slides:
+                    self._schedule_refill((category, subcategory, num_slides))
+
+    def take(
+        self, category: str, subcategory: str, num_slides: int
+    ) -> Optional[Tuple[str, Dict]]:
+        """
+        Pop a ready-made story and trigger a refill for its combination
+
+        Args:
+            category: The category name
+            subcategory: The subcategory name
+            num_slides: Number of slides requested
+
+        Returns:
+            Tuple of (prompt, story_data), or None if no fresh story is pooled
+        """
+        if not self.enabled:
+            return None
+
+        key = (category, subcategory, int(num_slides))
+        result = None
+        with self._lock:
+            pool = self._pools.setdefault(key, deque())
+            cutoff = time.time() - self.ttl
+            while pool and pool[0][0] < cutoff:
+                pool.popleft()
+            if pool:
+                _, prompt, story_data = pool.popleft()
+                result = (prompt, story_data)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        self._schedule_refill(key)
+        return result
+
+    def stats(self) -> Dict:
+        """
+        Get pool counters
+
+        Returns:
+            Dictionary with hits, misses and the number of pooled stories
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "combinations": len(self._pools),
+                "pooled_stories": sum(len(pool) for pool in self._pools.values()),
+                "refilling": len(self._refilling),
+            }
+
+    def _schedule_refill(self, key: Tuple[str, str, int]):
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+        self.executor.submit(self._refill, key)
+
+    def _refill(self, key: Tuple[str, str, int]):
+        category, subcategory, num_slides = key
+        try:
+            while True:
+                with self._lock:
+                    pool = self._pools.setdefault(key, deque())
+                    if len(pool) >= self.size:
+                        return
+                prompt, story_data = self.openai_service.generate_story(
+                    category, subcategory, num_slides, priority=PRIORITY_BACKGROUND
+                )
+                with self._lock:
+                    pool.append((time.time(), prompt, story_data))
+        except Exception as e:
+            logger.error(f"Story pool refill failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
@@ -0,0 +1,403 @@
+"""
+Typed schema of story responses
+
+Stories are validated slide by slide, so a response with a few missing or
+broken slides keeps its good ones and only the rest is regenerated.
+"""
+
+import re
+import json
+import logging
+from typing import Annotated, Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import AfterValidator, BaseModel, ValidationError
+
+from story_stream import SlideStreamParser
+
+logger = logging.getLogger(__name__)
+
+
+def _not_blank(value: str) -> str:
+    value = value.strip()
+    if not value:
+        raise ValueError("must not be empty")
+    return value
+
+
+Text = Annotated[str, AfterValidator(_not_blank)]
+
+
+class StorySlide(BaseModel):
+    slide_number: int
+    story_text: Text
+    image_prompt: Text
+
+
+class StoryCharacter(BaseModel):
+    name: Text
+    description: Text
+
+
+class Story(BaseModel):
+    story_title: str
+    category: str
+    subcategory: str
+    # Before the slides, so a streamed story has them before the first slide
+    characters: List[StoryCharacter]
+    slides: List[StorySlide]
+
+
+class StoryBeat(BaseModel):
+    slide_number: int
+    beat: str
+
+
+class StoryOutline(BaseModel):
+    story_title: str
+    category: str
+    subcategory: str
+    characters: List[StoryCharacter]
+    beats: List[StoryBeat]
+
+
+def strict_json_schema(model: Type[BaseModel]) -> Dict:
+    """
+    JSON schema of a model in the form strict structured outputs accept
+
+    Every object gets all of its properties required and no additional ones.
+
+    Args:
+        model: The pydantic model
+
+    Returns:
+        The schema as a dictionary
+    """
+
+    def close(node):
+        if isinstance(node, dict):
+            if node.get("type") == "object" and "properties" in node:
+                node["additionalProperties"] = False
+                node["required"] = list(node["properties"])
+            for value in node.values():
+                close(value)
+        elif isinstance(node, list):
+            for value in node:
+                close(value)
+
+    schema = model.model_json_schema()
+    close(schema)
+    return schema
+
+
+def response_format(model: Type[BaseModel], mode: str) -> Optional[Dict]:
+    """
+    The response_format parameter for a story completion
+
+    Args:
+        model: Schema of the expected response
+        mode: "json_schema", "json_object" or "text"
+
+    Returns:
+        The parameter value, or None to leave it out
+    """
+    if mode == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": model.__name__,
+                "schema": strict_json_schema(model),
+                "strict": True,
+            },
+        }
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+def decode_story_json(response_text: str) -> Dict:
+    """
+    Decode a story response, salvaging what it can from a broken one
+
+    Markdown fences and text around the JSON object are ignored. If the JSON
+    itself is truncated or malformed, the title, the characters and every
+    slide that decodes on its own are kept; a broken slide stands in the
+    slides as None, so validate_story lists it as missing.
+
+    Args:
+        response_text: Raw completion text
+
+    Returns:
+        The decoded response
+
+    Raises:
+        ValueError: If nothing usable could be recovered
+    """
+    text = response_text.strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start : end + 1])
+            if isinstance(data, dict):
+                return data
+        except json.JSONDecodeError:
+            pass
+
+    parser = SlideStreamParser()
+    parser.feed(text)
+    salvaged = [slide for slide in parser.slides if slide is not None]
+    if parser.story_title is None and not salvaged:
+        raise ValueError("Story response is not valid JSON")
+    logger.warning(
+        f"Story response is not valid JSON, salvaged {len(salvaged)} slides from it"
+    )
+    data = {"story_title": parser.story_title, "slides": parser.slides}
+    if parser.characters is not None:
+        data["characters"] = parser.characters
+    return data
+
+
+def parse_slide(raw: Any, default_number: Optional[int] = None) -> Optional[Dict]:
+    """
+    Validate one slide of a story response
+
+    Args:
+        raw: The slide as decoded from the response
+        default_number: Slide number to use if the slide has none
+
+    Returns:
+        The cleaned slide, or None if it is invalid
+    """
+    if not isinstance(raw, dict):
+        return None
+    if raw.get("slide_number") is None and default_number is not None:
+        raw = dict(raw, slide_number=default_number)
+    try:
+        slide = StorySlide.model_validate(raw)
+    except ValidationError:
+        return None
+    return dict(raw, **slide.model_dump())
+
+
+def parse_characters(raw: Any) -> List[Dict]:
+    """
+    Validate the characters section of a story or outline
+
+    Args:
+        raw: The section as decoded from the response
+
+    Returns:
+        The valid characters, each a dict with name and description;
+        invalid entries and repeated names are dropped
+    """
+    if not isinstance(raw, list):
+        return []
+    characters = []
+    names = set()
+    for item in raw:
+        try:
+            character = StoryCharacter.model_validate(item)
+        except ValidationError:
+            continue
+        if character.name.lower() not in names:
+            names.add(character.name.lower())
+            characters.append(character.model_dump())
+    return characters
+
+
+def characters_in(prompt: str, characters: List[Dict]) -> List[Dict]:
+    """
+    The characters an image prompt refers to
+
+    A character counts as named only if its full name appears in the prompt
+    as whole words, ignoring case and spacing. Parts of a name are never
+    matched on their own: "The Wise Owl" or "Mr Whiskers" would otherwise be
+    pulled into every prompt containing "the" or "Mr".
+
+    Args:
+        prompt: Slide image prompt
+        characters: The story's characters
+
+    Returns:
+        The named characters, in story order
+    """
+    named = []
+    for character in characters or []:
+        words = character.get("name", "").split()
+        if not words:
+            continue
+        pattern = r"\s+".join(re.escape(word) for word in words)
+        if re.search(rf"(?<!\w){pattern}(?!\w)", prompt, re.IGNORECASE):
+            named.append(character)
+    return named
+
+
+def session_characters(session_store, session_id: str) -> List[Dict]:
+    """
+    The characters of a session's story, finished or still being written
+
+    Args:
+        session_store: Store holding the session
+        session_id: The session
+
+    Returns:
+        The story's characters, or an empty list if it has none
+    """
+    for filename in ("story.json", "story_progress.json"):
+        story = session_store.read_json(session_id, filename)
+        if story is not None:
+            return parse_characters(story.get("characters"))
+    return []
+
+
+def validate_story(
+    data: Dict, category: str, subcategory: str, num_slides: int
+) -> Tuple[Dict, List[int]]:
+    """
+    Keep the valid slides of a story response and find the ones to redo
+
+    Args:
+        data: Decoded story response
+        category: Requested category, used if the response lacks one
+        subcategory: Requested subcategory, used if the response lacks one
+        num_slides: Number of slides the story must have
+
+    Returns:
+        (story, missing): the story with only its valid slides, in order, and
+        the numbers of the slides that are missing or invalid
+    """
+    raw_slides = data.get("slides")
+    if not isinstance(raw_slides, list):
+        raw_slides = []
+    slides = {}
+    for position, raw in enumerate(raw_slides):
+        slide = parse_slide(raw, position + 1)
+        number = slide["slide_number"] if slide else None
+        if number is not None and 1 <= number <= num_slides and number not in slides:
+            slides[number] = slide
+
+    story = dict(data)
+    story["story_title"] = (
+        str(data.get("story_title") or "").strip()
+        or subcategory.replace("_", " ").strip()
+        or "Story"
+    )
+    story["category"] = data.get("category") or category
+    story["subcategory"] = data.get("subcategory") or subcategory
+    story["characters"] = parse_characters(data.get("characters"))
+    story["slides"] = [slides[number] for number in sorted(slides)]
+    return story, missing_slides(story, num_slides)
+
+
+def missing_slides(story: Dict, num_slides: int) -> List[int]:
+    """Numbers of the slides a validated story still lacks"""
+    present = {slide["slide_number"] for slide in story["slides"]}
+    return [number for number in range(1, num_slides + 1) if number not in present]
+
+
+def add_slides(story: Dict, slides: List[Dict]) -> Dict:
+    """
+    Add regenerated slides to a story, keeping the slides in order
+
+    Args:
+        story: Story returned by validate_story
+        slides: Valid slides to add; existing slide numbers are replaced
+
+    Returns:
+        The updated story
+    """
+    by_number = {slide["slide_number"]: slide for slide in story["slides"]}
+    by_number.update({slide["slide_number"]: slide for slide in slides})
+    return dict(story, slides=[by_number[number] for number in sorted(by_number)])
+
+
+def part_slides(data: Dict, slide_numbers: List[int]) -> List[Dict]:
+    """
+    The valid slides of a response that was asked for the given slide numbers
+
+    Slides numbered from 1 within the part instead of within the story are
+    renumbered by position.
+
+    Args:
+        data: Decoded response of a story part
+        slide_numbers: The slide numbers the part was asked for
+
+    Returns:
+        The valid slides among slide_numbers
+    """
+    written = data.get("slides")
+    if not isinstance(written, list):
+        return []
+    by_number = {}
+    for raw in written:
+        if isinstance(raw, dict) and raw.get("slide_number") in slide_numbers:
+            by_number.setdefault(raw["slide_number"], raw)
+    slides = []
+    for position, number in enumerate(slide_numbers):
+        raw = by_number.get(number)
+        if raw is None and not by_number and position < len(written):
+            raw = written[position]
+        slide = parse_slide(raw)
+        if slide is not None:
+            slides.append(dict(slide, slide_number=number))
+    return slides
+
+
+def missing_runs(missing: List[int]) -> List[List[int]]:
+    """Group missing slide numbers into runs of consecutive numbers"""
+    runs: List[List[int]] = []
+    for number in sorted(missing):
+        if runs and runs[-1][-1] == number - 1:
+            runs[-1].append(number)
+        else:
+            runs.append([number])
+    return runs
+
+
+def repair_outline(story: Dict) -> Dict:
+    """
+    An outline for regenerating slides of a story that was written in one call
+
+    The story text of the valid slides stands in for their beats, so the
+    regenerated slides fit between their neighbours.
+    """
+    return {
+        "story_title": story["story_title"],
+        "category": story["category"],
+        "subcategory": story["subcategory"],
+        "characters": story.get("characters") or [],
+        "beats": [
+            {"slide_number": slide["slide_number"], "beat": slide["story_text"]}
+            for slide in story["slides"]
+        ],
+    }
+
+
+class InOrderSlides:
+    def __init__(self):
+        """
+        Release validated slides strictly in slide-number order
+
+        Slides that arrive early, or after an invalid one, are held back until
+        the gap before them is filled.
+        """
+        self.next_number = 1
+        self._pending: Dict[int, Dict] = {}
+
+    def add(self, slides: List[Dict]) -> List[Dict]:
+        """
+        Add valid slides and return the ones that can be released now
+
+        Args:
+            slides: Slides that passed validation
+
+        Returns:
+            Slides ready to be released, in order
+        """
+        for slide in slides:
+            if slide["slide_number"] >= self.next_number:
+                self._pending.setdefault(slide["slide_number"], slide)
+        ready = []
+        while self.next_number in self._pending:
+            ready.append(self._pending.pop(self.next_number))
+            self.next_number += 1
+        return ready
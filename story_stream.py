@@ -0,0 +1,101 @@
+import re
+import json
+from typing import Dict, List, Optional
+
+TITLE_PATTERN = re.compile(r'"story_title"\s*:\s*("(?:[^"\\]|\\.)*")')
+SLIDES_PATTERN = re.compile(r'"slides"\s*:\s*\[')
+CHARACTERS_PATTERN = re.compile(r'"characters"\s*:\s*(\[)')
+
+
+class SlideStreamParser:
+    def __init__(self):
+        """
+        Incrementally extract slides from a streamed story JSON response
+
+        Text is fed in as tokens arrive. Each element of the "slides" array is
+        decoded as soon as its closing brace is seen, so callers can act on a
+        slide while the model is still writing the next one. The title and
+        the "characters" array are available as soon as they are complete.
+
+        A slide object that is not valid JSON does not stop the parser: it
+        stands in the slides as None, so the slides after it keep their
+        positions and the broken one can be regenerated.
+        """
+        self.text = ""
+        self.story_title: Optional[str] = None
+        self.characters: Optional[List] = None
+        self.slides: List[Optional[Dict]] = []
+        self._pos = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self._finished = False
+
+    def feed(self, chunk: str) -> List[Optional[Dict]]:
+        """
+        Add streamed text and return the slides it completed
+
+        Args:
+            chunk: Next piece of the response text
+
+        Returns:
+            List of slide dictionaries completed by this chunk, in order, with
+            None for each slide object that could not be decoded
+        """
+        self.text += chunk
+
+        if self.story_title is None:
+            match = TITLE_PATTERN.search(self.text)
+            if match:
+                self.story_title = json.loads(match.group(1))
+
+        if self.characters is None:
+            match = CHARACTERS_PATTERN.search(self.text)
+            if match:
+                try:
+                    self.characters, _ = json.JSONDecoder().raw_decode(
+                        self.text, match.start(1)
+                    )
+                except json.JSONDecodeError:
+                    # Not complete yet
+                    pass
+
+        if self._pos is None:
+            match = SLIDES_PATTERN.search(self.text)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        slides = []
+        while self._pos < len(self.text) and not self._finished:
+            char = self.text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the slides array itself
+                    self._finished = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._object_start is not None:
+                        raw = self.text[self._object_start : self._pos + 1]
+                        try:
+                            slides.append(json.loads(raw))
+                        except json.JSONDecodeError:
+                            slides.append(None)
+                        self._object_start = None
+            self._pos += 1
+        self.slides.extend(slides)
+        return slides
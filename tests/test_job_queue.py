@@ -0,0 +1,139 @@
+import time
+
+import pytest
+
+import job_queue
+from job_queue import (
+    JOB_IMAGE,
+    JOB_STORY,
+    STATUS_CANCELLED,
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    JobQueue,
+)
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    monkeypatch.setenv("QUEUE_LEASE", "60")
+    monkeypatch.setenv("QUEUE_MAX_ATTEMPTS", "2")
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the time the queue sees"""
+    now = [time.time()]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+    return now
+
+
+def test_enqueue_is_idempotent_per_key(queue):
+    first = queue.enqueue("s1", JOB_IMAGE, "0", {"index": 0})
+    second = queue.enqueue("s1", JOB_IMAGE, "0", {"index": 0, "again": True})
+
+    assert first == second
+    assert queue.get(first)["payload"] == {"index": 0}
+    assert queue.enqueue("s2", JOB_IMAGE, "0", {"index": 0}) != first
+
+
+def test_claim_takes_the_highest_priority_job_first(queue):
+    queue.enqueue("s1", JOB_IMAGE, "1", {"index": 1}, priority=1)
+    story = queue.enqueue("s1", JOB_STORY, "story", {}, priority=0)
+
+    job = queue.claim("worker-a")
+
+    assert job["job_id"] == story
+    assert queue.get(story)["status"] == STATUS_RUNNING
+    assert job["attempts"] == 1
+
+
+def test_running_job_is_not_claimed_twice(queue):
+    queue.enqueue("s1", JOB_IMAGE, "0", {})
+
+    assert queue.claim("worker-a") is not None
+    assert queue.claim("worker-b") is None
+
+
+def test_expired_lease_is_claimed_again(queue, clock):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+
+    clock[0] += 61
+    job = queue.claim("worker-b")
+
+    assert job["job_id"] == job_id
+    assert job["attempts"] == 2
+    assert queue.get(job_id)["worker"] == "worker-b"
+
+
+def test_job_fails_once_its_attempts_are_used_up(queue, clock):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+    clock[0] += 61
+    queue.claim("worker-b")
+
+    clock[0] += 61
+    assert queue.claim("worker-c") is None
+    assert queue.get(job_id)["status"] == STATUS_FAILED
+
+
+def test_extended_lease_keeps_the_job_with_its_worker(queue, clock):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+
+    clock[0] += 50
+    assert queue.extend_lease(job_id, "worker-a")
+    clock[0] += 50
+
+    assert queue.claim("worker-b") is None
+    assert not queue.extend_lease(job_id, "worker-b")
+
+
+def test_lease_cannot_be_extended_after_another_worker_took_over(queue, clock):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+    clock[0] += 61
+    queue.claim("worker-b")
+
+    assert not queue.extend_lease(job_id, "worker-a")
+
+
+def test_failed_job_is_requeued_with_the_new_payload(queue):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {"try": 1})
+    queue.claim("worker-a")
+    queue.fail(job_id, "boom")
+
+    assert queue.enqueue("s1", JOB_IMAGE, "0", {"try": 2}) == job_id
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_QUEUED
+    assert job["payload"] == {"try": 2}
+    assert job["attempts"] == 0
+    assert job["error"] is None
+
+
+def test_done_job_is_not_requeued(queue):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+    queue.complete(job_id, {"filename": "story_image_0.jpg"})
+
+    queue.enqueue("s1", JOB_IMAGE, "0", {})
+
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_DONE
+    assert job["result"] == {"filename": "story_image_0.jpg"}
+
+
+def test_cancelled_job_stays_cancelled_when_its_worker_finishes(queue):
+    job_id = queue.enqueue("s1", JOB_IMAGE, "0", {})
+    queue.enqueue("s2", JOB_IMAGE, "0", {})
+    queue.claim("worker-a")
+
+    queue.cancel_session("s1")
+    queue.complete(job_id, {})
+
+    assert queue.is_cancelled(job_id)
+    assert queue.get(job_id)["status"] == STATUS_CANCELLED
+    assert queue.claim("worker-a")["session_id"] == "s2"
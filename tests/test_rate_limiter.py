@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucketStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    # 60 per minute with 2 seconds of burst: capacity 2, one token a second
+    return TokenBucketStore(str(tmp_path / "buckets.sqlite3"), burst_seconds=2)
+
+
+def test_bucket_allows_its_burst_then_asks_to_wait(buckets, clock):
+    limits = [("requests", 60)]
+
+    assert buckets.try_take(limits) == 0
+    assert buckets.try_take(limits) == 0
+    assert buckets.try_take(limits) == pytest.approx(1.0)
+
+
+def test_bucket_refills_over_time(buckets, clock):
+    limits = [("requests", 60)]
+    buckets.try_take(limits)
+    buckets.try_take(limits)
+
+    clock[0] += 0.5
+    assert buckets.try_take(limits) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert buckets.try_take(limits) == 0
+
+
+def test_refill_is_capped_at_the_burst(buckets, clock):
+    limits = [("requests", 60)]
+    buckets.try_take(limits)
+
+    clock[0] += 3600
+    assert buckets.levels()["requests"] == pytest.approx(1.0)
+    for _ in range(2):
+        assert buckets.try_take(limits) == 0
+    assert buckets.try_take(limits) > 0
+
+
+def test_tokens_are_taken_from_every_bucket_or_none(buckets, clock):
+    images = [("requests", 60), ("images", 30)]
+    # images: 0.5 a second, capacity 1
+    assert buckets.try_take(images) == 0
+
+    wait = buckets.try_take(images)
+
+    assert wait == pytest.approx(2.0)
+    # The request token was left alone because no image token was available
+    assert buckets.try_take([("requests", 60)]) == 0
+
+
+def test_buckets_are_shared_between_stores_on_one_database(tmp_path, clock):
+    path = str(tmp_path / "buckets.sqlite3")
+    first = TokenBucketStore(path, burst_seconds=1)
+    second = TokenBucketStore(path, burst_seconds=1)
+
+    assert first.try_take([("requests", 60)]) == 0
+    assert second.try_take([("requests", 60)]) > 0
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+def open_breaker(reset_timeout=0.05):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_open_breaker_fails_fast():
+    breaker = open_breaker(reset_timeout=60)
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    breaker = open_breaker()
+    time.sleep(0.06)
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_hedge_loser_is_closed(monkeypatch):
+    monkeypatch.setenv("OPENAI_HEDGE_PERCENTILE", "50")
+    monkeypatch.setenv("OPENAI_HEDGE_MIN_SAMPLES", "1")
+    caller = ResilientCaller("test", deadline=5)
+    caller.latencies.add(0.02)
+
+    class Result:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    results = []
+
+    def attempt(timeout):
+        result = Result()
+        results.append(result)
+        # The first request is the slow one
+        time.sleep(0.3 if len(results) == 1 else 0.05)
+        return result
+
+    winner = caller.call(attempt)
+    time.sleep(0.4)
+
+    assert caller.hedge_wins == 1
+    assert not winner.closed
+    assert [result.closed for result in results if result is not winner] == [True]
+
+
+def test_stream_callers_never_hedge(monkeypatch):
+    monkeypatch.setenv("OPENAI_HEDGE_PERCENTILE", "50")
+    monkeypatch.setenv("OPENAI_HEDGE_MIN_SAMPLES", "1")
+    caller = ResilientCaller("story_stream", deadline=5, hedge=False)
+    caller.latencies.add(0.02)
+
+    assert caller.hedge_after() is None
@@ -0,0 +1,134 @@
+from story_schema import (
+    InOrderSlides,
+    add_slides,
+    characters_in,
+    missing_runs,
+    parse_characters,
+    part_slides,
+    validate_story,
+)
+
+
+def slide(number, text="Text", prompt="Prompt"):
+    return {"slide_number": number, "story_text": text, "image_prompt": prompt}
+
+
+def test_validate_story_keeps_valid_slides_and_lists_the_rest():
+    data = {
+        "story_title": "Title",
+        "slides": [
+            slide(1),
+            slide(2, prompt="   "),
+            slide(2, text="Duplicate of a broken slide"),
+            slide(4),
+            slide(4, text="Duplicate"),
+            slide(9),
+            "not a slide",
+        ],
+    }
+
+    story, missing = validate_story(data, "Family", "Family_Adventures", 5)
+
+    assert [s["slide_number"] for s in story["slides"]] == [1, 2, 4]
+    assert story["slides"][1]["story_text"] == "Duplicate of a broken slide"
+    assert story["slides"][2]["story_text"] == "Text"
+    assert missing == [3, 5]
+
+
+def test_validate_story_numbers_slides_without_numbers_by_position():
+    data = {"slides": [{"story_text": "A", "image_prompt": "a"}, slide(2)]}
+
+    story, missing = validate_story(data, "Family", "Family_Adventures", 2)
+
+    assert [s["slide_number"] for s in story["slides"]] == [1, 2]
+    assert missing == []
+
+
+def test_validate_story_fills_in_missing_metadata():
+    story, _ = validate_story({"slides": []}, "Family", "Family_Adventures", 1)
+
+    assert story["story_title"] == "Family Adventures"
+    assert story["category"] == "Family"
+    assert story["characters"] == []
+
+
+def test_repaired_slides_complete_the_story_in_order():
+    story, missing = validate_story(
+        {"slides": [slide(1), slide(4)]}, "Family", "Family_Adventures", 4
+    )
+
+    story = add_slides(story, [slide(3), slide(2)])
+
+    assert missing == [2, 3]
+    assert [s["slide_number"] for s in story["slides"]] == [1, 2, 3, 4]
+
+
+def test_missing_runs_groups_consecutive_slides():
+    assert missing_runs([7, 2, 3, 5, 6]) == [[2, 3], [5, 6, 7]]
+    assert missing_runs([]) == []
+
+
+def test_part_slides_keeps_only_the_requested_numbers():
+    data = {"slides": [slide(5), slide(6, prompt=""), slide(9)]}
+
+    assert part_slides(data, [5, 6, 7]) == [slide(5)]
+
+
+def test_part_slides_renumbers_slides_numbered_within_the_part():
+    data = {"slides": [slide(1, text="Five"), slide(2, text="Six")]}
+
+    slides = part_slides(data, [5, 6])
+
+    assert [(s["slide_number"], s["story_text"]) for s in slides] == [
+        (5, "Five"),
+        (6, "Six"),
+    ]
+
+
+def test_part_slides_of_a_response_without_slides():
+    assert part_slides({"story_title": "Title"}, [1, 2]) == []
+
+
+def test_parse_characters_drops_invalid_and_repeated_entries():
+    raw = [
+        {"name": "Zed", "description": "A robot"},
+        {"name": "zed", "description": "Another robot"},
+        {"name": " ", "description": "Nameless"},
+        "Pip",
+    ]
+
+    assert parse_characters(raw) == [{"name": "Zed", "description": "A robot"}]
+
+
+CHARACTERS = [
+    {"name": "The Wise Owl", "description": "An owl"},
+    {"name": "Mr Whiskers", "description": "A cat"},
+    {"name": "Dr. Bolt", "description": "A scientist"},
+    {"name": "Zed", "description": "A robot"},
+]
+
+
+def names(prompt):
+    return [character["name"] for character in characters_in(prompt, CHARACTERS)]
+
+
+def test_characters_in_matches_full_names_ignoring_case_and_spacing():
+    prompt = "the wise  owl watches Dr. Bolt, mr whiskers and Zed."
+
+    assert names(prompt) == ["The Wise Owl", "Mr Whiskers", "Dr. Bolt", "Zed"]
+
+
+def test_characters_in_never_matches_part_of_a_name():
+    assert names("Mr. Sun shines on the meadow while Dr. Smith waves") == []
+
+
+def test_characters_in_needs_whole_words():
+    assert names("Zedd meets Dr. Boltzmann") == []
+
+
+def test_in_order_slides_holds_back_slides_after_a_gap():
+    in_order = InOrderSlides()
+
+    assert in_order.add([slide(2), slide(3)]) == []
+    assert in_order.add([slide(1)]) == [slide(1), slide(2), slide(3)]
+    assert in_order.add([slide(2)]) == []
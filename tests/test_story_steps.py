@@ -0,0 +1,120 @@
+import pytest
+
+import openai_service
+from openai_service import OpenAIService
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("IMAGE_CACHE_DIR", str(tmp_path / "images"))
+    return OpenAIService()
+
+
+def slide(number):
+    return {
+        "slide_number": number,
+        "story_text": f"Text {number}",
+        "image_prompt": f"Prompt {number}",
+    }
+
+
+def run_plan(steps, respond):
+    """Drive a plan like the services do, answering each batch with respond"""
+    batches = []
+    try:
+        batch = next(steps)
+        while True:
+            batches.append(batch)
+            batch = steps.send([respond(call, params) for call, params in batch])
+    except StopIteration as done:
+        return done.value, batches
+
+
+def test_single_call_story_repairs_only_missing_slides(service, monkeypatch):
+    monkeypatch.setattr(openai_service, "STORY_OUTLINE_MIN_SLIDES", 0)
+
+    def respond(call, params):
+        if call == "story":
+            return {"story_title": "Title", "slides": [slide(1), slide(4)]}
+        return {"slides": [slide(2), slide(3)]}
+
+    (prompt, story), batches = run_plan(
+        service.story_steps("Family", "Family_Adventures", 4), respond
+    )
+
+    assert [call for call, _ in batches[1]] == ["story_repair"]
+    assert "Write only slides 2 to 3" in batches[1][0][1]["messages"][-1]["content"]
+    assert [s["slide_number"] for s in story["slides"]] == [1, 2, 3, 4]
+    assert "Create a complete story" in prompt
+
+
+def test_outlined_story_expands_every_part_in_one_batch(service, monkeypatch):
+    monkeypatch.setattr(openai_service, "STORY_OUTLINE_MIN_SLIDES", 5)
+    monkeypatch.setattr(openai_service, "STORY_EXPAND_CHUNK", 3)
+    outline = {
+        "story_title": "Title",
+        "characters": [{"name": "Zed", "description": "A robot"}],
+        "beats": [{"slide_number": n, "beat": "Beat"} for n in range(1, 7)],
+    }
+
+    def respond(call, params):
+        if call == "story_outline":
+            return outline
+        if "Write only slides 1 to 3" in params["messages"][-1]["content"]:
+            return {"slides": [slide(1), slide(2), slide(3)]}
+        return {"slides": [slide(4), slide(5), slide(6)]}
+
+    (prompt, story), batches = run_plan(
+        service.story_steps("Family", "Family_Adventures", 6), respond
+    )
+
+    assert [[call for call, _ in batch] for batch in batches] == [
+        ["story_outline"],
+        ["story_expand", "story_expand"],
+    ]
+    assert [s["slide_number"] for s in story["slides"]] == list(range(1, 7))
+    assert story["characters"] == outline["characters"]
+    assert "Write only slides 4 to 6" in prompt
+
+
+def test_undecodable_part_is_repaired(service, monkeypatch):
+    monkeypatch.setattr(openai_service, "STORY_OUTLINE_MIN_SLIDES", 0)
+    responses = iter(
+        [
+            {"slides": [slide(1)]},
+            None,
+            {"slides": [slide(2)]},
+        ]
+    )
+
+    (_, story), batches = run_plan(
+        service.story_steps("Family", "Family_Adventures", 2),
+        lambda call, params: next(responses),
+    )
+
+    assert len(batches) == 3
+    assert [s["slide_number"] for s in story["slides"]] == [1, 2]
+
+
+def test_repair_gives_up_after_the_last_round(service, monkeypatch):
+    monkeypatch.setattr(openai_service, "STORY_REPAIR_ATTEMPTS", 2)
+    story, missing = openai_service.validate_story(
+        {"story_title": "Title", "slides": [slide(1)]}, "Family", "Family", 2
+    )
+
+    with pytest.raises(ValueError, match=r"missing slides \[2\]"):
+        run_plan(
+            service.repair_steps("Family", "Family", 2, story, missing),
+            lambda call, params: {"slides": []},
+        )
+
+
+def test_single_call_story_that_cannot_be_decoded(service, monkeypatch):
+    monkeypatch.setattr(openai_service, "STORY_OUTLINE_MIN_SLIDES", 0)
+
+    with pytest.raises(ValueError):
+        run_plan(
+            service.story_steps("Family", "Family_Adventures", 2),
+            lambda call, params: None,
+        )
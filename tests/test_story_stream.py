@@ -0,0 +1,139 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import openai_service
+from openai_service import OpenAIService
+from story_schema import decode_story_json, validate_story
+from story_stream import SlideStreamParser
+
+STORY = {
+    "story_title": 'The "Big" Day',
+    "category": "Family",
+    "subcategory": "Family_Adventures",
+    "characters": [{"name": "Zed", "description": "A small {green} robot"}],
+    "slides": [
+        {"slide_number": 1, "story_text": "Braces } in text", "image_prompt": "a"},
+        {"slide_number": 2, "story_text": 'Quote \\" and ]', "image_prompt": "b"},
+        {"slide_number": 3, "story_text": "End", "image_prompt": "c"},
+    ],
+}
+
+
+def with_broken_second_slide():
+    """The story as JSON, with a trailing comma inside its second slide"""
+    text = json.dumps(STORY)
+    second = json.dumps(STORY["slides"][1])
+    return text.replace(second, second[:-1] + ",}")
+
+
+def feed_in_chunks(parser, text, size):
+    slides = []
+    for start in range(0, len(text), size):
+        slides.extend(parser.feed(text[start : start + size]))
+    return slides
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_parser_returns_every_slide_whatever_the_chunking(size):
+    parser = SlideStreamParser()
+    slides = feed_in_chunks(parser, json.dumps(STORY, indent=2), size)
+
+    assert slides == STORY["slides"]
+    assert parser.story_title == STORY["story_title"]
+    assert parser.characters == STORY["characters"]
+
+
+def test_parser_releases_a_slide_as_soon_as_it_is_closed():
+    parser = SlideStreamParser()
+    text = json.dumps(STORY)
+    first_slide = json.dumps(STORY["slides"][0])
+    first_slide_end = text.index(first_slide) + len(first_slide)
+
+    assert parser.feed(text[: first_slide_end - 1]) == []
+    assert parser.feed(text[first_slide_end - 1 : first_slide_end]) == [
+        STORY["slides"][0]
+    ]
+
+
+def test_parser_waits_for_the_complete_characters_list():
+    parser = SlideStreamParser()
+    text = json.dumps(STORY)
+    parser.feed(text[: text.index("Zed") + 2])
+    assert parser.characters is None
+
+    parser.feed(text[text.index("Zed") + 2 :])
+    assert parser.characters == STORY["characters"]
+
+
+@pytest.mark.parametrize("size", [1, 1000])
+def test_parser_skips_a_malformed_slide(size):
+    parser = SlideStreamParser()
+    slides = feed_in_chunks(parser, with_broken_second_slide(), size)
+
+    assert slides == [STORY["slides"][0], None, STORY["slides"][2]]
+    assert parser.slides == slides
+
+
+def test_decode_salvages_the_slides_before_a_truncation():
+    text = "```json\n" + json.dumps(STORY)
+    truncated = text[: text.index('"slide_number": 3')]
+
+    data = decode_story_json(truncated)
+
+    assert data["story_title"] == STORY["story_title"]
+    assert data["slides"] == STORY["slides"][:2]
+
+
+def test_decode_keeps_the_slides_around_a_malformed_one():
+    data = decode_story_json(with_broken_second_slide())
+
+    assert data["slides"] == [STORY["slides"][0], None, STORY["slides"][2]]
+    assert data["characters"] == STORY["characters"]
+    _, missing = validate_story(data, "Family", "Family_Adventures", 3)
+    assert missing == [2]
+
+
+def test_stream_regenerates_a_malformed_slide(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("IMAGE_CACHE_DIR", str(tmp_path / "images"))
+    monkeypatch.setattr(openai_service, "STORY_OUTLINE_MIN_SLIDES", 0)
+    service = OpenAIService()
+    text = with_broken_second_slide()
+    repaired = {"slide_number": 2, "story_text": "Repaired", "image_prompt": "b"}
+
+    def create(stream=False, **params):
+        if stream:
+            return iter(
+                SimpleNamespace(
+                    usage=None,
+                    choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))],
+                )
+                for chunk in (text[i : i + 16] for i in range(0, len(text), 16))
+            )
+        message = SimpleNamespace(content=json.dumps({"slides": [repaired]}))
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(service.client.chat.completions, "create", create)
+
+    events = list(service.generate_story_stream("Family", "Family_Adventures", 3))
+
+    slides = [value for event, value in events if event == "slide"]
+    assert [s["slide_number"] for s in slides] == [1, 2, 3]
+    assert slides[1]["story_text"] == "Repaired"
+    _, (_, story) = events[-1]
+    assert [s["story_text"] for s in story["slides"]] == [
+        "Braces } in text",
+        "Repaired",
+        "End",
+    ]
+
+
+def test_decode_ignores_fences_around_valid_json():
+    assert decode_story_json("```json\n" + json.dumps(STORY) + "\n```") == STORY
+
+
+def test_decode_rejects_text_without_a_story():
+    with pytest.raises(ValueError):
+        decode_story_json("Sorry, I cannot help with that.")
@@ -0,0 +1,135 @@
+import pytest
+
+from job_queue import JOB_IMAGE, JobQueue
+from session_store import LocalSessionStore
+from worker import QueueWorker, enqueue_image, enqueue_story
+
+SESSION = "0123456789abcdef0123456789abcdef"
+
+
+def slide(number):
+    return {
+        "slide_number": number,
+        "story_text": f"Text {number}",
+        "image_prompt": f"Prompt {number}",
+    }
+
+
+class FakeStoryService:
+    """Writes stories without an API, recording what it was asked for"""
+
+    def __init__(self):
+        self.streamed = False
+        self.repaired = None
+
+    def generate_story_stream(self, category, subcategory, num_slides, session_id):
+        self.streamed = True
+        story = {
+            "story_title": "Title",
+            "category": category,
+            "subcategory": subcategory,
+            "characters": [],
+            "slides": [slide(n) for n in range(1, num_slides + 1)],
+        }
+        yield "prompt", "Prompt"
+        yield "title", story["story_title"]
+        yield "characters", []
+        for s in story["slides"]:
+            yield "slide", s
+        yield "story", ("Prompt", story)
+
+    def repair_story(
+        self, category, subcategory, num_slides, story, missing, session_id
+    ):
+        self.repaired = missing
+        slides = story["slides"] + [dict(slide(n), story_text="New") for n in missing]
+        return dict(story, slides=slides)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalSessionStore(str(tmp_path / "sessions"))
+
+
+class FakeStoryPool:
+    def __init__(self, story):
+        self.story = story
+
+    def take(self, category, subcategory, num_slides):
+        story, self.story = self.story, None
+        return story
+
+
+def run_story(queue, store, service, story_pool=None):
+    job = queue.get(enqueue_story(queue, SESSION, "Family", "Family_Adventures", 4))
+    worker = QueueWorker(queue, service, None, store, story_pool=story_pool)
+    return worker._run_story(job)
+
+
+def image_jobs(queue):
+    return {
+        job["payload"]["index"]: job
+        for job in queue.session_jobs(SESSION)
+        if job["kind"] == JOB_IMAGE
+    }
+
+
+def test_story_is_written_and_each_slide_image_queued(queue, store):
+    service = FakeStoryService()
+
+    result = run_story(queue, store, service)
+
+    assert result == {"base_prompt": "Prompt"}
+    assert store.read_json(SESSION, "story_progress.json")["prompt"] == "Prompt"
+    assert len(store.read_json(SESSION, "story.json")["slides"]) == 4
+    assert sorted(image_jobs(queue)) == [0, 1, 2, 3]
+
+
+def test_pooled_story_is_used_instead_of_writing_one(queue, store):
+    service = FakeStoryService()
+    pooled = {"story_title": "Pooled", "slides": [slide(n) for n in range(1, 5)]}
+
+    result = run_story(queue, store, service, FakeStoryPool(("Pooled prompt", pooled)))
+
+    assert not service.streamed
+    assert result == {"base_prompt": "Pooled prompt"}
+    assert store.read_json(SESSION, "story.json") == pooled
+    assert sorted(image_jobs(queue)) == [0, 1, 2, 3]
+
+
+def test_retried_story_keeps_the_slides_already_written(queue, store):
+    store.write_json(
+        SESSION,
+        "story_progress.json",
+        {
+            "prompt": "Prompt",
+            "story_title": "Title",
+            "category": "Family",
+            "subcategory": "Family_Adventures",
+            "characters": [],
+            "slides": [slide(1), slide(2)],
+        },
+    )
+    drawn = [enqueue_image(queue, SESSION, i, f"Prompt {i + 1}") for i in (0, 1)]
+    service = FakeStoryService()
+
+    result = run_story(queue, store, service)
+
+    story = store.read_json(SESSION, "story.json")
+    assert not service.streamed
+    assert service.repaired == [3, 4]
+    assert [s["story_text"] for s in story["slides"]] == [
+        "Text 1",
+        "Text 2",
+        "New",
+        "New",
+    ]
+    assert result == {"base_prompt": "Prompt"}
+    jobs = image_jobs(queue)
+    assert [jobs[0]["job_id"], jobs[1]["job_id"]] == drawn
+    assert sorted(jobs) == [0, 1, 2, 3]
@@ -0,0 +1,84 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _field(obj, *names, default=0):
+    for name in names:
+        if obj is None:
+            return default
+        obj = getattr(obj, name, None)
+    return obj if obj is not None else default
+
+
+class UsageTracker:
+    def __init__(self):
+        """Initialize per-call-type token counters"""
+        self.totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, call: str, usage) -> Optional[Dict[str, int]]:
+        """
+        Record the token usage reported for one API call
+
+        Handles both chat completion usage (prompt/completion tokens) and
+        image usage (input/output tokens).
+
+        Args:
+            call: Call type, e.g. "story" or "image"
+            usage: The usage object from the API response, if any
+
+        Returns:
+            Normalised token counts, or None if the response had no usage
+        """
+        if usage is None:
+            return None
+
+        counts = {
+            "input_tokens": _field(usage, "prompt_tokens")
+            or _field(usage, "input_tokens"),
+            "cached_input_tokens": _field(
+                usage, "prompt_tokens_details", "cached_tokens"
+            )
+            or _field(usage, "input_tokens_details", "cached_tokens"),
+            "output_tokens": _field(usage, "completion_tokens")
+            or _field(usage, "output_tokens"),
+        }
+        logger.info(f"{call} usage: {counts}")
+
+        with self._lock:
+            totals = self.totals.setdefault(
+                call,
+                {
+                    "calls": 0,
+                    "input_tokens": 0,
+                    "cached_input_tokens": 0,
+                    "output_tokens": 0,
+                },
+            )
+            totals["calls"] += 1
+            for key, value in counts.items():
+                totals[key] += value
+        return counts
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Get accumulated token counts per call type
+
+        Returns:
+            Dictionary of totals, including the share of cached input tokens
+        """
+        with self._lock:
+            return {
+                call: {
+                    **totals,
+                    "cached_input_ratio": (
+                        round(totals["cached_input_tokens"] / totals["input_tokens"], 4)
+                        if totals["input_tokens"]
+                        else 0.0
+                    ),
+                }
+                for call, totals in self.totals.items()
+            }
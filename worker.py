@@ -0,0 +1,382 @@
+"""
+Queue worker
+
+Claims story and image jobs from the durable job queue (job_queue.py) and
+writes their results into the session store, so web processes only enqueue
+work and serve fast requests. Run as many of these as the rate limits allow,
+on the host that keeps QUEUE_DB (SQLite in WAL mode, so never on a network
+filesystem) and the session store:
+
+    QUEUE_APP_WORKERS=0 gunicorn app:app      # web processes enqueue only
+    python worker.py --concurrency 8          # workers do the generation
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+import argparse
+
+from async_runtime import async_runtime
+from avatar_service import read_avatar_bytes
+from image_tiers import TIER_FINAL
+from job_queue import JOB_IMAGE, JOB_STORY, JobQueue
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_NORMAL, slide_priority
+from session_images import save_session_image
+from story_schema import session_characters, validate_story
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_story(
+    queue, session_id, category, subcategory, num_slides, tier=TIER_FINAL
+):
+    """Queue the story job of a session; its slide images use the given tier"""
+    return queue.enqueue(
+        session_id,
+        JOB_STORY,
+        "story",
+        {
+            "category": category,
+            "subcategory": subcategory,
+            "num_slides": num_slides,
+            "tier": tier,
+        },
+        priority=PRIORITY_INTERACTIVE,
+    )
+
+
+def enqueue_image(queue, session_id, index, prompt, tier=TIER_FINAL):
+    """Queue the image job of one slide"""
+    return queue.enqueue(
+        session_id,
+        JOB_IMAGE,
+        str(index),
+        {"index": index, "prompt": prompt, "tier": tier},
+        priority=slide_priority(index),
+    )
+
+
+def enqueue_upgrade(queue, session_id, index, prompt, filename, version):
+    """
+    Queue rendering a draft slide image again at the final tier
+
+    The draft stays in place until the final image replaces it. The job is
+    keyed by the draft's version, so a slide drafted again after an earlier
+    upgrade gets a new job instead of matching the finished one.
+    """
+    return queue.enqueue(
+        session_id,
+        JOB_IMAGE,
+        f"{filename}:{version}:{TIER_FINAL}",
+        {
+            "index": index,
+            "prompt": prompt,
+            "tier": TIER_FINAL,
+            "filename": filename,
+            "upgrade": True,
+        },
+        # Behind first renders, so drafts of other stories are not held up
+        priority=PRIORITY_NORMAL,
+    )
+
+
+class QueueWorker:
+    def __init__(
+        self,
+        queue,
+        openai_service,
+        async_openai_service,
+        session_store,
+        image_variants=None,
+        concurrency=None,
+        story_pool=None,
+    ):
+        """
+        Process queued jobs on the shared async runtime
+
+        Args:
+            queue: The JobQueue to claim jobs from
+            openai_service: Sync service, used for streamed story generation
+            async_openai_service: Async service used for images
+            session_store: Store the stories and images are written to
+            image_variants: Renders previews and thumbnails of saved images
+            concurrency: Jobs processed at once (defaults to the
+                QUEUE_WORKER_CONCURRENCY environment variable, or 4)
+            story_pool: Pool of ready-made stories taken before writing one
+        """
+        self.queue = queue
+        self.openai_service = openai_service
+        self.async_openai_service = async_openai_service
+        self.session_store = session_store
+        self.image_variants = image_variants
+        self.story_pool = story_pool
+        self.concurrency = concurrency or int(
+            os.getenv("QUEUE_WORKER_CONCURRENCY", "4")
+        )
+        self.poll_interval = float(os.getenv("QUEUE_POLL_INTERVAL", "0.5"))
+        self.retention = int(os.getenv("QUEUE_RETENTION", str(24 * 3600)))
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._future = None
+
+    def start(self):
+        """Start processing in the background if it is not running yet"""
+        if self._future is None:
+            self._future = async_runtime.submit(self.run())
+            logger.info(
+                f"Queue worker {self.name} started with concurrency {self.concurrency}"
+            )
+
+    async def run(self):
+        await asyncio.gather(
+            self._prune_loop(),
+            *(self._claim_loop() for _ in range(self.concurrency)),
+        )
+
+    async def _prune_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.queue.prune, self.retention)
+            except Exception as e:
+                logger.error(f"Queue prune failed: {e}")
+            await asyncio.sleep(600)
+
+    async def _claim_loop(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.name)
+            except Exception as e:
+                logger.error(f"Queue claim failed: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._run_job(job)
+
+    async def _heartbeat(self, job):
+        # Renew the lease well before it runs out, so a slow call is never
+        # claimed and paid for a second time by another worker
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await asyncio.to_thread(
+                    self.queue.extend_lease, job["job_id"], self.name
+                )
+            except Exception as e:
+                logger.error(f"Lease renewal of job {job['job_id']} failed: {e}")
+                continue
+            if not renewed:
+                return
+
+    async def _run_job(self, job):
+        started = time.time()
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            if job["kind"] == JOB_STORY:
+                result = await asyncio.to_thread(self._run_story, job)
+            elif job["kind"] == JOB_IMAGE:
+                result = await self._run_image(job)
+            else:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} ({job['kind']}) failed: {e}")
+            await asyncio.to_thread(self.queue.fail, job["job_id"], str(e))
+            return
+        finally:
+            heartbeat.cancel()
+        await asyncio.to_thread(self.queue.complete, job["job_id"], result)
+        logger.info(
+            f"Job {job['job_id']} ({job['kind']}) done in {time.time() - started:.1f}s"
+        )
+
+    def _run_story(self, job):
+        """Write the story slide by slide, queueing each slide's image right away"""
+        session_id = job["session_id"]
+        payload = job["payload"]
+        tier = payload.get("tier", TIER_FINAL)
+        saved = self.session_store.read_json(session_id, "story_progress.json")
+        if saved and saved.get("slides"):
+            return self._resume_story(job, saved)
+
+        pooled = self.story_pool and self.story_pool.take(
+            payload["category"], payload["subcategory"], payload["num_slides"]
+        )
+        if pooled:
+            prompt, story_data = pooled
+            return self._save_story(session_id, prompt, story_data, tier)
+
+        progress = {
+            "prompt": None,
+            "story_title": None,
+            "category": payload["category"],
+            "subcategory": payload["subcategory"],
+            "characters": [],
+            "slides": [],
+        }
+        for event, value in self.openai_service.generate_story_stream(
+            payload["category"],
+            payload["subcategory"],
+            payload["num_slides"],
+            session_id=session_id,
+        ):
+            if self.queue.is_cancelled(job["job_id"]):
+                return None
+            if event == "prompt":
+                # Saved with the title, for finishing the story on a retry
+                progress["prompt"] = value
+            elif event == "title":
+                progress["story_title"] = value
+                self.session_store.write_json(
+                    session_id, "story_progress.json", progress
+                )
+            elif event == "characters":
+                # Image jobs read them from here until story.json is written
+                progress["characters"] = value
+                self.session_store.write_json(
+                    session_id, "story_progress.json", progress
+                )
+            elif event == "slide":
+                index = len(progress["slides"])
+                progress["slides"].append(value)
+                self.session_store.write_json(
+                    session_id, "story_progress.json", progress
+                )
+                enqueue_image(
+                    self.queue, session_id, index, value.get("image_prompt", ""), tier
+                )
+            elif event == "story":
+                prompt, story_data = value
+                return self._save_story(session_id, prompt, story_data, tier)
+        return None
+
+    def _resume_story(self, job, progress):
+        """
+        Finish a story an earlier attempt stopped writing part way through
+
+        Its slides may already have images, which are keyed by slide index,
+        so they are kept and only the slides after them are written, to fit
+        the story so far.
+        """
+        session_id = job["session_id"]
+        payload = job["payload"]
+        story, missing = validate_story(
+            progress, payload["category"], payload["subcategory"], payload["num_slides"]
+        )
+        logger.info(
+            f"Resuming story of session {session_id} at slides {missing}, "
+            f"keeping {len(story['slides'])}"
+        )
+        story = self.openai_service.repair_story(
+            payload["category"],
+            payload["subcategory"],
+            payload["num_slides"],
+            story,
+            missing,
+            session_id=session_id,
+        )
+        if self.queue.is_cancelled(job["job_id"]):
+            return None
+        return self._save_story(
+            session_id, progress.get("prompt"), story, payload.get("tier", TIER_FINAL)
+        )
+
+    def _save_story(self, session_id, prompt, story_data, tier):
+        self.session_store.write_json(session_id, "story.json", story_data)
+        # Slides the streaming parser missed; already queued ones are kept
+        for index, slide in enumerate(story_data.get("slides", [])):
+            enqueue_image(
+                self.queue, session_id, index, slide.get("image_prompt", ""), tier
+            )
+        return {"base_prompt": prompt}
+
+    async def _run_image(self, job):
+        session_id = job["session_id"]
+        index = job["payload"]["index"]
+        tier = job["payload"].get("tier", TIER_FINAL)
+        avatar_bytes = await asyncio.to_thread(
+            read_avatar_bytes, self.session_store, session_id
+        )
+        if avatar_bytes is None:
+            raise ValueError("Avatar not found")
+        characters = await asyncio.to_thread(
+            session_characters, self.session_store, session_id
+        )
+
+        image_base64, image_prompt = await self.async_openai_service.generate_image(
+            avatar_bytes,
+            job["payload"]["prompt"],
+            session_id=session_id,
+            priority=job["priority"],
+            characters=characters,
+            tier=tier,
+        )
+        filename = job["payload"].get("filename") or f"story_image_{index}.jpg"
+        cancelled = await asyncio.to_thread(self.queue.is_cancelled, job["job_id"])
+        if not cancelled:
+            await asyncio.to_thread(
+                save_session_image,
+                self.session_store,
+                session_id,
+                filename,
+                image_base64,
+                tier,
+                self.image_variants,
+            )
+        return {"filename": filename, "prompt": image_prompt, "tier": tier}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process queued story and image jobs")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="jobs processed at once (default QUEUE_WORKER_CONCURRENCY or 4)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    # Imported here so the app can use QueueWorker without a second service
+    from async_openai_service import AsyncOpenAIService
+    from categories_service import CategoriesService
+    from image_variants import ImageVariants
+    from openai_service import OpenAIService
+    from session_store import create_session_store
+    from story_pool import StoryPool
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    args = parse_args(argv)
+    openai_service = OpenAIService()
+    session_store = create_session_store()
+    story_pool = StoryPool(openai_service, CategoriesService())
+    story_pool.warm()
+    worker = QueueWorker(
+        JobQueue(),
+        openai_service,
+        AsyncOpenAIService(openai_service),
+        session_store,
+        image_variants=ImageVariants(session_store),
+        concurrency=args.concurrency,
+        story_pool=story_pool,
+    )
+    logger.info(
+        f"Worker {worker.name} processing with concurrency {worker.concurrency}"
+    )
+    try:
+        async_runtime.submit(worker.run()).result()
+    except KeyboardInterrupt:
+        # Jobs in progress are picked up again once their lease runs out
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import zipfile
+from typing import Iterable, Iterator, Tuple, Union
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkWriter:
+    """Write-only, non-seekable file object that hands written bytes back out"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Union[str, bytes]]]) -> Iterator[bytes]:
+    """
+    Build a ZIP archive on the fly without holding it in memory
+
+    Entries are stored uncompressed (JPEGs do not shrink further), and because
+    the output is not seekable, zipfile writes sizes in data descriptors after
+    each member. Only one chunk of one file is buffered at a time.
+
+    Args:
+        entries: (archive name, file path or in-memory bytes) pairs
+
+    Yields:
+        Consecutive chunks of the ZIP archive
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, source in entries:
+            with archive.open(arcname, mode="w", force_zip64=True) as member:
+                if isinstance(source, bytes):
+                    member.write(source)
+                else:
+                    with open(source, "rb") as f:
+                        while True:
+                            chunk = f.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            member.write(chunk)
+                            data = writer.drain()
+                            if data:
+                                yield data
+            data = writer.drain()
+            if data:
+                yield data
+    yield writer.drain()